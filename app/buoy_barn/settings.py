@@ -231,6 +231,72 @@ PROXY_TIMEOUT_SECONDS = int(os.environ.get("PROXY_TIMEOUT_SECONDS", 30))  # noqa
 # When it isn't already defined by a model
 ERDDAP_TIMEOUT_SECONDS = int(os.environ.get("ERDDAP_TIMEOUT_SECONDS", 30))  # noqa: PLW1508
 
+# Should requests to ERDDAP servers use HTTP/2 when the server supports it (needs the h2 package)
+ERDDAP_HTTP2 = os.environ.get("ERDDAP_HTTP2", "false").lower() == "true"
+
+# Should observations only request rows since the last refresh, rather than the last 24 hours
+ERDDAP_INCREMENTAL_REFRESH = os.environ.get("ERDDAP_INCREMENTAL_REFRESH", "true").lower() == "true"
+
+# Longest URL to build when combining requests for multiple stations into one
+ERDDAP_MAX_URL_LENGTH = int(os.environ.get("ERDDAP_MAX_URL_LENGTH", 4000))  # noqa: PLW1508
+
+# How many seconds should ERDDAP servers stay slowed down after they ask us to back off
+ERDDAP_RATE_LIMIT_BACKOFF_SECONDS = int(os.environ.get("ERDDAP_RATE_LIMIT_BACKOFF_SECONDS", 10 * 60))  # noqa: PLW1508
+
+# How many times can the interval between requests to an ERDDAP server be doubled by backoffs
+ERDDAP_RATE_LIMIT_MAX_BACKOFF_LEVEL = int(os.environ.get("ERDDAP_RATE_LIMIT_MAX_BACKOFF_LEVEL", 6))  # noqa: PLW1508
+
+# How many timeouts or 403, 408, or 429 responses in a row open an ERDDAP server's circuit
+ERDDAP_CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get("ERDDAP_CIRCUIT_FAILURE_THRESHOLD", 5))  # noqa: PLW1508
+
+# How many seconds requests to an ERDDAP server are skipped for once its circuit opens
+ERDDAP_CIRCUIT_OPEN_SECONDS = int(os.environ.get("ERDDAP_CIRCUIT_OPEN_SECONDS", 5 * 60))  # noqa: PLW1508
+
+# How many of the most recent values to keep for each timeseries, for charts
+TIMESERIES_WINDOW_MAX_POINTS = int(os.environ.get("TIMESERIES_WINDOW_MAX_POINTS", 2000))  # noqa: PLW1508
+
+# How many seconds to keep the recent values of timeseries that are no longer refreshed
+TIMESERIES_WINDOW_EXPIRE_SECONDS = int(
+    os.environ.get("TIMESERIES_WINDOW_EXPIRE_SECONDS", 2 * 24 * 60 * 60),  # noqa: PLW1508
+)
+
+# How many minutes refreshes skip a group of timeseries after its request fails
+# in a way that will keep failing for a while, by `FailedRequest.Reason`. 0 keeps requesting it
+FAILED_REQUEST_TTL_MINUTES = {
+    "no_rows": 30,
+    "no_matching_time": 60,
+    "no_matching_station": 24 * 60,
+    "outside_range": 6 * 60,
+    "unrecognized_variable": 24 * 60,
+    "unrecognized_constraint": 24 * 60,
+    "unknown_dataset": 6 * 60,
+    "file_not_found": 6 * 60,
+}
+
+# Should refreshes keep the observations of timeseries in Postgres, with hourly and daily rollups
+OBSERVATION_HISTORY = os.environ.get("OBSERVATION_HISTORY", "false").lower() == "true"
+
+# How many months of raw observations to keep in the history store (rollups are kept). 0 keeps them all
+OBSERVATION_HISTORY_RETENTION_MONTHS = int(os.environ.get("OBSERVATION_HISTORY_RETENTION_MONTHS", 0))  # noqa: PLW1508
+
+# The MQTT subscriber refreshes a dataset once its change notifications have stopped
+# for this many seconds, or this many seconds after the first notification if they keep coming
+MQTT_CHANGE_QUIET_SECONDS = int(os.environ.get("MQTT_CHANGE_QUIET_SECONDS", 10))  # noqa: PLW1508
+MQTT_CHANGE_MAX_DELAY_SECONDS = int(os.environ.get("MQTT_CHANGE_MAX_DELAY_SECONDS", 60))  # noqa: PLW1508
+
+# How often the MQTT subscriber reloads the names of the server's datasets, in seconds
+MQTT_DATASET_INDEX_REFRESH_SECONDS = int(os.environ.get("MQTT_DATASET_INDEX_REFRESH_SECONDS", 60))  # noqa: PLW1508
+
+# How many seconds after a refresh changes values to rebuild the platform list snapshots,
+# so that refreshes finishing around the same time share a rebuild
+PLATFORM_SNAPSHOT_DELAY_SECONDS = int(os.environ.get("PLATFORM_SNAPSHOT_DELAY_SECONDS", 5))  # noqa: PLW1508
+
+# How many seconds platform list snapshots are kept, in case a rebuild after an edit is missed
+PLATFORM_SNAPSHOT_SECONDS = int(os.environ.get("PLATFORM_SNAPSHOT_SECONDS", 10 * 60))  # noqa: PLW1508
+
+# How many days of dataset refresh timings to keep
+REFRESH_RUN_RETENTION_DAYS = int(os.environ.get("REFRESH_RUN_RETENTION_DAYS", 14))  # noqa: PLW1508
+
 ASGI_APPLICATION = "buoy_barn.asgi.application"
 
 
@@ -290,11 +356,35 @@ CELERY_BROKER_URL = os.environ.get("CELERY_BROKER_URL")
 CELERY_TASK_TRACK_STARTED = True
 CELERY_TASK_TIME_LIMIT = 30 * 60
 
+# Refreshes are routed by who asked for them, see deployments.tasks.queue.
+# Workers take from the queues in the order that they are listed with `-Q`.
+CELERY_TASK_DEFAULT_QUEUE = "background"
+CELERY_TASK_ROUTES = ("deployments.tasks.queue.route_task",)
+CELERY_BROKER_TRANSPORT_OPTIONS = {"queue_order_strategy": "priority"}
+
+# How many seconds a task stays marked as queued if it never finishes,
+# before another of the same task can be queued
+TASK_QUEUED_TIMEOUT_SECONDS = int(
+    os.environ.get("TASK_QUEUED_TIMEOUT_SECONDS", 2 * CELERY_TASK_TIME_LIMIT),  # noqa: PLW1508
+)
+
 CELERY_BEAT_SCHEDULE = {
     "hourly_default_dataset_refresh": {
         "task": "deployments.tasks.periodic_refresh.hourly_default_dataset_refresh",
         "schedule": crontab(minute=5),
     },
+    "scheduled_dataset_refresh": {
+        "task": "deployments.tasks.periodic_refresh.scheduled_dataset_refresh",
+        "schedule": crontab(minute="*/5"),
+    },
+    "prune_refresh_runs": {
+        "task": "deployments.tasks.periodic_refresh.prune_refresh_runs",
+        "schedule": crontab(hour=4, minute=30),
+    },
+    "maintain_observation_history": {
+        "task": "deployments.tasks.periodic_refresh.maintain_observation_history",
+        "schedule": crontab(hour=4, minute=45),
+    },
 }
 
 if DEBUG:
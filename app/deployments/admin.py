@@ -6,7 +6,7 @@ from django.contrib.gis import admin
 from django.db.models.query import QuerySet
 from django.http.request import HttpRequest
 from django.utils import timezone
-from django.utils.html import format_html
+from django.utils.html import format_html, format_html_join
 from django.utils.safestring import mark_safe
 from django_object_actions import DjangoObjectActions, action
 
@@ -16,16 +16,24 @@ from .models import (
     DataType,
     ErddapDataset,
     ErddapServer,
+    FailedRequest,
     FloodLevel,
     MooringType,
     Platform,
     PlatformLink,
     Program,
     ProgramAttribution,
+    RefreshRun,
     StationType,
     TimeSeries,
 )
+from .models.refresh_run import STAGES
 from .tasks import refresh
+from .tasks.platform_snapshots import rebuild_after_commit
+from .tasks.queue import USER_QUEUE
+from .utils.circuit_breaker import CircuitState, circuit_state, reset_circuit
+from .utils.mqtt_notifications import notification_counts
+from .utils.refresh_progress import server_run_progress
 from .widgets import EsriOceanBasemapWidget
 
 
@@ -120,7 +128,7 @@ class TimeSeriesAdmin(admin.ModelAdmin):
             datasets_to_queue.add(ts.dataset.id)
 
         for dataset_id in datasets_to_queue:
-            refresh.refresh_dataset.delay(dataset_id)
+            refresh.refresh_dataset.delay(dataset_id, force=True, queue=USER_QUEUE)
 
         self.message_user(
             request,
@@ -353,7 +361,7 @@ class PlatformAdmin(DjangoObjectActions, admin.GISModelAdmin):
             datasets_to_queue.add(ts.dataset_id)
 
         for dataset_id in datasets_to_queue:
-            refresh.refresh_dataset.delay(dataset_id)
+            refresh.refresh_dataset.delay(dataset_id, force=True, queue=USER_QUEUE)
 
         self.message_user(
             request,
@@ -378,6 +386,7 @@ class PlatformAdmin(DjangoObjectActions, admin.GISModelAdmin):
             timeseries_to_update.append(ts)
 
         TimeSeries.objects.bulk_update(timeseries_to_update, ["active"])
+        rebuild_after_commit()
 
         self.message_user(
             request,
@@ -394,7 +403,7 @@ class PlatformAdmin(DjangoObjectActions, admin.GISModelAdmin):
                 datasets_to_queue.add(ts.dataset_id)
 
         for dataset_id in datasets_to_queue:
-            refresh.refresh_dataset.delay(dataset_id)
+            refresh.refresh_dataset.delay(dataset_id, force=True, queue=USER_QUEUE)
 
         self.message_user(
             request,
@@ -416,6 +425,7 @@ class PlatformAdmin(DjangoObjectActions, admin.GISModelAdmin):
 
         if timeseries:
             TimeSeries.objects.bulk_update(timeseries, ["end_time"])
+            rebuild_after_commit()
 
         self.message_user(
             request,
@@ -437,6 +447,7 @@ class PlatformAdmin(DjangoObjectActions, admin.GISModelAdmin):
                 timeseries.append(ts)
 
         TimeSeries.objects.bulk_update(timeseries, ["active"])
+        rebuild_after_commit()
 
         self.message_user(
             request,
@@ -455,6 +466,7 @@ class PlatformAdmin(DjangoObjectActions, admin.GISModelAdmin):
                 timeseries.append(ts)
 
         TimeSeries.objects.bulk_update(timeseries, ["active"])
+        rebuild_after_commit()
 
         self.message_user(
             request,
@@ -466,12 +478,60 @@ class PlatformAdmin(DjangoObjectActions, admin.GISModelAdmin):
 class ErddapServerAdmin(DjangoObjectActions, admin.ModelAdmin):
     ordering = ["name"]
 
-    actions = ["disable_timeseries", "enable_timeseries", "refresh_server"]
-    change_actions = ["refresh_erddap_server"]
+    list_display = ["__str__", "circuit"]
+    actions = ["disable_timeseries", "enable_timeseries", "refresh_server", "reset_circuits"]
+    change_actions = ["refresh_erddap_server", "reset_erddap_circuit"]
+    readonly_fields = ["refresh_progress", "circuit", "mqtt_notifications"]
+
+    @admin.display(description="Circuit")
+    def circuit(self, obj: ErddapServer) -> str:
+        state, open_seconds = circuit_state(obj)
+        if state == CircuitState.OPEN:
+            return f"Open, trying again in {open_seconds} seconds"
+        if state == CircuitState.HALF_OPEN:
+            return "Half-open, trying a request"
+        return "Closed"
+
+    @action(description="Reset the circuit for this server")
+    def reset_erddap_circuit(self, request, obj):
+        reset_circuit(obj)
+        self.message_user(request, f"Closed the circuit for server '{obj}'.")
+
+    @admin.action(description="Reset circuits for servers")
+    def reset_circuits(self, request, queryset):
+        servers = list(queryset)
+        for server in servers:
+            reset_circuit(server)
+
+        self.message_user(request, f"Closed the circuits for {len(servers)} servers")
+
+    @admin.display(description="Latest refresh progress")
+    def refresh_progress(self, obj: ErddapServer) -> str:
+        progress = server_run_progress(obj.id) if obj.id else None
+        if progress is None:
+            return "-"
+
+        started = datetime.fromtimestamp(progress["started"], tz=timezone.get_current_timezone())
+        return (
+            f"{progress['completed']} of {progress['total']} datasets refreshed, "
+            f"started {started:%Y-%m-%d %H:%M}"
+        )
+
+    @admin.display(description="MQTT notifications")
+    def mqtt_notifications(self, obj: ErddapServer) -> str:
+        counts = notification_counts(obj) if obj.id else None
+        if not counts:
+            return "-"
+
+        return (
+            f"{counts.get('messages', 0)} change notifications received "
+            f"({counts.get('unknown', 0)} for unknown datasets), "
+            f"{counts.get('refreshes', 0)} refreshes scheduled"
+        )
 
     @action(description="Refresh all datasets for this server")
     def refresh_erddap_server(self, request, obj):
-        refresh.refresh_server.delay(obj.id, healthcheck=False)
+        refresh.refresh_server.delay(obj.id, healthcheck=False, queue=USER_QUEUE)
         self.message_user(
             request,
             f"Queued all datasets for server '{obj}' to be refreshed.",
@@ -482,7 +542,7 @@ class ErddapServerAdmin(DjangoObjectActions, admin.ModelAdmin):
         queued_servers = []
 
         for server in queryset.iterator(chunk_size=100):
-            refresh.refresh_server.delay(server.id, healthcheck=False)
+            refresh.refresh_server.delay(server.id, healthcheck=False, queue=USER_QUEUE)
             queued_servers.append(server)
 
         self.message_user(
@@ -503,6 +563,7 @@ class ErddapServerAdmin(DjangoObjectActions, admin.ModelAdmin):
                     timeseries.append(ts)
 
         TimeSeries.objects.bulk_update(timeseries, ["active"])
+        rebuild_after_commit()
 
         self.message_user(
             request,
@@ -522,6 +583,7 @@ class ErddapServerAdmin(DjangoObjectActions, admin.ModelAdmin):
                     timeseries.append(ts)
 
         TimeSeries.objects.bulk_update(timeseries, ["active"])
+        rebuild_after_commit()
 
         self.message_user(
             request,
@@ -596,31 +658,45 @@ class ErddapDatasetAdmin(DjangoObjectActions, admin.ModelAdmin):
         day_ago = now - timedelta(days=1)
 
         last_refreshed = f"Last refreshed at: {obj.refresh_attempted:%Y-%m-%d %H:%M}"
+        if obj.time_coverage_end:
+            last_refreshed += f", data through: {obj.time_coverage_end:%Y-%m-%d %H:%M}"
+        if obj.next_refresh:
+            last_refreshed += f", next refresh: {obj.next_refresh:%Y-%m-%d %H:%M}"
+
+        if obj.refresh_result == ErddapDataset.RefreshResult.UNCHANGED:
+            result = "checked, unchanged"
+        elif obj.refresh_result == ErddapDataset.RefreshResult.REFRESHED:
+            result = "refreshed"
+        elif obj.refresh_result == ErddapDataset.RefreshResult.PARTIAL:
+            result = "partially refreshed"
+        else:
+            result = None
+
         if obj.refresh_attempted < day_ago:
-            return format_html(
-                "<span style='color: {};' title='{}'>{}</span>",
-                "red",
-                last_refreshed,
-                "More than 24 hours ago",
-            )
+            color, ago = "red", "More than 24 hours ago"
         elif obj.refresh_attempted < hour_ago:
-            return format_html(
-                "<span style='color: {};' title='{}'>{}</span>",
-                "yellow",
-                last_refreshed,
-                "More than 1 hour ago",
-            )
+            color, ago = "yellow", "More than 1 hour ago"
         else:
+            color, ago = "green", "Less than 1 hour ago"
+
+        if result:
             return format_html(
-                "<span style='color: {};' title='{}'>{}</span>",
-                "green",
+                "<span style='color: {};' title='{}'>{}</span> ({})",
+                color,
                 last_refreshed,
-                "Less than 1 hour ago",
+                ago,
+                result,
             )
+        return format_html(
+            "<span style='color: {};' title='{}'>{}</span>",
+            color,
+            last_refreshed,
+            ago,
+        )
 
     @action(description="Refresh this dataset")
     def refresh_erddap_dataset(self, request, obj):
-        refresh.refresh_dataset.delay(obj.id, healthcheck=False)
+        refresh.refresh_dataset.delay(obj.id, healthcheck=False, force=True, queue=USER_QUEUE)
         self.message_user(
             request,
             f"Queued dataset '{obj}' for refresh.",
@@ -631,7 +707,7 @@ class ErddapDatasetAdmin(DjangoObjectActions, admin.ModelAdmin):
         queued_datasets = []
 
         for dataset in queryset.iterator(chunk_size=100):
-            refresh.refresh_dataset.delay(dataset.id, healthcheck=False)
+            refresh.refresh_dataset.delay(dataset.id, healthcheck=False, force=True, queue=USER_QUEUE)
             queued_datasets.append(dataset)
 
         self.message_user(
@@ -651,6 +727,7 @@ class ErddapDatasetAdmin(DjangoObjectActions, admin.ModelAdmin):
                 timeseries.append(ts)
 
         TimeSeries.objects.bulk_update(timeseries, ["active"])
+        rebuild_after_commit()
 
         self.message_user(
             request,
@@ -669,6 +746,7 @@ class ErddapDatasetAdmin(DjangoObjectActions, admin.ModelAdmin):
                 timeseries.append(ts)
 
         TimeSeries.objects.bulk_update(timeseries, ["active"])
+        rebuild_after_commit()
 
         self.message_user(
             request,
@@ -676,6 +754,122 @@ class ErddapDatasetAdmin(DjangoObjectActions, admin.ModelAdmin):
         )
 
 
+@admin.register(RefreshRun)
+class RefreshRunAdmin(admin.ModelAdmin):
+    """Timings recorded for each dataset refresh, to find where refreshes are slow"""
+
+    date_hierarchy = "started"
+    search_fields = ["dataset__name", "dataset__server__name"]
+    list_display = [
+        "dataset",
+        "started",
+        "result",
+        "duration",
+        "wait_seconds",
+        "fetch_seconds",
+        "parse_seconds",
+        "extrema_seconds",
+        "save_seconds",
+        "bytes_downloaded",
+        "rows",
+        "error_count",
+        "backoff_level",
+    ]
+    list_filter = ["result", "dataset__server__name", "backoff_level"]
+    list_select_related = ["dataset", "dataset__server"]
+
+    def get_readonly_fields(self, request: HttpRequest, obj=None) -> list[str]:
+        return [field.name for field in self.model._meta.fields] + ["group_timings"]
+
+    def get_fields(self, request: HttpRequest, obj=None) -> list[str]:
+        hidden = {"id", "groups"}
+        return [field for field in self.get_readonly_fields(request, obj) if field not in hidden]
+
+    def has_add_permission(self, request: HttpRequest) -> bool:
+        return False
+
+    def has_change_permission(self, request: HttpRequest, obj=None) -> bool:
+        return False
+
+    @admin.display(description="Duration", ordering="duration_seconds")
+    def duration(self, obj: RefreshRun) -> str:
+        return f"{obj.duration_seconds:.1f}s"
+
+    @admin.display(description="Group timings (slowest first)")
+    def group_timings(self, obj: RefreshRun):
+        rows = [
+            (
+                group["group"],
+                *(f"{group[stage]:.2f}" for stage in STAGES),
+                group["bytes"],
+                group["rows"],
+            )
+            for group in obj.groups
+        ]
+        return format_html(
+            "<table><tr><th>Group</th>{}<th>bytes</th><th>rows</th></tr>{}</table>",
+            format_html_join("", "<th>{}</th>", ((stage,) for stage in STAGES)),
+            format_html_join("", "<tr>" + "<td>{}</td>" * (len(STAGES) + 3) + "</tr>", rows),
+        )
+
+
+class FailedRequestActiveFilter(SimpleListFilter):
+    title = "Active"
+    parameter_name = "active"
+
+    def lookups(self, request, model_admin):
+        return [("yes", "Still skipped"), ("no", "Expired")]
+
+    def queryset(self, request, queryset):
+        if self.value() == "yes":
+            return queryset.active()
+        if self.value() == "no":
+            return queryset.exclude(expires__gt=timezone.now())
+        return queryset
+
+
+@admin.register(FailedRequest)
+class FailedRequestAdmin(admin.ModelAdmin):
+    """Groups of timeseries that refreshes skip until their failures expire"""
+
+    actions = ["clear_failures"]
+    date_hierarchy = "last_failed"
+    search_fields = ["dataset__name", "dataset__server__name", "message"]
+    list_display = [
+        "dataset",
+        "constraints",
+        "variables",
+        "reason",
+        "failures",
+        "last_failed",
+        "expires",
+        "active",
+    ]
+    list_filter = [FailedRequestActiveFilter, "reason", "dataset__server__name"]
+    list_select_related = ["dataset", "dataset__server"]
+
+    def get_readonly_fields(self, request: HttpRequest, obj=None) -> list[str]:
+        return [field.name for field in self.model._meta.fields]
+
+    def has_add_permission(self, request: HttpRequest) -> bool:
+        return False
+
+    def has_change_permission(self, request: HttpRequest, obj=None) -> bool:
+        return False
+
+    @admin.display(boolean=True, description="Still skipped")
+    def active(self, obj: FailedRequest) -> bool:
+        return obj.active
+
+    @admin.action(
+        description="Clear selected failures, so they are requested on the next refresh",
+        permissions=["delete"],
+    )
+    def clear_failures(self, request, queryset):
+        deleted, _ = queryset.delete()
+        self.message_user(request, f"Cleared {deleted} failed requests.")
+
+
 @admin.register(DataType)
 class DataTypeAdmin(admin.ModelAdmin):
     search_fields = ["short_name", "standard_name", "long_name", "units"]
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class DeploymentsConfig(AppConfig):
     name = "deployments"
+
+    def ready(self):
+        from . import signals  # noqa: F401, PLC0415
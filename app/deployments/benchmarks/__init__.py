@@ -0,0 +1,4 @@
+"""Benchmarks for the refresh pipeline
+
+Run with `python manage.py benchmark <name>`.
+"""
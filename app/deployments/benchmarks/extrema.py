@@ -0,0 +1,55 @@
+"""Compare calculating extrema for each timeseries in a group with pandas,
+against calculating them for the whole group at once with `group_extrema`
+"""
+
+from deployments import standard_names
+from deployments.models import DataType, TimeSeries
+from deployments.tasks.extrema import group_extrema
+from deployments.utils.erddap_datasets import parse_csvp, sort_dataframe
+from deployments.utils.group_arrays import GroupArrays
+
+from . import legacy
+from .timing import time_calls
+
+
+def group_timeseries(variables: list[str]) -> list[TimeSeries]:
+    """Unsaved timeseries for each variable, with the first treated as water level to find tides"""
+    return [
+        TimeSeries(
+            variable=variable,
+            data_type=DataType(
+                standard_name=standard_names.WATER_LEVEL[0] if index == 0 else variable,
+            ),
+        )
+        for index, variable in enumerate(variables)
+    ]
+
+
+def run(response: bytes, variables: list[str], repeat: int) -> dict[str, float]:
+    """Returns the median seconds per timeseries for each path,
+    using the first station's rows as a refresh group
+    """
+    erddap_df = parse_csvp(response, variables, string_variables=["station"])
+    erddap_df = sort_dataframe(erddap_df, "benchmark")
+    if "station" in erddap_df:
+        erddap_df = erddap_df[erddap_df["station"] == erddap_df["station"].iloc[0]]
+
+    timeseries = group_timeseries(variables)
+
+    def per_series():
+        return [
+            legacy.extrema_for_timeseries(ts, legacy.filter_dataframe(erddap_df, ts.variable))
+            for ts in timeseries
+        ]
+
+    def batch():
+        return group_extrema(GroupArrays.from_dataframe(erddap_df, variables), timeseries)
+
+    results = time_calls(
+        {
+            "pandas per series": per_series,
+            "group_extrema": batch,
+        },
+        repeat,
+    )
+    return {name: seconds / len(timeseries) for name, seconds in results.items()}
@@ -0,0 +1,289 @@
+"""A local stand-in for an ERDDAP server, to refresh against without the network
+
+`FakeErddap` serves generated data on a random local port from a background thread:
+
+- `tabledap/<dataset>.csvp` and `.nc`, with a row every `interval_minutes` for each
+  requested station and variable, honoring `time>=`, `time<=`, and `station=` or `station=~`
+  constraints. Requests without a station constraint are for a single station.
+- `info/<dataset>/index.csv`, with `time_coverage_start`, `time_coverage_end`,
+  and the grid resolution.
+- `griddap/<dataset>.json`, with hourly values for the next 3 days.
+
+Each response waits `latency_seconds` (with up to `jitter_seconds` more), and can be
+replaced with a 408, 429, or 500 error at the rates in `error_rates`, using the same
+response text as ERDDAP so that `error_handling` treats them the same way.
+"""
+
+import json
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import UTC, datetime, timedelta
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlsplit
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from .responses import NDBC_MET_VARIABLES
+
+logger = logging.getLogger(__name__)
+
+ERROR_TEXT = {
+    HTTPStatus.REQUEST_TIMEOUT: (
+        'Error {\n    code=408;\n    message="Request Timeout: TimeoutException: '
+        'Timeout waiting for the server to respond";\n}\n'
+    ),
+    HTTPStatus.TOO_MANY_REQUESTS: (
+        'Error {\n    code=429;\n    message="Too Many Requests: '
+        'You have made too many requests recently";\n}\n'
+    ),
+    HTTPStatus.INTERNAL_SERVER_ERROR: (
+        'Error {\n    code=500;\n    message="Internal Server Error: '
+        'java.lang.NullPointerException";\n}\n'
+    ),
+}
+NO_ROWS_TEXT = (
+    'Error {\n    code=404;\n    message="Not Found: Your query produced no matching results. '
+    '(nRows = 0)";\n}\n'
+)
+
+FIRST_STATION = 41000
+FORECAST_HOURS = 3 * 24
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+@dataclass
+class FakeErddapConfig:
+    """How the fake server behaves
+
+    `stations` is how many stations each dataset has, and `interval_minutes`
+    how often they have a row, which together set the size of responses.
+    """
+
+    latency_seconds: float = 0.05
+    jitter_seconds: float = 0.0
+    stations: int = 200
+    interval_minutes: int = 10
+    error_rates: dict[int, float] = field(default_factory=dict)
+    seed: int = 0
+
+
+def station_ids(stations: int) -> list[str]:
+    return [str(FIRST_STATION + station) for station in range(stations)]
+
+
+def parse_time(value: str) -> datetime:
+    """ERDDAP accepts times as ISO 8601 strings or seconds since the epoch"""
+    value = value.strip('"')
+    try:
+        return datetime.fromtimestamp(float(value), tz=UTC)
+    except ValueError:
+        return pd.to_datetime(value, utc=True).to_pydatetime()
+
+
+def parse_tabledap_query(query: str) -> tuple[list[str], dict[str, str]]:
+    """Split a tabledap query into the requested variables and the constraints"""
+    parts = unquote(query).split("&")
+    variables = [variable for variable in parts[0].split(",") if variable]
+    constraints = {}
+
+    for part in parts[1:]:
+        for operator in ("=~", ">=", "<=", "!=", "=", ">", "<"):
+            name, found, value = part.partition(operator)
+            if found:
+                constraints[name + operator] = value.strip('"')
+                break
+
+    return variables, constraints
+
+
+class FakeErddap:
+    """Serve fake ERDDAP responses from a background thread.
+
+    Use as a context manager, or call `start()` and `stop()`.
+    """
+
+    def __init__(self, config: FakeErddapConfig | None = None):
+        self.config = config or FakeErddapConfig()
+        self.requests: Counter[int] = Counter()
+        self._rng = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+        self._server: ThreadingHTTPServer | None = None
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/erddap"
+
+    def start(self) -> "FakeErddap":
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                fake.handle(self)
+
+            def log_message(self, fmt, *args):
+                logger.debug(fmt, *args)
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self) -> "FakeErddap":
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def injected_error(self) -> HTTPStatus | None:
+        """Pick an error to respond with, at the configured rates"""
+        with self._lock:
+            roll = self._rng.random()
+            jitter = self._rng.random() * self.config.jitter_seconds
+
+        time.sleep(self.config.latency_seconds + jitter)
+
+        for status, rate in self.config.error_rates.items():
+            if roll < rate:
+                return HTTPStatus(status)
+            roll -= rate
+        return None
+
+    def handle(self, request: BaseHTTPRequestHandler):
+        url = urlsplit(request.path)
+        path = url.path.removeprefix("/erddap/")
+
+        error = self.injected_error()
+        if error is not None:
+            self.respond(request, error, ERROR_TEXT[error].encode(), "text/plain")
+            return
+
+        try:
+            if path.startswith("tabledap/"):
+                response = path.rpartition(".")[2]
+                status, body, content_type = self.tabledap(response, url.query)
+            elif path.startswith("info/"):
+                status, body, content_type = self.info()
+            elif path.startswith("griddap/"):
+                status, body, content_type = self.griddap(url.query)
+            else:
+                status, body, content_type = HTTPStatus.NOT_FOUND, b"Not Found", "text/plain"
+        except Exception as error:
+            logger.exception(f"Fake ERDDAP couldn't respond to {request.path}")
+            status, body, content_type = (
+                HTTPStatus.INTERNAL_SERVER_ERROR,
+                f'Error {{\n    code=500;\n    message="{error}";\n}}\n'.encode(),
+                "text/plain",
+            )
+
+        self.respond(request, status, body, content_type)
+
+    def respond(self, request: BaseHTTPRequestHandler, status: int, body: bytes, content_type: str):
+        with self._lock:
+            self.requests[status] += 1
+
+        request.send_response(status)
+        request.send_header("Content-Type", content_type)
+        request.send_header("Content-Length", str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+    def latest_time(self) -> datetime:
+        """The time of the newest row, on the configured interval"""
+        interval = self.config.interval_minutes * 60
+        now = datetime.now(UTC).timestamp()
+        return datetime.fromtimestamp(now - now % interval, tz=UTC)
+
+    def rows(self, variables: list[str], constraints: dict[str, str]) -> pd.DataFrame:
+        """Generate the rows for a tabledap request"""
+        end = self.latest_time()
+        if "time<=" in constraints:
+            end = min(end, parse_time(constraints["time<="]))
+        start = parse_time(constraints["time>="]) if "time>=" in constraints else end - timedelta(days=1)
+
+        interval = timedelta(minutes=self.config.interval_minutes)
+        times = pd.date_range(pd.Timestamp(start).tz_convert(UTC).ceil(interval), end, freq=interval)
+
+        if "station=~" in constraints:
+            stations = constraints["station=~"].split("|")
+        elif "station=" in constraints:
+            stations = [constraints["station="]]
+        else:
+            stations = station_ids(1)
+        stations = [station for station in stations if station in set(station_ids(self.config.stations))]
+
+        columns = {}
+        station_column = np.repeat(stations, len(times))
+        # Values follow the time and station, so that repeated requests agree
+        hours = np.tile(times.asi8 / 3.6e12, len(stations))
+        offsets = station_column.astype(int) % 50 / 10
+        for index, variable in enumerate(variables):
+            if variable == "time":
+                columns["time (UTC)"] = np.tile(times.strftime(TIME_FORMAT), len(stations))
+            elif variable == "station":
+                columns["station"] = station_column
+            else:
+                units = NDBC_MET_VARIABLES.get(variable, "1")
+                values = 10 + index + np.sin(hours / 12.42 * 2 * np.pi) + offsets
+                columns[f"{variable} ({units})"] = np.round(values, 2)
+
+        return pd.DataFrame(columns)
+
+    def tabledap(self, response: str, query: str) -> tuple[int, bytes, str]:
+        variables, constraints = parse_tabledap_query(query)
+        rows = self.rows(variables, constraints)
+
+        if rows.empty:
+            return HTTPStatus.NOT_FOUND, NO_ROWS_TEXT.encode(), "text/plain"
+
+        if response == "nc":
+            ds = xr.Dataset(
+                {name.split(" ")[0]: ("row", rows[name].to_numpy()) for name in rows.columns},
+            )
+            return HTTPStatus.OK, bytes(ds.to_netcdf()), "application/x-netcdf"
+
+        return HTTPStatus.OK, rows.to_csv(index=False).encode(), "text/csv"
+
+    def info(self) -> tuple[int, bytes, str]:
+        end = self.latest_time()
+        attributes = [
+            ("time_coverage_start", "String", (end - timedelta(days=30)).strftime(TIME_FORMAT)),
+            ("time_coverage_end", "String", (end + timedelta(days=3)).strftime(TIME_FORMAT)),
+            ("geospatial_lat_resolution", "double", "0.01"),
+            ("geospatial_lon_resolution", "double", "0.01"),
+        ]
+        info = pd.DataFrame(
+            [("attribute", "NC_GLOBAL", *attribute) for attribute in attributes],
+            columns=["Row Type", "Variable Name", "Attribute Name", "Data Type", "Value"],
+        )
+        return HTTPStatus.OK, info.to_csv(index=False).encode(), "text/csv"
+
+    def griddap(self, query: str) -> tuple[int, bytes, str]:
+        variables = [part.split("[")[0] for part in unquote(query).split(",")]
+        start = self.latest_time().replace(minute=0)
+        times = [start + timedelta(hours=hour) for hour in range(FORECAST_HOURS)]
+
+        table = {
+            "columnNames": ["time", "latitude", "longitude", *variables],
+            "columnTypes": ["String", "float", "float", *["float"] * len(variables)],
+            "rows": [
+                [step.strftime(TIME_FORMAT), 43.0, -70.0, *[10 + hour % 24 / 4] * len(variables)]
+                for hour, step in enumerate(times)
+            ],
+        }
+        return HTTPStatus.OK, json.dumps({"table": table}).encode(), "application/json"
@@ -0,0 +1,31 @@
+"""Compare parsing a tabledap response with erddapy's generic CSV path against `parse_csvp`"""
+
+from deployments.utils.erddap_datasets import parse_csvp, sort_dataframe
+from deployments.utils.group_arrays import GroupArrays
+
+from . import legacy
+from .timing import time_calls
+
+
+def legacy_path(response: bytes, variables: list[str]):
+    """Reading with inferred types, then filtering and parsing time for each variable"""
+    erddap_df = legacy.read_response(response)
+    return [legacy.filter_dataframe(erddap_df, variable) for variable in variables]
+
+
+def typed_path(response: bytes, variables: list[str]):
+    """Parsing with the fixed schema, and splitting into arrays once"""
+    erddap_df = sort_dataframe(parse_csvp(response, variables), "benchmark")
+    arrays = GroupArrays.from_dataframe(erddap_df, variables)
+    return [arrays.series(variable) for variable in variables]
+
+
+def run(response: bytes, variables: list[str], repeat: int) -> dict[str, float]:
+    """Returns the median seconds for each path"""
+    return time_calls(
+        {
+            "erddapy read_csv": lambda: legacy_path(response, variables),
+            "parse_csvp": lambda: typed_path(response, variables),
+        },
+        repeat,
+    )
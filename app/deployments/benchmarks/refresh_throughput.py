@@ -0,0 +1,199 @@
+"""Refresh datasets end to end against a fake ERDDAP server, and measure their throughput
+
+Datasets shaped like `cwwcNDBCMet` are created with a timeseries for each station
+and variable, pointing at a `FakeErddap`. Then one of the scenarios is run with
+Celery tasks run in process:
+
+- `dataset`: `refresh_dataset` for each dataset, one after another
+- `server`: `refresh_server`, which fans the datasets out into a task each
+- `sweep`: `hourly_default_dataset_refresh`, as the hourly beat would
+
+Group latencies come from the `RefreshRun` recorded for each dataset refresh,
+so they include waiting for the rate limit, fetching, parsing, extrema, and saving.
+
+As this creates and refreshes models, it should be run against a test database,
+as `manage.py benchmark_refresh` does.
+"""
+
+import resource
+import statistics
+import time
+from collections import Counter
+from collections.abc import Callable
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+from buoy_barn.celery import app as celery_app
+from django.db import transaction
+from django.db.models import Max
+
+from deployments.models import (
+    DataType,
+    ErddapDataset,
+    ErddapServer,
+    FailedRequest,
+    Platform,
+    RefreshRun,
+    TimeSeries,
+)
+from deployments.models.refresh_run import STAGES
+from deployments.tasks import periodic_refresh, refresh
+from deployments.utils.circuit_breaker import reset_circuit
+from deployments.utils.erddap_datasets import clear_window, window_key
+from deployments.utils.rate_limit import reset_rate_limit
+
+from .fake_erddap import FakeErddap, station_ids
+from .responses import NDBC_MET_VARIABLES
+
+
+@dataclass
+class ThroughputResult:
+    scenario: str
+    seconds: float
+    group_latencies: list[float]
+    requests: Counter
+    peak_rss_mb: float
+
+    @property
+    def groups(self) -> int:
+        return len(self.group_latencies)
+
+    @property
+    def groups_per_second(self) -> float:
+        return self.groups / self.seconds if self.seconds else 0
+
+    def latency_percentile(self, percent: int) -> float:
+        if len(self.group_latencies) < 2:  # noqa: PLR2004
+            return self.group_latencies[0] if self.group_latencies else 0
+        return statistics.quantiles(self.group_latencies, n=100)[percent - 1]
+
+
+@contextmanager
+def eager_tasks():
+    """Run Celery tasks and chains in process, rather than sending them to the broker"""
+    celery_app.conf.task_always_eager = True
+    try:
+        yield
+    finally:
+        celery_app.conf.task_always_eager = False
+
+
+def peak_rss_mb() -> float:
+    """Peak resident memory of this process. Linux reports kilobytes"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+@transaction.atomic
+def create_datasets(  # noqa: PLR0913
+    base_url: str,
+    *,
+    datasets: int,
+    stations: int,
+    variables: int,
+    concurrency: int = 1,
+    coalesce: bool = False,
+) -> ErddapServer:
+    """Create a server with datasets that each have a timeseries for every station and variable"""
+    server = ErddapServer.objects.create(
+        name="fake-erddap",
+        base_url=base_url,
+        request_refresh_time_seconds=0,
+        request_concurrency=concurrency,
+    )
+
+    data_types = {
+        variable: DataType.objects.get_or_create(
+            standard_name=f"benchmark_{variable}",
+            defaults={"long_name": variable, "units": units},
+        )[0]
+        for variable, units in list(NDBC_MET_VARIABLES.items())[:variables]
+    }
+
+    platforms = Platform.objects.bulk_create(
+        Platform(name=station, mooring_site_desc="Benchmark station")
+        for station in station_ids(stations)
+    )
+
+    for index in range(datasets):
+        dataset = ErddapDataset.objects.create(
+            name=f"benchmark_{index}",
+            server=server,
+            coalesce_requests=coalesce,
+        )
+        TimeSeries.objects.bulk_create(
+            TimeSeries(
+                platform=platform,
+                data_type=data_type,
+                variable=variable,
+                constraints={"station=": platform.name},
+                dataset=dataset,
+            )
+            for platform in platforms
+            for variable, data_type in data_types.items()
+        )
+
+    return server
+
+
+def scenario_call(scenario: str, server: ErddapServer) -> Callable[[], None]:
+    dataset_ids = list(server.erddapdataset_set.values_list("id", flat=True))
+
+    if scenario == "dataset":
+        return lambda: [refresh.refresh_dataset(dataset_id) for dataset_id in dataset_ids]
+    if scenario == "server":
+        return lambda: refresh.refresh_server(server.id)
+    if scenario == "sweep":
+        return periodic_refresh.hourly_default_dataset_refresh
+    raise ValueError(f"Unknown scenario {scenario}")
+
+
+def reset_refresh_state(server: ErddapServer):
+    """Forget everything earlier refreshes of the server left behind,
+    so that each scenario starts out the same
+    """
+    datasets = ErddapDataset.objects.filter(server=server)
+    for dataset in datasets:
+        for timeseries in dataset.group_timeseries_by_constraint_and_type().values():
+            clear_window(window_key(server, dataset.name, timeseries[0].constraints, timeseries))
+
+    datasets.update(
+        refresh_attempted=None,
+        refresh_result=None,
+        time_coverage_end=None,
+        last_value_time=None,
+        update_interval_seconds=None,
+        refresh_misses=0,
+        next_refresh=None,
+    )
+    TimeSeries.objects.filter(dataset__server=server).update(
+        value=None,
+        value_time=None,
+        extrema_values={},
+    )
+    FailedRequest.objects.filter(dataset__server=server).delete()
+    reset_circuit(server)
+    reset_rate_limit(server)
+
+
+def run(scenario: str, fake: FakeErddap, server: ErddapServer) -> ThroughputResult:
+    """Refresh all the server's datasets once, as if they had never been refreshed"""
+    reset_refresh_state(server)
+    call = scenario_call(scenario, server)
+    last_run = RefreshRun.objects.aggregate(last=Max("id"))["last"] or 0
+    fake.requests.clear()
+
+    with eager_tasks():
+        start = time.perf_counter()
+        call()
+        seconds = time.perf_counter() - start
+
+    runs = RefreshRun.objects.filter(dataset__server=server, id__gt=last_run)
+    latencies = [sum(group[stage] for stage in STAGES) for run in runs for group in run.groups]
+
+    return ThroughputResult(
+        scenario=scenario,
+        seconds=seconds,
+        group_latencies=latencies,
+        requests=Counter(fake.requests),
+        peak_rss_mb=peak_rss_mb(),
+    )
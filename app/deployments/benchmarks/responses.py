@@ -0,0 +1,70 @@
+"""ERDDAP responses to benchmark against"""
+
+from datetime import UTC, datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+
+# How many of the generated values are missing
+MISSING_RATE = 0.05
+
+# Variables and units from Coastwatch's cwwcNDBCMet
+NDBC_MET_VARIABLES = {
+    "wd": "degrees_true",
+    "wspd": "m s-1",
+    "gst": "m s-1",
+    "wvht": "m",
+    "dpd": "s",
+    "apd": "s",
+    "bar": "hPa",
+    "atmp": "degree_C",
+    "wtmp": "degree_C",
+}
+
+
+def multi_station_csvp(
+    stations: int = 200,
+    hours: int = 24,
+    interval_minutes: int = 10,
+    seed: int = 0,
+) -> bytes:
+    """Build a `.csvp` response shaped like a multi-station cwwcNDBCMet request.
+
+    Rows are ordered by station and then time as ERDDAP returns them,
+    and about 5% of values are missing.
+    """
+    rng = np.random.default_rng(seed)
+    end = datetime.now(UTC).replace(second=0, microsecond=0)
+    steps = hours * 60 // interval_minutes
+    times = [
+        (end - timedelta(minutes=interval_minutes * step)).strftime("%Y-%m-%dT%H:%M:%SZ")
+        for step in reversed(range(steps))
+    ]
+
+    header = ["station", "time (UTC)"]
+    header += [f"{name} ({units})" for name, units in NDBC_MET_VARIABLES.items()]
+    lines = [",".join(header)]
+
+    for station in range(stations):
+        values = rng.normal(10, 3, size=(steps, len(NDBC_MET_VARIABLES))).round(2)
+        values[rng.random(values.shape) < MISSING_RATE] = np.nan
+
+        for time, row in zip(times, values, strict=True):
+            lines.append(
+                ",".join([f"{41000 + station}", time] + ["NaN" if np.isnan(v) else str(v) for v in row]),
+            )
+
+    return ("\n".join(lines) + "\n").encode()
+
+
+def load_response(path: str | None) -> bytes:
+    """Load a recorded response, or build a multi-station response if no path is given"""
+    if path:
+        return Path(path).read_bytes()
+    return multi_station_csvp()
+
+
+def response_variables(response: bytes) -> list[str]:
+    """Variable names in a `.csvp` response, other than time and station"""
+    header = response.split(b"\n", 1)[0].decode("latin-1").strip().split(",")
+    return [name.split(" ")[0] for name in header if name.split(" ")[0] not in ("time", "station")]
@@ -0,0 +1,29 @@
+"""Compare splitting an already parsed group dataframe with `filter_dataframe` for each variable,
+against splitting it once with `GroupArrays`
+"""
+
+from deployments.utils.erddap_datasets import parse_csvp, sort_dataframe
+from deployments.utils.group_arrays import GroupArrays
+
+from . import legacy
+from .timing import time_calls
+
+
+def run(response: bytes, variables: list[str], repeat: int) -> dict[str, float]:
+    """Returns the median seconds for each path"""
+    erddap_df = sort_dataframe(parse_csvp(response, variables), "benchmark")
+
+    def filter_each():
+        return [legacy.filter_dataframe(erddap_df, variable) for variable in variables]
+
+    def group_arrays():
+        arrays = GroupArrays.from_dataframe(erddap_df, variables)
+        return [arrays.series(variable).valid_rows() for variable in variables]
+
+    return time_calls(
+        {
+            "filter_dataframe": filter_each,
+            "GroupArrays": group_arrays,
+        },
+        repeat,
+    )
@@ -0,0 +1,23 @@
+"""Time benchmark calls"""
+
+import statistics
+import time
+from collections.abc import Callable
+
+
+def time_calls(calls: dict[str, Callable], repeat: int) -> dict[str, float]:
+    """Call each function `repeat` times after a warm up call, and return the median seconds for each"""
+    results = {}
+
+    for name, call in calls.items():
+        call()
+
+        durations = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            call()
+            durations.append(time.perf_counter() - start)
+
+        results[name] = statistics.median(durations)
+
+    return results
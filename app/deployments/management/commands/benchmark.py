@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandParser
+
+from deployments.benchmarks import extrema, parsing, splitting
+from deployments.benchmarks.responses import load_response, response_variables
+
+BENCHMARKS = {
+    "extrema": extrema,
+    "parsing": parsing,
+    "splitting": splitting,
+}
+
+
+class Command(BaseCommand):
+    help = "Benchmark parts of the refresh pipeline against a multi-station ERDDAP response"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("benchmark", choices=sorted(BENCHMARKS), help="Which benchmark to run")
+        parser.add_argument(
+            "--response",
+            help="Path to a recorded .csvp response. Defaults to a generated 200 station response",
+        )
+        parser.add_argument("--repeat", type=int, default=10, help="How many times to time each path")
+
+    def handle(self, *args, **options):
+        response = load_response(options["response"])
+        variables = response_variables(response)
+
+        self.stdout.write(
+            f"Running {options['benchmark']} on a {len(response) / 1_000_000:.1f} MB response "
+            f"with {len(variables)} variables",
+        )
+
+        results = BENCHMARKS[options["benchmark"]].run(response, variables, options["repeat"])
+
+        baseline = next(iter(results.values()))
+        for name, seconds in results.items():
+            self.stdout.write(f"{name:>24}: {seconds * 1000:8.1f} ms ({baseline / seconds:.1f}x)")
@@ -0,0 +1,98 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from django.test.utils import setup_databases, teardown_databases
+
+from deployments.benchmarks import refresh_throughput
+from deployments.benchmarks.fake_erddap import FakeErddap, FakeErddapConfig
+
+SCENARIOS = ["dataset", "server", "sweep"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark refreshing datasets end to end against a local fake ERDDAP server, "
+        "using a test database"
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "scenarios",
+            nargs="*",
+            help=f"Which refreshes to run, out of {', '.join(SCENARIOS)}. Defaults to all of them",
+        )
+        parser.add_argument("--datasets", type=int, default=4, help="How many datasets to create")
+        parser.add_argument("--stations", type=int, default=50, help="Stations in each dataset")
+        parser.add_argument("--variables", type=int, default=4, help="Variables for each station")
+        parser.add_argument(
+            "--interval-minutes",
+            type=int,
+            default=10,
+            help="Minutes between rows, which sets the size of responses",
+        )
+        parser.add_argument("--latency", type=float, default=0.05, help="Seconds for each response")
+        parser.add_argument("--jitter", type=float, default=0, help="Up to this many extra seconds")
+        parser.add_argument("--error-408", type=float, default=0, help="Rate of 408 responses")
+        parser.add_argument("--error-429", type=float, default=0, help="Rate of 429 responses")
+        parser.add_argument("--error-500", type=float, default=0, help="Rate of 500 responses")
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=1,
+            help="Concurrent requests for the server",
+        )
+        parser.add_argument("--coalesce", action="store_true", help="Combine station requests")
+        parser.add_argument("--keepdb", action="store_true", help="Keep the test database between runs")
+
+    def handle(self, *args, **options):
+        scenarios = options["scenarios"] or SCENARIOS
+        unknown = set(scenarios) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+        # Don't signal the production healthcheck from the hourly sweep
+        os.environ.pop("HOURLY_REFRESH_HEALTHCHECK_URL", None)
+
+        config = FakeErddapConfig(
+            latency_seconds=options["latency"],
+            jitter_seconds=options["jitter"],
+            stations=options["stations"],
+            interval_minutes=options["interval_minutes"],
+            error_rates={
+                408: options["error_408"],
+                429: options["error_429"],
+                500: options["error_500"],
+            },
+        )
+
+        old_config = setup_databases(verbosity=0, interactive=False, keepdb=options["keepdb"])
+        try:
+            with FakeErddap(config) as fake:
+                server = refresh_throughput.create_datasets(
+                    fake.url,
+                    datasets=options["datasets"],
+                    stations=options["stations"],
+                    variables=options["variables"],
+                    concurrency=options["concurrency"],
+                    coalesce=options["coalesce"],
+                )
+                self.stdout.write(
+                    f"Refreshing {options['datasets']} datasets with {options['stations']} stations "
+                    f"and {options['variables']} variables from {fake.url}",
+                )
+
+                for scenario in scenarios:
+                    result = refresh_throughput.run(scenario, fake, server)
+                    self.report(result)
+        finally:
+            teardown_databases(old_config, verbosity=0, keepdb=options["keepdb"])
+
+    def report(self, result: refresh_throughput.ThroughputResult):
+        requests = ", ".join(f"{status}: {count}" for status, count in sorted(result.requests.items()))
+        self.stdout.write(
+            f"{result.scenario:>8}: {result.groups} groups in {result.seconds:.2f}s, "
+            f"{result.groups_per_second:.1f} groups/s, "
+            f"p50 {result.latency_percentile(50) * 1000:.0f} ms, "
+            f"p95 {result.latency_percentile(95) * 1000:.0f} ms per group, "
+            f"peak RSS {result.peak_rss_mb:.0f} MB, requests ({requests})",
+        )
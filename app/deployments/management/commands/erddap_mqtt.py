@@ -1,10 +1,21 @@
+import asyncio
+import logging
+import threading
 import uuid
+from collections import Counter
 
 import paho.mqtt.client as mqtt
+from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError, CommandParser
 
-from deployments.models import ErddapDataset, ErddapServer
+from deployments.models import ErddapServer
 from deployments.tasks import single_refresh_dataset
+from deployments.tasks.queue import PUSH_QUEUE
+from deployments.utils.change_payloads import parse_change_payload
+from deployments.utils.mqtt_gateway import MqttGateway
+from deployments.utils.mqtt_notifications import ChangeDebouncer, DatasetIndex, count_notifications
+
+logger = logging.getLogger(__name__)
 
 
 def get_client_id() -> str:
@@ -15,12 +26,49 @@ def get_client_id() -> str:
 class Command(BaseCommand):
     help = "Start the ERDDAP MQTT subscriber"
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.debouncer = ChangeDebouncer(
+            settings.MQTT_CHANGE_QUIET_SECONDS,
+            settings.MQTT_CHANGE_MAX_DELAY_SECONDS,
+        )
+        self.index_refresh_seconds = settings.MQTT_DATASET_INDEX_REFRESH_SECONDS
+        self.counts = Counter()
+        self.counts_lock = threading.Lock()
+
     def add_arguments(self, parser: CommandParser) -> None:
         parser.add_argument(
             "server_slug",
+            nargs="?",
             help="The slug/name of the ERDDAP server to subscribe to",
             type=str,
         )
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help=(
+                "Subscribe to every ERDDAP server with an MQTT broker from a single event loop, "
+                "picking up servers as they are configured"
+            ),
+        )
+        parser.add_argument(
+            "--quiet-seconds",
+            type=float,
+            default=settings.MQTT_CHANGE_QUIET_SECONDS,
+            help="Refresh a dataset once its change notifications have stopped for this long",
+        )
+        parser.add_argument(
+            "--max-delay-seconds",
+            type=float,
+            default=settings.MQTT_CHANGE_MAX_DELAY_SECONDS,
+            help="Refresh a dataset at most this long after its first change notification",
+        )
+        parser.add_argument(
+            "--index-refresh-seconds",
+            type=float,
+            default=settings.MQTT_DATASET_INDEX_REFRESH_SECONDS,
+            help="Reload the names of the server's datasets, and with --all the servers, this often",
+        )
 
     def get_erddap_server(self, server_slug: str) -> ErddapServer:
         """Retrieve and validate the ERDDAP server configuration."""
@@ -50,26 +98,89 @@ class Command(BaseCommand):
         return on_connect
 
     def create_on_message_callback(self, erddap_server: ErddapServer):
-        """Create the on_message callback for the MQTT client."""
+        """Create the on_message callback for the MQTT client.
+
+        Refreshes aren't scheduled directly, rather each dataset's notifications are collected
+        until they settle, see `schedule_refreshes`. Datasets are found from an index of the
+        server's datasets, and notifications are counted in memory, so that the MQTT network
+        thread doesn't wait on the database or Redis.
+        """
+        self.dataset_index = DatasetIndex(erddap_server, self.index_refresh_seconds)
+        self.dataset_index.load()
 
         def on_message(client, userdata, msg):
             dataset_name = msg.topic.split("/")[-1]
             self.stdout.write(f"ERDDAP dataset updated: {dataset_name}")
-            try:
-                dataset = ErddapDataset.objects.get(name=dataset_name, server=erddap_server)
-            except ErddapDataset.DoesNotExist:
+            dataset_id = self.dataset_index.get(dataset_name)
+            if dataset_id is None:
                 self.stdout.write(
                     self.style.NOTICE(
                         f"No dataset found for name {dataset_name} on server {erddap_server}",
                     ),
                 )
+                self.count(messages=1, unknown=1)
                 return
-            # Clear end_time since MQTT notification indicates new data is available
-            single_refresh_dataset.delay(dataset.id, clear_end_time=True)
-            self.stdout.write(self.style.SUCCESS(f"Scheduled refresh for dataset {dataset}"))
+
+            self.count(messages=1)
+            self.debouncer.notify(dataset_id, parse_change_payload(msg.payload))
 
         return on_message
 
+    def count(self, **counts: int) -> None:
+        """Add to the notification counts, which are saved when refreshes are scheduled"""
+        with self.counts_lock:
+            self.counts.update(counts)
+
+    def schedule_due_refreshes(self, erddap_server: ErddapServer) -> None:
+        """Schedule a single refresh for each dataset whose change notifications have settled.
+
+        Changes for datasets whose refresh can't be scheduled are put back to be tried again.
+        """
+        due = self.debouncer.pop_due_changes()
+        scheduled = 0
+        for dataset_id, change in due.items():
+            try:
+                # Clear end_time since MQTT notification indicates new data is available
+                single_refresh_dataset.delay(
+                    dataset_id,
+                    clear_end_time=True,
+                    queue=PUSH_QUEUE,
+                    changes=change.changes,
+                )
+            except Exception:
+                logger.exception(f"Unable to schedule refresh for dataset {dataset_id}, trying again")
+                self.debouncer.notify(dataset_id, change.changes)
+                continue
+
+            scheduled += 1
+            changes = f" to {change.changes}" if change.changes else ""
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"Scheduled refresh for dataset {dataset_id} "
+                    f"after {change.notifications} notifications{changes}",
+                ),
+            )
+
+        with self.counts_lock:
+            counts, self.counts = self.counts, Counter()
+        if scheduled:
+            counts["refreshes"] += scheduled
+        if counts:
+            count_notifications(erddap_server, **counts)
+
+    def schedule_refreshes(self, erddap_server: ErddapServer) -> None:
+        """Schedule refreshes as datasets become due, and keep the dataset index up to date,
+        alongside the MQTT loop
+        """
+        while True:
+            try:
+                self.debouncer.wait(self.dataset_index.seconds_until_stale())
+                self.dataset_index.reload_if_stale()
+                self.schedule_due_refreshes(erddap_server)
+            except Exception:
+                # Keep scheduling, rather than silently ending the thread
+                logger.exception(f"Unable to schedule refreshes for {erddap_server}")
+
     def create_mqtt_client(self, erddap_server: ErddapServer) -> mqtt.Client:
         """Create and configure the MQTT client."""
         mqttc = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=get_client_id())
@@ -87,12 +198,36 @@ class Command(BaseCommand):
 
         mqttc.loop_forever()
 
+    def run_gateway(self, options) -> None:
+        """Subscribe to every configured server until interrupted"""
+        self.stdout.write("Starting ERDDAP MQTT gateway for all servers with an MQTT broker")
+        gateway = MqttGateway(
+            options["quiet_seconds"],
+            options["max_delay_seconds"],
+            options["index_refresh_seconds"],
+            client_id=get_client_id(),
+        )
+        asyncio.run(gateway.run())
+
     def handle(self, *args, **options):
         server_slug = options["server_slug"]
 
+        if options["all"]:
+            if server_slug:
+                raise CommandError("Give either a server slug or --all, not both")
+            self.run_gateway(options)
+            return
+
+        if not server_slug:
+            raise CommandError("Give the slug of an ERDDAP server, or --all for every server")
+
         erddap_server = self.get_erddap_server(server_slug)
 
         self.stdout.write(f"Starting ERDDAP MQTT subscriber for {erddap_server}")
 
+        self.debouncer = ChangeDebouncer(options["quiet_seconds"], options["max_delay_seconds"])
+        self.index_refresh_seconds = options["index_refresh_seconds"]
+
         mqttc = self.create_mqtt_client(erddap_server)
+        threading.Thread(target=self.schedule_refreshes, args=[erddap_server], daemon=True).start()
         self.connect_and_run(mqttc, erddap_server)
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from deployments.tasks.queue import QUEUES
+from deployments.tasks.queue_metrics import PERCENTILES, queue_latency
+
+
+class Command(BaseCommand):
+    help = "Show how long recent tasks waited in each Celery queue before starting"
+
+    def handle(self, *args, **options):
+        for queue in QUEUES:
+            summary = queue_latency(queue)
+
+            if summary is None:
+                self.stdout.write(f"{queue:>12}: no recent tasks")
+                continue
+
+            percentiles = ", ".join(
+                f"p{percent} {summary[f'p{percent}']:.2f}s" for percent in PERCENTILES
+            )
+            self.stdout.write(
+                f"{queue:>12}: {summary['count']} tasks, {percentiles}, max {summary['max']:.2f}s",
+            )
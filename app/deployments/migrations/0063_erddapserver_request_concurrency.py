@@ -0,0 +1,24 @@
+# Generated by Django 6.0.7 on 2026-10-17 14:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("deployments", "0062_alter_platform_geom"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="erddapserver",
+            name="request_concurrency",
+            field=models.PositiveIntegerField(
+                default=1,
+                help_text=(
+                    "Maximum number of constraint groups to request at once when refreshing a dataset. "
+                    "Timeouts and too many request errors will halve this during a refresh."
+                ),
+                verbose_name="Concurrent requests",
+            ),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 6.0.7 on 2026-10-17 15:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("deployments", "0063_erddapserver_request_concurrency"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="erddapserver",
+            name="request_refresh_time_seconds",
+            field=models.FloatField(
+                default=0,
+                help_text=(
+                    "Minimum number of seconds between requests, shared by all workers. "
+                    "Up to 'Concurrent requests' may be made at once before waiting. "
+                    "Doubled for a while when the server asks us to back off."
+                ),
+                verbose_name="Refresh request time in seconds",
+            ),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 6.0.7 on 2026-10-17 15:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("deployments", "0064_alter_erddapserver_request_refresh_time_seconds"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="erddapdataset",
+            name="coalesce_requests",
+            field=models.BooleanField(
+                default=False,
+                help_text=(
+                    "Select to refresh timeseries that only differ by a single text constraint "
+                    "(say station=) with a few combined requests, rather than one request per station."
+                ),
+                verbose_name="Combine station requests",
+            ),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 6.0.7 on 2026-10-17 16:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("deployments", "0065_erddapdataset_coalesce_requests"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="erddapdataset",
+            name="refresh_result",
+            field=models.CharField(
+                blank=True,
+                choices=[
+                    ("refreshed", "Refreshed"),
+                    ("partial", "Partially refreshed"),
+                    ("unchanged", "Unchanged"),
+                ],
+                help_text=(
+                    "Were timeseries refreshed, were only some refreshed without errors, "
+                    "or was the dataset unchanged, at the last attempt"
+                ),
+                max_length=16,
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="erddapdataset",
+            name="time_coverage_end",
+            field=models.DateTimeField(
+                blank=True,
+                help_text="The dataset's time_coverage_end from ERDDAP when it was last refreshed",
+                null=True,
+            ),
+        ),
+    ]
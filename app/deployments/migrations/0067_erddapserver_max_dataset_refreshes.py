@@ -0,0 +1,24 @@
+# Generated by Django 6.0.7 on 2026-10-17 17:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("deployments", "0066_erddapdataset_refresh_result_time_coverage_end"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="erddapserver",
+            name="max_dataset_refreshes",
+            field=models.PositiveIntegerField(
+                default=4,
+                help_text=(
+                    "Maximum number of datasets from this server that are refreshed at once "
+                    "by separate workers when the whole server is refreshed."
+                ),
+                verbose_name="Datasets refreshed at once",
+            ),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 6.0.7 on 2026-10-17 17:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("deployments", "0067_erddapserver_max_dataset_refreshes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="erddapdataset",
+            name="last_value_time",
+            field=models.DateTimeField(
+                blank=True,
+                help_text="The newest observation time found when the dataset was last refreshed",
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="erddapdataset",
+            name="update_interval_seconds",
+            field=models.FloatField(
+                blank=True,
+                help_text="Average time between observations, learned from the spacing of the values retrieved",
+                null=True,
+                verbose_name="Learned update interval in seconds",
+            ),
+        ),
+        migrations.AddField(
+            model_name="erddapdataset",
+            name="refresh_misses",
+            field=models.PositiveIntegerField(
+                default=0,
+                help_text="Refreshes in a row that haven't found new observations",
+            ),
+        ),
+        migrations.AddField(
+            model_name="erddapdataset",
+            name="next_refresh",
+            field=models.DateTimeField(
+                blank=True,
+                help_text=(
+                    "When the dataset is next expected to have new observations. "
+                    "Datasets without a time are refreshed hourly."
+                ),
+                null=True,
+            ),
+        ),
+    ]
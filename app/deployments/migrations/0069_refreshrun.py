@@ -0,0 +1,101 @@
+# Generated by Django 6.0.7 on 2026-10-17 18:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("deployments", "0068_erddapdataset_refresh_schedule"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RefreshRun",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("started", models.DateTimeField(db_index=True)),
+                ("duration_seconds", models.FloatField()),
+                (
+                    "result",
+                    models.CharField(
+                        choices=[
+                            ("refreshed", "Refreshed"),
+                            ("partial", "Partially refreshed"),
+                            ("unchanged", "Unchanged"),
+                            ("failed", "Failed"),
+                        ],
+                        max_length=16,
+                    ),
+                ),
+                (
+                    "wait_seconds",
+                    models.FloatField(
+                        default=0,
+                        help_text="Time spent waiting for the server's rate limit, including any backoff",
+                    ),
+                ),
+                (
+                    "fetch_seconds",
+                    models.FloatField(default=0, help_text="Time spent requesting data from ERDDAP"),
+                ),
+                (
+                    "parse_seconds",
+                    models.FloatField(default=0, help_text="Time spent reading responses"),
+                ),
+                (
+                    "extrema_seconds",
+                    models.FloatField(default=0, help_text="Time spent finding extrema"),
+                ),
+                ("save_seconds", models.FloatField(default=0, help_text="Time spent saving timeseries")),
+                ("bytes_downloaded", models.BigIntegerField(default=0)),
+                (
+                    "rows",
+                    models.PositiveIntegerField(default=0, help_text="Rows read from ERDDAP responses"),
+                ),
+                (
+                    "group_count",
+                    models.PositiveIntegerField(
+                        default=0,
+                        help_text="Groups of timeseries with the same constraints that were requested",
+                        verbose_name="Groups",
+                    ),
+                ),
+                ("error_count", models.PositiveIntegerField(default=0, verbose_name="Errors")),
+                (
+                    "backoff_level",
+                    models.PositiveIntegerField(
+                        default=0,
+                        help_text="Highest backoff level that the server asked us to slow down to",
+                    ),
+                ),
+                (
+                    "groups",
+                    models.JSONField(default=list, help_text="Timings for each group of timeseries"),
+                ),
+                ("errors", models.JSONField(default=list, help_text="Errors handled while refreshing")),
+                (
+                    "dataset",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="refresh_runs",
+                        to="deployments.erddapdataset",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["-started"],
+                "indexes": [
+                    models.Index(fields=["dataset", "-started"], name="refresh_run_dataset_started"),
+                ],
+            },
+        ),
+    ]
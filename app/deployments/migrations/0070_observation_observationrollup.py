@@ -0,0 +1,102 @@
+# Generated by Django 6.0.7 on 2026-10-17 20:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Django can't create partitioned tables, so the table is created here
+# and partitions for each month are created by `utils.observation_history`
+CREATE_OBSERVATION_TABLE = """
+CREATE TABLE deployments_observation (
+    timeseries_id integer NOT NULL
+        REFERENCES deployments_timeseries (id) DEFERRABLE INITIALLY DEFERRED,
+    time timestamp with time zone NOT NULL,
+    value double precision NOT NULL,
+    PRIMARY KEY (timeseries_id, time)
+) PARTITION BY RANGE (time);
+"""
+
+DROP_OBSERVATION_TABLE = "DROP TABLE deployments_observation;"
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("deployments", "0069_refreshrun"),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(CREATE_OBSERVATION_TABLE, reverse_sql=DROP_OBSERVATION_TABLE),
+            ],
+            state_operations=[
+                migrations.CreateModel(
+                    name="Observation",
+                    fields=[
+                        (
+                            "pk",
+                            models.CompositePrimaryKey(
+                                "timeseries_id",
+                                "time",
+                                blank=True,
+                                editable=False,
+                                primary_key=True,
+                                serialize=False,
+                            ),
+                        ),
+                        ("time", models.DateTimeField()),
+                        ("value", models.FloatField()),
+                        (
+                            "timeseries",
+                            models.ForeignKey(
+                                on_delete=django.db.models.deletion.CASCADE,
+                                related_name="observations",
+                                to="deployments.timeseries",
+                            ),
+                        ),
+                    ],
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="ObservationRollup",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "tier",
+                    models.CharField(choices=[("hour", "Hour"), ("day", "Day")], max_length=4),
+                ),
+                ("bucket", models.DateTimeField(help_text="Start of the hour or day")),
+                ("count", models.PositiveIntegerField()),
+                (
+                    "total",
+                    models.FloatField(help_text="Sum of the values, so rollups can be combined"),
+                ),
+                ("minimum", models.FloatField()),
+                ("maximum", models.FloatField()),
+                (
+                    "timeseries",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="observation_rollups",
+                        to="deployments.timeseries",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("timeseries", "tier", "bucket"),
+                        name="observation_rollup_bucket",
+                    ),
+                ],
+            },
+        ),
+    ]
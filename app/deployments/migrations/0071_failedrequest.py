@@ -0,0 +1,76 @@
+# Generated by Django 6.0.7 on 2026-10-17 20:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("deployments", "0070_observation_observationrollup"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FailedRequest",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "group_key",
+                    models.CharField(
+                        help_text="Hash of the constraints and variables of the group",
+                        max_length=64,
+                    ),
+                ),
+                ("constraints", models.JSONField(blank=True, null=True)),
+                ("variables", models.JSONField(default=list)),
+                (
+                    "reason",
+                    models.CharField(
+                        choices=[
+                            ("no_rows", "No rows"),
+                            ("no_matching_time", "No data matches time"),
+                            ("no_matching_station", "No matching stations"),
+                            ("outside_range", "Outside of a variable's range"),
+                            ("unrecognized_variable", "Unrecognized variable"),
+                            ("unrecognized_constraint", "Unrecognized constraint"),
+                            ("unknown_dataset", "Unknown dataset"),
+                            ("file_not_found", "Dataset file not found"),
+                        ],
+                        max_length=32,
+                    ),
+                ),
+                ("message", models.TextField(blank=True, help_text="Error from the last failure")),
+                ("failures", models.PositiveIntegerField(default=1)),
+                ("first_failed", models.DateTimeField()),
+                ("last_failed", models.DateTimeField()),
+                (
+                    "expires",
+                    models.DateTimeField(db_index=True, help_text="Refreshes skip the group until then"),
+                ),
+                (
+                    "dataset",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="failed_requests",
+                        to="deployments.erddapdataset",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["-last_failed"],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("dataset", "group_key"), name="failed_request_group"
+                    ),
+                ],
+            },
+        ),
+    ]
@@ -4,12 +4,15 @@ from .choice_enum import ChoiceEnum
 from .data_type import DataType
 from .erddap_dataset import ErddapDataset
 from .erddap_server import ErddapServer
+from .failed_request import FailedRequest
 from .flood_level import FloodLevel
 from .mooring_type import MooringType
+from .observation import Observation, ObservationRollup
 from .platform import Platform
 from .platform_link import PlatformLink
 from .program import Program
 from .program_attribution import ProgramAttribution
+from .refresh_run import RefreshRun
 from .station_type import StationType
 from .timeseries import TimeSeries
 
@@ -20,12 +23,16 @@ __all__ = [
     "DataType",
     "ErddapDataset",
     "ErddapServer",
+    "FailedRequest",
     "FloodLevel",
     "MooringType",
+    "Observation",
+    "ObservationRollup",
     "PlatformLink",
     "Platform",
     "ProgramAttribution",
     "Program",
+    "RefreshRun",
     "StationType",
     "TimeSeries",
 ]
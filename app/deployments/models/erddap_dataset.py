@@ -13,6 +13,11 @@ logger = logging.getLogger(__name__)
 
 
 class ErddapDataset(models.Model):
+    class RefreshResult(models.TextChoices):
+        REFRESHED = "refreshed"
+        PARTIAL = "partial", "Partially refreshed"
+        UNCHANGED = "unchanged"
+
     name = models.SlugField(
         max_length=256,
         help_text="Or as ERDDAP knows it as the Dataset ID. EX: 'Dataset ID: A01_accelerometer_all'",
@@ -35,6 +40,44 @@ class ErddapDataset(models.Model):
         null=True,
         help_text="Last time that Buoy Barn attempted to refresh this dataset",
     )
+    refresh_result = models.CharField(
+        max_length=16,
+        choices=RefreshResult.choices,
+        blank=True,
+        null=True,
+        help_text=(
+            "Were timeseries refreshed, were only some refreshed without errors, "
+            "or was the dataset unchanged, at the last attempt"
+        ),
+    )
+    time_coverage_end = models.DateTimeField(
+        blank=True,
+        null=True,
+        help_text="The dataset's time_coverage_end from ERDDAP when it was last refreshed",
+    )
+    last_value_time = models.DateTimeField(
+        blank=True,
+        null=True,
+        help_text="The newest observation time found when the dataset was last refreshed",
+    )
+    update_interval_seconds = models.FloatField(
+        "Learned update interval in seconds",
+        blank=True,
+        null=True,
+        help_text="Average time between observations, learned from the spacing of the values retrieved",
+    )
+    refresh_misses = models.PositiveIntegerField(
+        default=0,
+        help_text="Refreshes in a row that haven't found new observations",
+    )
+    next_refresh = models.DateTimeField(
+        blank=True,
+        null=True,
+        help_text=(
+            "When the dataset is next expected to have new observations. "
+            "Datasets without a time are refreshed hourly."
+        ),
+    )
     greater_than_hourly = models.BooleanField(
         default=False,
         help_text=(
@@ -43,6 +86,14 @@ class ErddapDataset(models.Model):
             "Ask Alex to setup refreshing at a different rate."
         ),
     )
+    coalesce_requests = models.BooleanField(
+        "Combine station requests",
+        default=False,
+        help_text=(
+            "Select to refresh timeseries that only differ by a single text constraint "
+            "(say station=) with a few combined requests, rather than one request per station."
+        ),
+    )
 
     class Meta:
         constraints = [
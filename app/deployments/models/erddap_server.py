@@ -34,9 +34,9 @@ class ErddapServer(models.Model):
         "Refresh request time in seconds",
         default=0,
         help_text=(
-            "Minimum number of seconds to attempt to delay between requests. "
-            "If dataset refreshes are triggered independently "
-            "(e.g. via ERDDAP subscriptions) they might ignore this."
+            "Minimum number of seconds between requests, shared by all workers. "
+            "Up to 'Concurrent requests' may be made at once before waiting. "
+            "Doubled for a while when the server asks us to back off."
         ),
     )
     request_timeout_seconds = models.PositiveIntegerField(
@@ -44,6 +44,22 @@ class ErddapServer(models.Model):
         default=60,
         help_text=("Seconds before requests time out."),
     )
+    request_concurrency = models.PositiveIntegerField(
+        "Concurrent requests",
+        default=1,
+        help_text=(
+            "Maximum number of constraint groups to request at once when refreshing a dataset. "
+            "Timeouts and too many request errors will halve this during a refresh."
+        ),
+    )
+    max_dataset_refreshes = models.PositiveIntegerField(
+        "Datasets refreshed at once",
+        default=4,
+        help_text=(
+            "Maximum number of datasets from this server that are refreshed at once "
+            "by separate workers when the whole server is refreshed."
+        ),
+    )
 
     mqtt_broker = models.CharField(
         "MQTT broker",
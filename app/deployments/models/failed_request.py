@@ -0,0 +1,56 @@
+from django.db import models
+from django.utils import timezone
+
+from .erddap_dataset import ErddapDataset
+
+
+class FailedRequestQuerySet(models.QuerySet):
+    def active(self):
+        """Failures that refreshes should still skip"""
+        return self.filter(expires__gt=timezone.now())
+
+
+class FailedRequest(models.Model):
+    """A group of timeseries whose request failed in a way that will keep failing for a while,
+    so refreshes skip it until it expires, see `utils.failed_requests`
+    """
+
+    class Reason(models.TextChoices):
+        NO_ROWS = "no_rows", "No rows"
+        NO_MATCHING_TIME = "no_matching_time", "No data matches time"
+        NO_MATCHING_STATION = "no_matching_station", "No matching stations"
+        OUTSIDE_RANGE = "outside_range", "Outside of a variable's range"
+        UNRECOGNIZED_VARIABLE = "unrecognized_variable", "Unrecognized variable"
+        UNRECOGNIZED_CONSTRAINT = "unrecognized_constraint", "Unrecognized constraint"
+        UNKNOWN_DATASET = "unknown_dataset", "Unknown dataset"
+        FILE_NOT_FOUND = "file_not_found", "Dataset file not found"
+
+    dataset = models.ForeignKey(ErddapDataset, on_delete=models.CASCADE, related_name="failed_requests")
+    group_key = models.CharField(
+        max_length=64,
+        help_text="Hash of the constraints and variables of the group",
+    )
+    constraints = models.JSONField(null=True, blank=True)
+    variables = models.JSONField(default=list)
+
+    reason = models.CharField(max_length=32, choices=Reason.choices)
+    message = models.TextField(blank=True, help_text="Error from the last failure")
+    failures = models.PositiveIntegerField(default=1)
+    first_failed = models.DateTimeField()
+    last_failed = models.DateTimeField()
+    expires = models.DateTimeField(db_index=True, help_text="Refreshes skip the group until then")
+
+    objects = FailedRequestQuerySet.as_manager()
+
+    class Meta:
+        ordering = ["-last_failed"]
+        constraints = [
+            models.UniqueConstraint(fields=["dataset", "group_key"], name="failed_request_group"),
+        ]
+
+    def __str__(self):
+        return f"{self.dataset} {self.constraints} {self.variables}: {self.get_reason_display()}"
+
+    @property
+    def active(self) -> bool:
+        return self.expires > timezone.now()
@@ -0,0 +1,55 @@
+from django.db import models
+
+from .timeseries import TimeSeries
+
+
+class Observation(models.Model):
+    """A single observed value of a timeseries, kept when `settings.OBSERVATION_HISTORY` is enabled
+
+    The table is partitioned by month on `time` (see migration 0070),
+    so partitions are created and dropped by `utils.observation_history`
+    rather than rows being deleted.
+    """
+
+    pk = models.CompositePrimaryKey("timeseries_id", "time")
+    timeseries = models.ForeignKey(TimeSeries, on_delete=models.CASCADE, related_name="observations")
+    time = models.DateTimeField()
+    value = models.FloatField()
+
+    def __str__(self):
+        return f"{self.timeseries_id} at {self.time}: {self.value}"
+
+
+class ObservationRollup(models.Model):
+    """Summary of the observations of a timeseries for an hour or a day"""
+
+    class Tier(models.TextChoices):
+        HOUR = "hour"
+        DAY = "day"
+
+    timeseries = models.ForeignKey(
+        TimeSeries,
+        on_delete=models.CASCADE,
+        related_name="observation_rollups",
+    )
+    tier = models.CharField(max_length=4, choices=Tier.choices)
+    bucket = models.DateTimeField(help_text="Start of the hour or day")
+    count = models.PositiveIntegerField()
+    total = models.FloatField(help_text="Sum of the values, so rollups can be combined")
+    minimum = models.FloatField()
+    maximum = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["timeseries", "tier", "bucket"],
+                name="observation_rollup_bucket",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.timeseries_id} {self.tier} from {self.bucket}"
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count
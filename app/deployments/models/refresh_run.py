@@ -0,0 +1,91 @@
+from django.db import models
+from django.db.models import Avg, Count, Max, Sum
+
+from .erddap_dataset import ErddapDataset
+
+STAGES = ["wait", "fetch", "parse", "extrema", "save"]
+
+
+class RefreshRunQuerySet(models.QuerySet):
+    def slowest(self, by: str, order: str = "total", limit: int = 20) -> list[dict]:
+        """Summarize runs by `dataset` or `server`, slowest first.
+
+        Each summary has the number of runs, total, average, and max seconds,
+        total seconds for each stage, bytes downloaded, errors, and the highest backoff level.
+        """
+        fields = {
+            "dataset": ["dataset_id", "dataset__name", "dataset__server__name"],
+            "server": ["dataset__server_id", "dataset__server__name"],
+        }[by]
+
+        return list(
+            self.values(*fields)
+            .annotate(
+                runs=Count("id"),
+                total_seconds=Sum("duration_seconds"),
+                average_seconds=Avg("duration_seconds"),
+                max_seconds=Max("duration_seconds"),
+                **{f"total_{stage}_seconds": Sum(f"{stage}_seconds") for stage in STAGES},
+                total_bytes=Sum("bytes_downloaded"),
+                total_errors=Sum("error_count"),
+                max_backoff_level=Max("backoff_level"),
+            )
+            .order_by(f"-{self.model.SLOWEST_ORDERINGS[order]}")[:limit],
+        )
+
+
+class RefreshRun(models.Model):
+    """Where the time went in a single refresh of a dataset, see `utils.refresh_ledger`"""
+
+    dataset = models.ForeignKey(ErddapDataset, on_delete=models.CASCADE, related_name="refresh_runs")
+    started = models.DateTimeField(db_index=True)
+    duration_seconds = models.FloatField()
+
+    class Result(models.TextChoices):
+        REFRESHED = "refreshed"
+        PARTIAL = "partial", "Partially refreshed"
+        UNCHANGED = "unchanged"
+        FAILED = "failed"
+
+    result = models.CharField(max_length=16, choices=Result.choices)
+
+    wait_seconds = models.FloatField(
+        default=0,
+        help_text="Time spent waiting for the server's rate limit, including any backoff",
+    )
+    fetch_seconds = models.FloatField(default=0, help_text="Time spent requesting data from ERDDAP")
+    parse_seconds = models.FloatField(default=0, help_text="Time spent reading responses")
+    extrema_seconds = models.FloatField(default=0, help_text="Time spent finding extrema")
+    save_seconds = models.FloatField(default=0, help_text="Time spent saving timeseries")
+
+    bytes_downloaded = models.BigIntegerField(default=0)
+    rows = models.PositiveIntegerField(default=0, help_text="Rows read from ERDDAP responses")
+    group_count = models.PositiveIntegerField(
+        "Groups",
+        default=0,
+        help_text="Groups of timeseries with the same constraints that were requested",
+    )
+    error_count = models.PositiveIntegerField("Errors", default=0)
+    backoff_level = models.PositiveIntegerField(
+        default=0,
+        help_text="Highest backoff level that the server asked us to slow down to",
+    )
+
+    groups = models.JSONField(default=list, help_text="Timings for each group of timeseries")
+    errors = models.JSONField(default=list, help_text="Errors handled while refreshing")
+
+    objects = RefreshRunQuerySet.as_manager()
+
+    # How the slowest datasets or servers can be ordered
+    SLOWEST_ORDERINGS = {
+        "total": "total_seconds",
+        "average": "average_seconds",
+        "max": "max_seconds",
+    }
+
+    class Meta:
+        ordering = ["-started"]
+        indexes = [models.Index(fields=["dataset", "-started"], name="refresh_run_dataset_started")]
+
+    def __str__(self):
+        return f"{self.dataset} - {self.started:%Y-%m-%d %H:%M:%S} ({self.duration_seconds:.1f}s)"
@@ -0,0 +1,61 @@
+"""Rebuild the platform list snapshots when the admin changes what they show
+
+Saving or deleting any of the models that the platform list is rendered from
+schedules a rebuild (see `tasks.platform_snapshots`), once the change is committed.
+Refreshes save datasets and servers too, so their saves only count
+when they change a field that the list shows.
+"""
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import (
+    Alert,
+    DataType,
+    ErddapDataset,
+    ErddapServer,
+    FloodLevel,
+    Platform,
+    PlatformLink,
+    Program,
+    ProgramAttribution,
+    TimeSeries,
+)
+from .tasks.platform_snapshots import rebuild_after_commit
+
+SNAPSHOT_MODELS = [
+    Alert,
+    DataType,
+    ErddapDataset,
+    ErddapServer,
+    FloodLevel,
+    Platform,
+    PlatformLink,
+    Program,
+    ProgramAttribution,
+    TimeSeries,
+]
+
+# Fields of models that refreshes also save, which the platform list shows
+SNAPSHOT_FIELDS = {
+    ErddapDataset: {"name", "public_name", "server"},
+    ErddapServer: {"base_url", "proxy_cors"},
+}
+
+
+@receiver(post_save)
+def snapshot_model_saved(sender, update_fields=None, **kwargs):
+    if sender not in SNAPSHOT_MODELS:
+        return
+
+    fields = SNAPSHOT_FIELDS.get(sender)
+    if fields is not None and update_fields is not None and not fields & set(update_fields):
+        return
+
+    rebuild_after_commit()
+
+
+@receiver(post_delete)
+def snapshot_model_deleted(sender, **kwargs):
+    if sender in SNAPSHOT_MODELS:
+        rebuild_after_commit()
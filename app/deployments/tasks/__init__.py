@@ -1,8 +1,16 @@
+from . import queue_metrics  # noqa: F401
 from .old_timeseries import more_thank_a_week_old  # noqa: F401
-from .periodic_refresh import hourly_default_dataset_refresh  # noqa: F401
+from .periodic_refresh import (  # noqa: F401
+    hourly_default_dataset_refresh,
+    maintain_observation_history,
+    prune_refresh_runs,
+    scheduled_dataset_refresh,
+)
+from .platform_snapshots import rebuild_platform_snapshots  # noqa: F401
 from .refresh import (  # noqa: F401
     refresh_dataset,
     refresh_server,
+    refresh_server_dataset,
     single_refresh_dataset,
     single_refresh_server,
     update_values_for_timeseries,
@@ -0,0 +1,108 @@
+"""Concurrently retrieve the constraint groups of a dataset from ERDDAP"""
+
+import asyncio
+import logging
+from dataclasses import dataclass
+
+import httpx
+import pandas as pd
+from httpcore import ConnectError
+
+from deployments.models import ErddapServer, TimeSeries
+from deployments.utils.erddap_datasets import aretrieve_dataframe
+from deployments.utils.http_clients import async_server_client
+from deployments.utils.rate_limit import report_backoff
+
+from .error_handling import is_backoff_error
+
+logger = logging.getLogger(__name__)
+
+RETRIEVE_ERRORS = (ConnectError, httpx.HTTPError, OSError)
+
+
+class AdaptiveConcurrencyLimiter:
+    """Limits the number of requests in flight to a server.
+
+    When a server asks us to back off, the number of requests allowed in flight is halved.
+    Spacing between requests is left to the server's shared rate limit.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = max(limit, 1)
+        self._in_flight = 0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self):
+        """Wait until another request can be made"""
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._in_flight < self.limit)
+            self._in_flight += 1
+
+    async def release(self):
+        """Mark a request as completed"""
+        async with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+
+    def backoff(self):
+        """Reduce the number of requests in flight to the server"""
+        if self.limit > 1:
+            new_limit = self.limit // 2
+            logger.warning(f"Reducing concurrent requests from {self.limit} to {new_limit}")
+            self.limit = new_limit
+
+
+@dataclass
+class GroupResult:
+    """The dataframe retrieved for a group of timeseries, or the error raised trying"""
+
+    timeseries: list[TimeSeries]
+    df: pd.DataFrame | None = None
+    error: Exception | None = None
+
+    def dataframe(self) -> pd.DataFrame:
+        """Return the retrieved dataframe, or raise the error that occurred"""
+        if self.error is not None:
+            raise self.error
+        return self.df
+
+
+async def fetch_group(
+    client: httpx.AsyncClient,
+    limiter: AdaptiveConcurrencyLimiter,
+    server: ErddapServer,
+    dataset: str,
+    timeseries: list[TimeSeries],
+) -> GroupResult:
+    """Retrieve the dataframe for a single group of timeseries"""
+    await limiter.acquire()
+    try:
+        df = await aretrieve_dataframe(client, server, dataset, timeseries[0].constraints, timeseries)
+    except RETRIEVE_ERRORS as error:
+        if is_backoff_error(error):
+            limiter.backoff()
+            await asyncio.to_thread(report_backoff, server)
+        return GroupResult(timeseries, error=error)
+    finally:
+        await limiter.release()
+
+    return GroupResult(timeseries, df=df)
+
+
+async def fetch_groups(
+    server: ErddapServer,
+    dataset: str,
+    groups: list[list[TimeSeries]],
+) -> list[GroupResult]:
+    """Retrieve dataframes for groups of timeseries from a dataset,
+    with up to `server.request_concurrency` requests in flight at once.
+
+    As the ORM can't be used from the event loop, the server and timeseries
+    should already be loaded.
+    """
+    limiter = AdaptiveConcurrencyLimiter(server.request_concurrency)
+
+    async with async_server_client(server) as client:
+        return await asyncio.gather(
+            *(fetch_group(client, limiter, server, dataset, timeseries) for timeseries in groups),
+        )
@@ -4,10 +4,27 @@ from http import HTTPStatus
 
 import pandas as pd
 from django.utils import timezone
-from httpx import HTTPError, HTTPStatusError
+from httpcore import ConnectError
+from httpx import HTTPError, HTTPStatusError, TimeoutException
+
+from deployments.models import FailedRequest
+from deployments.utils import refresh_ledger
+from deployments.utils.failed_requests import remember_failure
 
 logger = logging.getLogger(__name__)
 
+# Text in ERDDAP errors that will keep happening for a while, most specific first
+FAILURE_REASONS = [
+    ("Currently unknown datasetID", FailedRequest.Reason.UNKNOWN_DATASET),
+    ("java.io.FileNotFoundException", FailedRequest.Reason.FILE_NOT_FOUND),
+    ("There are no matching stations", FailedRequest.Reason.NO_MATCHING_STATION),
+    ("No data matches time", FailedRequest.Reason.NO_MATCHING_TIME),
+    ("Unrecognized variable=", FailedRequest.Reason.UNRECOGNIZED_VARIABLE),
+    ("Unrecognized constraint variable=", FailedRequest.Reason.UNRECOGNIZED_CONSTRAINT),
+    ("is outside of the variable", FailedRequest.Reason.OUTSIDE_RANGE),
+    ("nRows = 0", FailedRequest.Reason.NO_ROWS),
+]
+
 
 def handle_500_no_rows_error(timeseries_group, compare_text: str) -> bool:
     """Did the request not return any rows? Returns true if handled"""
@@ -357,3 +374,84 @@ def handle_http_errors(timeseries_group, error: HTTPError) -> bool:  # noqa: PLR
         exc_info=True,
     )
     return True
+
+
+def handle_retrieve_error(timeseries_group, error: Exception) -> bool:
+    """Handle an error raised while retrieving data for a group of timeseries.
+    Should be called from the `except` block that caught the error.
+
+    Raises BackoffError if requests to the server should be slowed down,
+    otherwise logs the error, and remembers errors that will keep happening
+    so that the group is skipped for a while.
+
+    Returns True if the error will keep happening (it has a `FailedRequest.Reason`),
+    so there is no point requesting the group again before its next refresh.
+    """
+    refresh_ledger.record_error(timeseries_group, error)
+
+    if isinstance(error, ConnectError | TimeoutException):
+        raise BackoffError(
+            f"Timeout when trying to retrieve dataset {timeseries_group[0].dataset.name} "
+            f"with constraint {timeseries_group[0].constraints}: {error}",
+        ) from error
+
+    if isinstance(error, HTTPError):
+        handle_http_errors(timeseries_group, error)
+
+        reason = failure_reason(error)
+        if reason:
+            remember_failure(timeseries_group, reason, str(error))
+        return reason is not None
+
+    logger.error(
+        (
+            f"Error loading dataset {timeseries_group[0].dataset.name} with "
+            f"constraints {timeseries_group[0].constraints}: {error}"
+        ),
+        extra={
+            "timeseries": timeseries_group,
+            "constraints": timeseries_group[0].constraints,
+        },
+        exc_info=True,
+    )
+    return False
+
+
+def is_backoff_error(error: Exception) -> bool:
+    """Would handling this error raise a BackoffError?
+
+    Unlike the handlers above, this has no side effects, so it can be used
+    while requests are still in flight.
+    """
+    if isinstance(error, ConnectError | TimeoutException):
+        return True
+
+    if not isinstance(error, HTTPError):
+        return False
+
+    if isinstance(error.__cause__, HTTPStatusError) and error.__cause__.response.status_code in {
+        HTTPStatus.REQUEST_TIMEOUT,
+        HTTPStatus.TOO_MANY_REQUESTS,
+    }:
+        return True
+
+    compare_text = str(error)
+    return ("code=408" in compare_text and "TimeoutException" in compare_text) or (
+        "code=429" in compare_text and "Too Many Requests" in compare_text
+    )
+
+
+def failure_reason(error: Exception) -> FailedRequest.Reason | None:
+    """Will requests for the same group keep failing for a while? Returns why if so.
+
+    Like `is_backoff_error`, this has no side effects.
+    """
+    if not isinstance(error, HTTPError) or is_backoff_error(error):
+        return None
+
+    compare_text = str(error)
+    for text, reason in FAILURE_REASONS:
+        if text in compare_text:
+            return reason
+
+    return None
@@ -1,90 +1,91 @@
-from datetime import datetime, timedelta
+from datetime import timedelta
 
 import numpy as np
-import pandas as pd
 from scipy.signal import find_peaks
 
 from deployments import standard_names
 from deployments.models import TimeSeries
-from deployments.utils.erddap_datasets import TIME_COLUMN, VALUE_COLUMN
-
-
-def encode_value(value):  # noqa: PLR0911
-    """Make Pandas and Numpy values json serializable"""
-    if isinstance(value, np.bool_):
-        return bool(value)
-    if isinstance(value, np.integer):
-        return int(value)
-    if isinstance(value, np.floating):
-        return float(value)
-    if isinstance(value, pd.Timestamp | datetime):
-        return value.isoformat()
-    if isinstance(value, list | np.ndarray | pd.Series):
-        return [encode_value(v) for v in value]
-    if isinstance(value, dict):
-        return {encode_value(k): encode_value(v) for k, v in value.items()}
-    try:
-        if pd.isna(value):
-            return None
-    except ValueError as e:
-        raise ValueError(f"Unable to encode value {value}") from e
-    return value
-
-
-def extrema_for_timeseries(ts: TimeSeries, df: pd.DataFrame) -> dict:
+from deployments.utils.group_arrays import GroupArrays, SeriesArrays
+
+# Hannah suggested a minimum distance of ten hours between tides
+MIN_TIDE_DISTANCE = np.timedelta64(timedelta(hours=10))
+MIN_TIDE_ROWS = 3
+
+
+def iso_times(times: np.ndarray) -> list[str]:
+    """Format UTC datetime64 values the same way as `pd.Timestamp.isoformat`"""
+    return [f"{time}+00:00" for time in np.datetime_as_string(times, unit="s")]
+
+
+def group_extrema(arrays: GroupArrays, timeseries: list[TimeSeries]) -> dict[str, dict]:
     """
-    Calculate the extrema for a timeseries
+    Calculate the extrema for every variable in a group at once,
+    as JSON ready values keyed by variable.
+
+    Variables without any valid values are left out, and high and low tides
+    are found for variables of water level timeseries.
     """
-    extrema_df = df
-    extrema_df = df.set_index(TIME_COLUMN)
-
-    column_name = VALUE_COLUMN
-
-    try:
-        extrema = {
-            "max": {
-                "time": extrema_df[column_name].idxmax(),
-                "value": extrema_df[column_name].max(),
-            },
-            "min": {
-                "time": extrema_df[column_name].idxmin(),
-                "value": extrema_df[column_name].min(),
-            },
-        }
-    except KeyError as e:
-        raise KeyError(f"Unable to find {ts.variable} in {extrema_df.columns}") from e
+    if not arrays.block.shape[0]:
+        return {}
 
-    if ts.data_type.standard_name in standard_names.WATER_LEVEL:
-        tides_df = tidal_extrema(extrema_df, column_name)
-        extrema["tides"] = tides_df.to_dict(orient="records")
+    valid = ~np.isnat(arrays.time)[:, np.newaxis] & ~np.isnan(arrays.block)
+    has_values = valid.any(axis=0)
+
+    max_rows = np.where(valid, arrays.block, -np.inf).argmax(axis=0)
+    min_rows = np.where(valid, arrays.block, np.inf).argmin(axis=0)
+
+    columns = np.arange(arrays.block.shape[1])
+    max_values = arrays.block[max_rows, columns].tolist()
+    min_values = arrays.block[min_rows, columns].tolist()
+    max_times = iso_times(arrays.time[max_rows])
+    min_times = iso_times(arrays.time[min_rows])
+
+    water_level_variables = {
+        ts.variable for ts in timeseries if ts.data_type.standard_name in standard_names.WATER_LEVEL
+    }
+
+    extrema = {}
+    for variable, column in arrays.columns.items():
+        if not has_values[column]:
+            continue
+
+        extrema[variable] = {
+            "max": {"time": max_times[column], "value": max_values[column]},
+            "min": {"time": min_times[column], "value": min_values[column]},
+        }
 
-    return encode_value(extrema)
+        if variable in water_level_variables:
+            extrema[variable]["tides"] = tidal_extrema(arrays.series(variable))
 
+    return extrema
 
-def tidal_extrema(
-    df: pd.DataFrame,
-    water_level_column: str,
-    time_col: str = TIME_COLUMN,
-) -> pd.DataFrame:
-    """Calculate the high and low tides for a timeseries"""
-    # Hannah suggested a minimum distance of ten hours between tides,
-    # but we need to specifiy the number of values
-    # pandas <2 doesn't allow .diff() on index
-    min_distance = timedelta(hours=10) / df.reset_index()[time_col].diff().mean()
 
-    high_idx = find_peaks(df[water_level_column], distance=min_distance)
-    low_idx = find_peaks(-df[water_level_column], distance=min_distance)
+def tidal_extrema(series: SeriesArrays) -> list[dict]:
+    """Calculate the high and low tides for a timeseries, ordered by time"""
+    rows = series.valid_rows()
+    if len(rows) < MIN_TIDE_ROWS:
+        return []
 
-    high_tides = df.iloc[high_idx[0]]
-    high_tides.loc[:, "tide"] = "high"
+    times = series.time[rows]
+    values = series.value[rows]
 
-    low_tides = df.iloc[low_idx[0]]
-    low_tides.loc[:, "tide"] = "low"
+    # find_peaks needs the number of values between tides, rather than time
+    min_distance = max(MIN_TIDE_DISTANCE / np.diff(times).mean(), 1)
 
-    tides_df = pd.concat([high_tides, low_tides])
-    tides_df = tides_df.sort_index().reset_index()
+    high_idx, _ = find_peaks(values, distance=min_distance)
+    low_idx, _ = find_peaks(-values, distance=min_distance)
 
-    tides_df[time_col] = tides_df[time_col].map(lambda x: x.isoformat())
-    tides_df = tides_df[["time", "value", "tide"]]
+    peaks = np.concatenate([high_idx, low_idx])
+    tides = np.array(["high"] * len(high_idx) + ["low"] * len(low_idx))
+    order = np.argsort(peaks, kind="stable")
+    peaks = peaks[order]
 
-    return tides_df
+    return [
+        {"time": time, "value": value, "tide": tide}
+        for time, value, tide in zip(
+            iso_times(times[peaks]),
+            values[peaks].tolist(),
+            tides[order].tolist(),
+            strict=True,
+        )
+    ]
@@ -5,10 +5,13 @@ from datetime import timedelta
 
 import requests
 from celery import shared_task
+from django.conf import settings
 from django.utils import timezone
 
-from deployments.models import ErddapDataset
+from deployments.models import ErddapDataset, RefreshRun
+from deployments.utils import observation_history
 
+from .queue import BACKGROUND_QUEUE
 from .refresh import single_refresh_dataset
 
 NOT_RECENTLY = timedelta(minutes=45)
@@ -33,7 +36,7 @@ def hourly_default_dataset_refresh():
 
     old_dataset_ids = not_recently_refreshed_datasets(NOT_RECENTLY)
     for dataset_id in old_dataset_ids:
-        single_refresh_dataset.delay(dataset_id, healthcheck=True)
+        single_refresh_dataset.delay(dataset_id, healthcheck=True, queue=BACKGROUND_QUEUE)
     logger.info(f"Launched dataset refreshes for {old_dataset_ids}")
 
     if healthcheck_url:
@@ -46,12 +49,65 @@ def hourly_default_dataset_refresh():
             )
 
 
+@shared_task
+def scheduled_dataset_refresh():
+    """Refresh datasets that are expected to have new observations by now,
+    based on how often they have updated before.
+    """
+    due_dataset_ids = due_datasets()
+    for dataset_id in due_dataset_ids:
+        single_refresh_dataset.delay(dataset_id, queue=BACKGROUND_QUEUE)
+
+    if due_dataset_ids:
+        logger.info(f"Launched scheduled dataset refreshes for {due_dataset_ids}")
+
+
+@shared_task
+def prune_refresh_runs():
+    """Delete refresh timings older than `settings.REFRESH_RUN_RETENTION_DAYS`"""
+    older_than = timezone.now() - timedelta(days=settings.REFRESH_RUN_RETENTION_DAYS)
+    deleted, _ = RefreshRun.objects.filter(started__lt=older_than).delete()
+    logger.info(f"Deleted {deleted} refresh runs from before {older_than}")
+
+
+@shared_task
+def maintain_observation_history():
+    """Create observation history partitions for this month and next,
+    and drop those older than `settings.OBSERVATION_HISTORY_RETENTION_MONTHS`
+    """
+    if not settings.OBSERVATION_HISTORY:
+        return
+
+    this_month = observation_history.month_start(timezone.now())
+    observation_history.ensure_partitions([this_month, observation_history.next_month(this_month)])
+
+    if settings.OBSERVATION_HISTORY_RETENTION_MONTHS:
+        oldest = this_month
+        for _ in range(settings.OBSERVATION_HISTORY_RETENTION_MONTHS):
+            oldest = (oldest - timedelta(days=1)).replace(day=1)
+        dropped = observation_history.drop_partitions_before(oldest)
+        logger.info(f"Dropped observation history partitions {dropped}")
+
+
 def not_recently_refreshed_datasets(time_before: timedelta) -> Iterable[int]:
-    """Return the ids of datasets that have not been recently refreshed"""
-    older_than = timezone.now() - time_before
+    """Return the ids of datasets that have not been recently refreshed,
+    skipping datasets that aren't expected to have new observations yet
+    """
+    now = timezone.now()
+    older_than = now - time_before
 
-    old_datasets = ErddapDataset.objects.filter(
-        refresh_attempted__lt=older_than,
-    ) | ErddapDataset.objects.filter(refresh_attempted__isnull=True)
+    old_datasets = (
+        ErddapDataset.objects.filter(
+            refresh_attempted__lt=older_than,
+        )
+        | ErddapDataset.objects.filter(refresh_attempted__isnull=True)
+    ).exclude(next_refresh__gt=now)
 
     return [dataset.id for dataset in old_datasets]
+
+
+def due_datasets() -> Iterable[int]:
+    """Return the ids of datasets whose scheduled refresh time has passed"""
+    return list(
+        ErddapDataset.objects.filter(next_refresh__lte=timezone.now()).values_list("id", flat=True),
+    )
@@ -0,0 +1,58 @@
+import logging
+
+from celery import shared_task
+from django.conf import settings
+from django.db import transaction
+
+from deployments.utils.platform_snapshots import VISIBILITY_KEYS, build_snapshot
+
+from .queue import BACKGROUND_QUEUE, task_finished, task_queued
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def rebuild_platform_snapshots(queue: str | None = None):
+    """Render and store the platform list snapshot for each visibility
+
+    Params:
+        queue (str): Celery queue that the rebuild is sent to, see `queue.route_task`
+    """
+    # Cleared first, so that values changed while rendering queue another rebuild
+    task_finished(rebuild_platform_snapshots.name, [])
+
+    for visibility in VISIBILITY_KEYS:
+        build_snapshot(visibility)
+    logger.info(f"Rebuilt platform snapshots for {VISIBILITY_KEYS}")
+
+
+def schedule_snapshot_rebuild():
+    """Rebuild the platform snapshots shortly, unless a rebuild is already waiting,
+    so that refreshes changing values around the same time share a rebuild
+    """
+    if task_queued(rebuild_platform_snapshots.name, [], {"queue": BACKGROUND_QUEUE}):
+        return
+
+    try:
+        rebuild_platform_snapshots.apply_async(
+            kwargs={"queue": BACKGROUND_QUEUE},
+            countdown=settings.PLATFORM_SNAPSHOT_DELAY_SECONDS,
+        )
+    except Exception:
+        task_finished(rebuild_platform_snapshots.name, [])
+        raise
+
+
+def rebuild_after_commit():
+    """Rebuild the platform snapshots once the current transaction is committed,
+    for edits that change what the platform list shows
+    """
+    transaction.on_commit(try_snapshot_rebuild)
+
+
+def try_snapshot_rebuild():
+    """Edits shouldn't fail when a rebuild can't be queued, as the snapshots expire anyway"""
+    try:
+        schedule_snapshot_rebuild()
+    except Exception:
+        logger.exception("Unable to schedule a rebuild of the platform snapshots")
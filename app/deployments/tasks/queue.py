@@ -1,33 +1,75 @@
-def task_queued(task_name: str, task_args: list, task_kwargs: dict) -> bool:  # noqa: PLR0912
-    """Returns true if the task is already scheduled"""
-    from buoy_barn.celery import app  # noqa: PLC0415
-    from celery.app.control import Control  # noqa: PLC0415
+"""Avoid queueing tasks that are already waiting or running
 
-    control = Control(app)
-    inspect = control.inspect()
+Each queued task gets a key in the Django cache for its name and arguments,
+which is added atomically when the task is queued, so that only one of
+many callers checking at the same time will queue it. The key is cleared
+when the task finishes, or expires after `settings.TASK_QUEUED_TIMEOUT_SECONDS`
+if the task is lost.
+
+Refreshes are also routed to separate queues by who asked for them, so that
+datasets ERDDAP has just told us about aren't stuck behind the hourly refresh.
+Tasks that take a `queue` keyword argument are sent to that queue by `route_task`,
+and each queue can have a task of the same name and arguments waiting at once.
+"""
+
+import json
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django_redis.exceptions import ConnectionInterrupted
+
+logger = logging.getLogger(__name__)
+
+QUEUED_KEY = "task-queued:{}:{}:{}"
+
+# Datasets that ERDDAP has told us have changed (say over MQTT)
+PUSH_QUEUE = "push"
+# Refreshes requested by users from the admin or API
+USER_QUEUE = "user"
+# Scheduled and hourly refreshes, and any other tasks
+BACKGROUND_QUEUE = "background"
+
+QUEUES = [PUSH_QUEUE, USER_QUEUE, BACKGROUND_QUEUE]
 
-    try:
-        for worker_tasks in inspect.active().values():
-            for task in worker_tasks:
-                if task["name"] == task_name and task["args"] == task_args:
-                    return True
-    except AttributeError:
-        pass
 
+def route_task(name, args, kwargs, options, task=None, **kw):
+    """Celery router that sends tasks to the queue given by their `queue` keyword argument"""
+    queue = (kwargs or {}).get("queue")
+    if queue in QUEUES:
+        return {"queue": queue}
+    return None
+
+
+def queued_key(task_name: str, task_args: list, queue: str | None = None) -> str:
+    return QUEUED_KEY.format(task_name, queue or "", json.dumps(list(task_args)))
+
+
+def task_queued(task_name: str, task_args: list, task_kwargs: dict) -> bool:
+    """Returns true if the task is already queued, otherwise marks it as queued.
+
+    Tasks are matched by name, arguments, and the `queue` keyword argument,
+    regardless of other keyword arguments.
+    The caller that gets False is responsible for queueing the task.
+    If Redis is unavailable, tasks are treated as not queued.
+    """
     try:
-        for worker_tasks in inspect.reserved().values():
-            for task in worker_tasks:
-                if task["name"] == task_name and task["args"] == task_args:
-                    return True
-    except AttributeError:
-        pass
+        marked = cache.add(
+            queued_key(task_name, task_args, task_kwargs.get("queue")),
+            task_kwargs,
+            settings.TASK_QUEUED_TIMEOUT_SECONDS,
+        )
+    except ConnectionInterrupted as error:
+        logger.warning(f"Unable to check if {task_name} is queued, queueing anyway: {error}")
+        return False
+
+    return not marked
+
 
+def task_finished(task_name: str, task_args: list):
+    """Clear the queued marks for a task on every queue, so that it can be queued again"""
+    keys = [queued_key(task_name, task_args, queue) for queue in [None, *QUEUES]]
     try:
-        for worker_tasks in inspect.scheduled().values():
-            for task in worker_tasks:
-                if task["name"] == task_name and task["args"] == task_args:
-                    return True
-    except AttributeError:
-        pass
-
-    return False
+        cache.delete_many(keys)
+    except ConnectionInterrupted as error:
+        logger.warning(f"Unable to clear queued mark for {task_name}: {error}")
@@ -0,0 +1,79 @@
+"""Measure how long tasks wait in each queue before a worker starts them
+
+Tasks are stamped with the time they were sent, and when a worker starts a task
+the wait is added to a capped list of recent waits for its queue in Redis.
+`queue_latency` summarizes them, and `manage.py queue_latency` shows them.
+"""
+
+import logging
+import time
+
+from celery.signals import before_task_publish, task_prerun
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+ENQUEUED_HEADER = "buoy_barn_enqueued_at"
+LATENCY_KEY = "celery-queue-latency:{}"
+RECENT_LATENCIES = 1000
+LATENCY_EXPIRE_SECONDS = 24 * 60 * 60
+
+PERCENTILES = (50, 95)
+
+
+@before_task_publish.connect
+def stamp_enqueued_time(headers=None, **kwargs):
+    if headers is not None:
+        headers[ENQUEUED_HEADER] = time.time()
+
+
+@task_prerun.connect
+def record_queue_latency(task=None, **kwargs):
+    request = getattr(task, "request", None)
+    if request is None or request.is_eager:
+        return
+
+    enqueued_at = getattr(request, ENQUEUED_HEADER, None)
+    if enqueued_at is None:
+        enqueued_at = (request.headers or {}).get(ENQUEUED_HEADER)
+
+    queue = (request.delivery_info or {}).get("routing_key")
+    if enqueued_at is None or queue is None:
+        return
+
+    latency = max(time.time() - float(enqueued_at), 0)
+    logger.debug(f"{task.name} waited {latency:.2f}s in the {queue} queue")
+
+    try:
+        pipe = get_redis_connection("default").pipeline()
+        pipe.lpush(LATENCY_KEY.format(queue), f"{latency:.3f}")
+        pipe.ltrim(LATENCY_KEY.format(queue), 0, RECENT_LATENCIES - 1)
+        pipe.expire(LATENCY_KEY.format(queue), LATENCY_EXPIRE_SECONDS)
+        pipe.execute()
+    except RedisError as error:
+        logger.warning(f"Unable to record queue latency for {queue}: {error}")
+
+
+def percentile(sorted_values: list[float], percent: float) -> float:
+    index = round(percent / 100 * (len(sorted_values) - 1))
+    return sorted_values[index]
+
+
+def queue_latency(queue: str) -> dict[str, float] | None:
+    """Returns the count, median, 95th percentile, and max of recent waits in a queue, in seconds"""
+    try:
+        latencies = get_redis_connection("default").lrange(LATENCY_KEY.format(queue), 0, -1)
+    except RedisError as error:
+        logger.warning(f"Unable to load queue latency for {queue}: {error}")
+        return None
+
+    if not latencies:
+        return None
+
+    latencies = sorted(float(latency) for latency in latencies)
+    summary = {"count": len(latencies), "max": latencies[-1]}
+    for percent in PERCENTILES:
+        summary[f"p{percent}"] = percentile(latencies, percent)
+
+    return summary
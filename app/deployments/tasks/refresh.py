@@ -1,39 +1,76 @@
+import asyncio
 import logging
-import time
+import random
+from contextlib import contextmanager
+from datetime import datetime
+from uuid import uuid4
 
+import httpx
 import pandas as pd
 import sentry_sdk
 from celery import shared_task
+from django.conf import settings
+from django.db import transaction
 from django.utils import timezone
-from httpcore import ConnectError
-from httpx import HTTPError, TimeoutException
 
 from deployments.models import ErddapDataset, ErddapServer, TimeSeries
+from deployments.utils import refresh_ledger
+from deployments.utils.change_payloads import Changes, changed_groups
+from deployments.utils.circuit_breaker import CircuitOpenError, CircuitState, circuit_state
+from deployments.utils.coalesced_requests import (
+    plan_coalesced_requests,
+    retrieve_coalesced_dataframe,
+    split_dataframe,
+)
 from deployments.utils.erddap_datasets import (
     TIME_COLUMN,
     VALUE_COLUMN,
-    filter_dataframe,
     retrieve_dataframe,
+    retrieve_time_coverage_end,
+)
+from deployments.utils.failed_requests import clear_failures, skip_failed_requests
+from deployments.utils.group_arrays import GroupArrays
+from deployments.utils.observation_history import new_rows, record_observations
+from deployments.utils.rate_limit import report_backoff
+from deployments.utils.recent_windows import pack_window, store_windows
+from deployments.utils.refresh_progress import (
+    SLOT_RETRY_SECONDS,
+    acquire_dataset_slot,
+    complete_server_dataset,
+    release_dataset_slot,
+    start_server_run,
 )
 
-from .error_handling import BackoffError, handle_http_errors
-from .extrema import extrema_for_timeseries
-from .queue import task_queued
+from .concurrent import RETRIEVE_ERRORS, GroupResult, fetch_groups
+from .error_handling import BackoffError, handle_retrieve_error, is_backoff_error
+from .extrema import group_extrema
+from .platform_snapshots import schedule_snapshot_rebuild
+from .queue import BACKGROUND_QUEUE, task_finished, task_queued
+from .refresh_schedule import schedule_next_refresh
 
 logger = logging.getLogger(__name__)
 
 
-def update_values_for_timeseries(timeseries: list[TimeSeries], clear_end_time: bool = False):  # noqa: PLR0912 PLR0915
+@contextmanager
+def timeseries_scope(timeseries: list[TimeSeries]):
+    """Tag Sentry events with the server and dataset of a group of timeseries"""
+    with sentry_sdk.new_scope() as scope:
+        scope.set_tag("erddap-server", timeseries[0].dataset.server)
+        scope.set_tag("erddap-dataset", timeseries[0].dataset.name)
+        yield scope
+
+
+def update_values_for_timeseries(timeseries: list[TimeSeries], clear_end_time: bool = False) -> bool:
     """Update values and most recent times for a group of timeseries that have the same constraints
 
     Args:
         timeseries: List of timeseries to update
         clear_end_time: If True, clear the end_time field when data is successfully retrieved
-    """
-    with sentry_sdk.new_scope() as scope:
-        scope.set_tag("erddap-server", timeseries[0].dataset.server)
-        scope.set_tag("erddap-dataset", timeseries[0].dataset.name)
 
+    Returns:
+        False if the data for the group couldn't be retrieved for a reason that may soon pass
+    """
+    with timeseries_scope(timeseries):
         logger.info(f"Working on timeseries: {timeseries}")
         try:
             timeseries_df = retrieve_dataframe(
@@ -42,164 +79,520 @@ def update_values_for_timeseries(timeseries: list[TimeSeries], clear_end_time: b
                 timeseries[0].constraints,
                 timeseries,
             )
+        except RETRIEVE_ERRORS as error:
+            return handle_retrieve_error(timeseries, error)
+
+        update_values_from_dataframe(timeseries, timeseries_df, clear_end_time=clear_end_time)
+        return True
+
+
+def update_values_from_result(result: GroupResult, clear_end_time: bool = False) -> bool:
+    """Update values for a group of timeseries from an already retrieved result
 
-        except (ConnectError, TimeoutException) as error:
-            raise BackoffError(
-                f"Timeout when trying to retrieve dataset {timeseries[0].dataset.name} "
-                f"with constraint {timeseries[0].constraints}: {error}",
-            ) from error
+    Args:
+        result: Dataframe or error retrieved for the group of timeseries
+        clear_end_time: If True, clear the end_time field when data is successfully retrieved
+
+    Returns:
+        False if the result was an error that may soon pass
+    """
+    with timeseries_scope(result.timeseries):
+        try:
+            timeseries_df = result.dataframe()
+        except RETRIEVE_ERRORS as error:
+            return handle_retrieve_error(result.timeseries, error)
 
-        except HTTPError as error:
-            if handle_http_errors(timeseries, error):
-                return
+        update_values_from_dataframe(result.timeseries, timeseries_df, clear_end_time=clear_end_time)
+        return True
 
-        except OSError as error:
+
+def update_values_from_dataframe(  # noqa: PLR0912 PLR0915
+    timeseries: list[TimeSeries],
+    timeseries_df: pd.DataFrame,
+    clear_end_time: bool = False,
+):
+    """Update values, most recent times, and extrema for a group of timeseries
+    from the dataframe retrieved for them, keep their recent windows for charts,
+    and add new observations to the history store when it's enabled
+
+    Args:
+        timeseries: List of timeseries to update
+        timeseries_df: Dataframe retrieved from ERDDAP for the group
+        clear_end_time: If True, clear the end_time field when data is successfully retrieved
+    """
+    updated: dict[TimeSeries, set[str]] = {}
+    windows: dict[int, bytes] = {}
+    observations: dict[int, tuple] = {}
+    with refresh_ledger.timed("parse", timeseries):
+        arrays = GroupArrays.from_dataframe(timeseries_df, {series.variable for series in timeseries})
+    with refresh_ledger.timed("extrema", timeseries):
+        extrema = group_extrema(arrays, timeseries)
+
+    for series in timeseries:
+        extra_context = {
+            "timeseries": timeseries,
+            "constraints": timeseries[0].constraints,
+        }
+
+        try:
+            series_arrays = arrays.series(series.variable)
+        except KeyError:
+            logger.warning(f"Unable to find {series.variable} in dataframe for {series.platform.name}")
+            continue
+
+        try:
+            valid_rows = series_arrays.valid_rows()
+            if series.timeseries_type in TimeSeries.FUTURE_TYPES:
+                row_index = valid_rows[1]
+            else:
+                row_index = valid_rows[-1]
+            row = {
+                TIME_COLUMN: series_arrays.timestamp(row_index),
+                VALUE_COLUMN: series_arrays.value[row_index],
+            }
+            extra_context["row"] = row
+            windows[series.id] = pack_window(series_arrays)
+            if (
+                settings.OBSERVATION_HISTORY
+                and series.timeseries_type == TimeSeries.TimeSeriesType.OBSERVATION
+            ):
+                observations[series.id] = new_rows(series_arrays, series.value_time)
+        except IndexError:
+            msg = f"Unable to find position in dataframe for {series.platform.name} - {series.variable}"
+            logger.warning(
+                msg,
+                #    extra=extra_context,
+                #    exc_info=True
+            )
+            continue
+
+        try:
+            changed_fields = set()
+            value = row[VALUE_COLUMN]
+
+            extra_context["series"] = series
+            extra_context["variable"] = series.variable
+            extra_context[VALUE_COLUMN] = value
+
+            set_if_changed(series, "value", value, changed_fields)
+
+            new_value_time = row[TIME_COLUMN]
+            extra_context["time"] = new_value_time
+
+            # Clear end_time if requested AND we have fresh data
+            # Only clear if the new data is more recent than the end_time
+            # This prevents clearing end_time on dataset reloads without new data
+            if clear_end_time and series.end_time is not None and (new_value_time > series.end_time):
+                logger.info(
+                    f"Clearing end_time for {series} - new data at {new_value_time} is after "
+                    f"end_time {series.end_time}",
+                )
+                set_if_changed(series, "end_time", None, changed_fields)
+
+            set_if_changed(series, "value_time", new_value_time, changed_fields)
+            updated[series] = changed_fields
+
+            set_if_changed(series, "extrema_values", extrema[series.variable], changed_fields)
+        except (TypeError, ValueError) as error:
             logger.error(
-                (
-                    f"Error loading dataset {timeseries[0].dataset.name} with "
-                    f"constraints {timeseries[0].constraints}: {error}"
-                ),
-                extra={
-                    "timeseries": timeseries,
-                    "constraints": timeseries[0].constraints,
-                },
+                f"Could not save {series.variable} from {row}: {error}",
+                extra=extra_context,
                 exc_info=True,
             )
-            return
 
-        for series in timeseries:
-            filtered_df = filter_dataframe(timeseries_df, series.variable)
+    with refresh_ledger.timed("save", timeseries):
+        save_timeseries_changes(updated)
+        store_windows(windows)
+        record_observations(observations)
 
-            extra_context = {
-                "timeseries": timeseries,
-                "constraints": timeseries[0].constraints,
-            }
 
-            try:
-                if series.timeseries_type in TimeSeries.FUTURE_TYPES:
-                    row = filtered_df.iloc[1]
-                else:
-                    row = filtered_df.iloc[-1]
-                extra_context["row"] = row
-            except IndexError:
-                msg = (
-                    f"Unable to find position in dataframe for {series.platform.name} - "
-                    f"{series.variable}"
-                )
+def set_if_changed(series: TimeSeries, field: str, value, changed_fields: set[str]):
+    """Set a field on a timeseries, and track the field if the value is different"""
+    if getattr(series, field) != value:
+        setattr(series, field, value)
+        changed_fields.add(field)
+
+
+def save_timeseries_changes(updated: dict[TimeSeries, set[str]]):
+    """Save the changed fields for a group of timeseries with a single bulk update.
+
+    Only timeseries with changes are written, and only the fields that changed
+    for any of them (along with `update_time`, which `bulk_update` won't set itself).
+    Then the platform list snapshots are rebuilt to include the changes.
+    """
+    changed_series = [series for series, changed_fields in updated.items() if changed_fields]
+    if not changed_series:
+        return
+
+    fields = set().union(*updated.values()) | {"update_time"}
+
+    now = timezone.now()
+    for series in changed_series:
+        series.update_time = now
+
+    with transaction.atomic():
+        TimeSeries.objects.bulk_update(changed_series, sorted(fields))
+
+    schedule_snapshot_rebuild()
+
+
+def refresh_groups_coalesced(
+    dataset: ErddapDataset,
+    groups: dict[tuple[tuple, str], list[TimeSeries]],
+    clear_end_time: bool = False,
+) -> tuple[dict[tuple[tuple, str], list[TimeSeries]], bool]:
+    """Refresh groups of timeseries that only differ by a single text constraint
+    (say `station=`) with combined requests.
+
+    Returns the groups that still need to be refreshed on their own, either because
+    they couldn't be combined, their combined request failed, or they were missing
+    from the combined response, so that their errors can be handled individually.
+    Along with False if any groups were skipped because the server asked us to back off.
+    """
+    requests, _ = plan_coalesced_requests(dataset.server, dataset.name, list(groups.values()))
+    refreshed = set()
+    complete = True
+
+    for request in requests:
+        try:
+            frames = split_dataframe(
+                request,
+                retrieve_coalesced_dataframe(dataset.server, dataset.name, request),
+            )
+        except RETRIEVE_ERRORS as error:
+            if not is_backoff_error(error):
                 logger.warning(
-                    msg,
-                    #    extra=extra_context,
-                    #    exc_info=True
+                    f"Unable to retrieve combined request for {request.column} in dataset {dataset.id}, "
+                    f"requesting {len(request.groups)} values individually: {error}",
                 )
                 continue
 
-            try:
-                value = row[VALUE_COLUMN]
-
-                extra_context["series"] = series
-                extra_context["variable"] = series.variable
-                extra_context[VALUE_COLUMN] = value
-
-                if isinstance(value, pd.Timedelta):
-                    logger.info("Converting from Timedelta to seconds")
-                    value = value.seconds
-
-                series.value = value
-
-                time = row[TIME_COLUMN]
-                extra_context["time"] = time
-
-                new_value_time = pd.to_datetime(time)
-
-                # Clear end_time if requested AND we have fresh data
-                # Only clear if the new data is more recent than the end_time
-                # This prevents clearing end_time on dataset reloads without new data
-                if clear_end_time and series.end_time is not None and (new_value_time > series.end_time):
-                    logger.info(
-                        f"Clearing end_time for {series} - new data at {new_value_time} is after "
-                        f"end_time {series.end_time}",
-                    )
-                    series.end_time = None
-
-                series.value_time = new_value_time
-                series.save()
-
-                try:
-                    series.extrema_values = extrema_for_timeseries(series, filtered_df)
-                    series.save()
-                except TypeError as error:
-                    logger.error(
-                        f"Could not save extrema for {series.variable} from {row}: {error}",
-                        extra=extra_context,
-                        exc_info=True,
-                    )
-                    continue
-            except (TypeError, ValueError) as error:
-                logger.error(
-                    f"Could not save {series.variable} from {row}: {error}",
-                    extra=extra_context,
-                    exc_info=True,
-                )
+            level = report_backoff(dataset.server)
+            logger.error(
+                f"Some form of timeout encountered while refreshing dataset {dataset.id}. "
+                f"Slowing requests to {dataset.server.base_url} to backoff level {level}",
+                extra={"constraints": request.request_constraints()},
+                exc_info=True,
+            )
+            # Wait for the next refresh, rather than making more requests to a struggling server
+            refreshed.update(id(timeseries) for timeseries in request.timeseries_groups)
+            complete = False
+            continue
+        except IndexError:
+            logger.warning(
+                f"Combined response for dataset {dataset.id} did not include {request.column}, "
+                f"requesting {len(request.groups)} values individually",
+            )
+            continue
 
+        for value, value_df in frames.items():
+            for timeseries in request.groups[value]:
+                with timeseries_scope(timeseries):
+                    update_values_from_dataframe(timeseries, value_df, clear_end_time=clear_end_time)
+                refreshed.add(id(timeseries))
 
-@shared_task
-def refresh_dataset(dataset_id: int, healthcheck: bool = False, clear_end_time: bool = False):
-    """Refresh the values for all timeseries associated with a specific dataset
+    remaining = {
+        key: timeseries for key, timeseries in groups.items() if id(timeseries) not in refreshed
+    }
+    return remaining, complete
 
-    Params:
-        dataset_id (int): Primary key of ErddapDataset to refresh all timeseries for
-        healthcheck (bool): Should Healthchecks.io be signaled when the dataset has completed updating?
-        clear_end_time (bool): If True, clear the end_time field for timeseries
-            when data is successfully retrieved
+
+def refresh_groups_sequentially(
+    dataset: ErddapDataset,
+    groups: dict[tuple[tuple, str], list[TimeSeries]],
+    clear_end_time: bool = False,
+) -> bool:
+    """Refresh each group of timeseries one after another.
+
+    Requests are spaced out by the server's rate limit, which is slowed down
+    for all workers when the server asks us to back off.
+
+    Returns False if any group couldn't be refreshed for a reason that may soon pass.
     """
-    dataset = ErddapDataset.objects.get(pk=dataset_id)
-    dataset.refresh_attempted = timezone.now()
-    dataset.save()
+    complete = True
+    for (constraints, _), timeseries in groups.items():
+        try:
+            if not update_values_for_timeseries(timeseries, clear_end_time=clear_end_time):
+                complete = False
+        except BackoffError:
+            complete = False
+            level = report_backoff(dataset.server)
+            logger.error(
+                f"Some form of timeout encountered while refreshing dataset {dataset.id}. "
+                f"Slowing requests to {dataset.server.base_url} to backoff level {level}",
+                extra={"timeseries": timeseries, "constraints": constraints},
+                exc_info=True,
+            )
+    return complete
 
-    request_refresh_time_seconds = dataset.server.request_refresh_time_seconds
 
-    if healthcheck:
-        dataset.healthcheck_start()
+def refresh_groups_concurrently(
+    dataset: ErddapDataset,
+    groups: list[list[TimeSeries]],
+    clear_end_time: bool = False,
+) -> bool:
+    """Retrieve groups of timeseries with multiple requests in flight,
+    then update the values for each group.
 
-    groups = dataset.group_timeseries_by_constraint_and_type()
+    Backoffs reduce the number of requests in flight and slow down the server's
+    rate limit while retrieving, so they are only logged when updating.
 
-    for (constraints, _), timeseries in groups.items():
-        time.sleep(request_refresh_time_seconds)
+    Returns False if any group couldn't be refreshed for a reason that may soon pass.
+    """
+    results = asyncio.run(fetch_groups(dataset.server, dataset.name, groups))
 
+    complete = True
+    for result in results:
         try:
-            update_values_for_timeseries(timeseries, clear_end_time=clear_end_time)
+            if not update_values_from_result(result, clear_end_time=clear_end_time):
+                complete = False
         except BackoffError:
-            new_request_refresh_time_seconds = max(request_refresh_time_seconds, 1) * 2
+            complete = False
             logger.error(
-                f"Some form of timeout encountered while refreshing dataset {dataset_id}"
-                f"Increasing backoff from {request_refresh_time_seconds} to "
-                f"{new_request_refresh_time_seconds}",
-                extra={"timeseries": timeseries, "constraints": constraints},
+                f"Some form of timeout encountered while refreshing dataset {dataset.id}",
+                extra={"timeseries": result.timeseries, "constraints": result.timeseries[0].constraints},
                 exc_info=True,
             )
-            request_refresh_time_seconds = new_request_refresh_time_seconds
+    return complete
+
+
+def refresh_groups(
+    dataset: ErddapDataset,
+    groups: dict[tuple[tuple, str], list[TimeSeries]],
+    *,
+    clear_end_time: bool = False,
+    force: bool = False,
+) -> bool:
+    """Refresh groups of timeseries, skipping ones that recently failed unless forced,
+    and return if every group was refreshed.
+
+    Groups that fail in a way that will keep failing for a while (a `FailedRequest.Reason`),
+    or that are skipped for such a failure, count as refreshed. Otherwise a dataset
+    with a station that stopped reporting would never be complete.
+    Only timeouts, backoffs, and unrecognized errors leave the refresh incomplete.
+    """
+    complete = True
+    if force:
+        clear_failures(dataset)
+    else:
+        groups = skip_failed_requests(dataset, groups)
+
+    if dataset.coalesce_requests:
+        groups, coalesced = refresh_groups_coalesced(dataset, groups, clear_end_time=clear_end_time)
+        complete = complete and coalesced
+
+    if dataset.server.request_concurrency > 1:
+        refreshed = refresh_groups_concurrently(
+            dataset,
+            list(groups.values()),
+            clear_end_time=clear_end_time,
+        )
+    else:
+        refreshed = refresh_groups_sequentially(dataset, groups, clear_end_time=clear_end_time)
+    return complete and refreshed
+
+
+def check_time_coverage_end(dataset: ErddapDataset) -> datetime | None:
+    """Returns the dataset's current time_coverage_end, or None if it couldn't be checked"""
+    try:
+        return retrieve_time_coverage_end(dataset.server, dataset.name)
+    except (httpx.HTTPError, OSError, KeyError, ValueError) as error:
+        logger.info(f"Unable to check time_coverage_end for dataset {dataset.id}: {error}")
+        return None
+
+
+def dataset_unchanged(
+    dataset: ErddapDataset,
+    groups: dict[tuple[tuple, str], list[TimeSeries]],
+    time_coverage_end: datetime | None,
+) -> bool:
+    """Has the dataset's time_coverage_end stayed the same since it was last refreshed?
+
+    Datasets with predictions or forecasts are always treated as changed,
+    as their next values move forward even when their coverage doesn't.
+    """
+    if time_coverage_end is None or dataset.time_coverage_end is None:
+        return False
+
+    if time_coverage_end > timezone.now():
+        return False
+
+    if any(ts.timeseries_type in TimeSeries.FUTURE_TYPES for group in groups.values() for ts in group):
+        return False
+
+    return time_coverage_end == dataset.time_coverage_end
+
+
+def refresh_dataset_timeseries(
+    dataset: ErddapDataset,
+    healthcheck: bool = False,
+    clear_end_time: bool = False,
+    force: bool = False,
+    changes: Changes | None = None,
+):
+    """Refresh the timeseries of a dataset, see `refresh_dataset`"""
+    previously_attempted = dataset.refresh_attempted
+    dataset.refresh_attempted = timezone.now()
+    dataset.save(update_fields=["refresh_attempted"])
+
+    if healthcheck:
+        dataset.healthcheck_start()
+
+    groups = dataset.group_timeseries_by_constraint_and_type()
+    # Refreshing only the groups that changed says nothing about the others,
+    # so the dataset's time_coverage_end is left for a full refresh to record
+    partial = False
+    if changes:
+        changed = changed_groups(groups, changes)
+        partial = len(changed) < len(groups)
+        groups = changed
+
+    time_coverage_end = None
+    if not partial:
+        # Checked before refreshing, so that data added while refreshing is picked up next time
+        time_coverage_end = check_time_coverage_end(dataset)
+
+        check = not force and previously_attempted is not None
+        if check and dataset_unchanged(dataset, groups, time_coverage_end):
+            logger.info(f"Dataset {dataset.id} is unchanged since {time_coverage_end}, skipping refresh")
+            dataset.refresh_result = ErddapDataset.RefreshResult.UNCHANGED
+            dataset.save(update_fields=["refresh_result", *schedule_next_refresh(dataset)])
+
+            if healthcheck:
+                dataset.healthcheck_complete()
+            return
+
+    # Only a refresh that got every group counts, so that groups that failed for a while
+    # aren't left behind by the next refresh finding the dataset unchanged
+    complete = refresh_groups(dataset, groups, clear_end_time=clear_end_time, force=force)
+
+    update_fields = ["refresh_result", *schedule_next_refresh(dataset)]
+    if complete:
+        dataset.refresh_result = ErddapDataset.RefreshResult.REFRESHED
+        if not partial:
+            dataset.time_coverage_end = time_coverage_end
+            update_fields.append("time_coverage_end")
+    else:
+        logger.info(
+            f"Not every group of timeseries in dataset {dataset.id} was refreshed, "
+            f"keeping the previous time_coverage_end of {dataset.time_coverage_end}",
+        )
+        dataset.refresh_result = ErddapDataset.RefreshResult.PARTIAL
+    dataset.save(update_fields=update_fields)
 
     if healthcheck:
         dataset.healthcheck_complete()
 
 
+def refresh_dataset_args(dataset_id: int, changes: Changes | None = None) -> list:
+    """Refreshes of part of a dataset are queued separately for what changed,
+    so that a change doesn't wait behind a refresh of a different part
+    """
+    return [dataset_id, changes] if changes else [dataset_id]
+
+
+def run_dataset_refresh(
+    dataset_id: int,
+    *,
+    healthcheck: bool = False,
+    clear_end_time: bool = False,
+    force: bool = False,
+    changes: Changes | None = None,
+):
+    """Refresh a dataset and record it in the refresh ledger, unless its server's circuit is open.
+
+    Unlike `refresh_dataset`, the dataset's queued marks are left alone,
+    so it can be run from other tasks without letting duplicate refreshes be queued.
+    """
+    dataset = ErddapDataset.objects.get(pk=dataset_id)
+
+    state, _ = circuit_state(dataset.server)
+    if state == CircuitState.OPEN:
+        logger.info(f"Circuit is open for {dataset.server}, skipping dataset {dataset.id}")
+        return
+
+    try:
+        with refresh_ledger.record_refresh(dataset) as ledger:
+            refresh_dataset_timeseries(
+                dataset,
+                healthcheck=healthcheck,
+                clear_end_time=clear_end_time,
+                force=force,
+                changes=changes,
+            )
+            ledger.result = dataset.refresh_result
+    except CircuitOpenError as error:
+        logger.warning(f"Stopped refreshing dataset {dataset.id}: {error}")
+
+
+@shared_task
+def refresh_dataset(  # noqa: PLR0913
+    dataset_id: int,
+    *,
+    healthcheck: bool = False,
+    clear_end_time: bool = False,
+    force: bool = False,
+    queue: str | None = None,
+    changes: Changes | None = None,
+):
+    """Refresh the values for all timeseries associated with a specific dataset
+
+    Unless forced or never refreshed before, the dataset's time_coverage_end is checked
+    first, and the refresh is skipped if it hasn't changed since the last refresh.
+
+    When ERDDAP has said what changed in the dataset, only the groups of timeseries
+    that the changes match are refreshed, see `utils.change_payloads`.
+
+    Params:
+        dataset_id (int): Primary key of ErddapDataset to refresh all timeseries for
+        healthcheck (bool): Should Healthchecks.io be signaled when the dataset has completed updating?
+        clear_end_time (bool): If True, clear the end_time field for timeseries
+            when data is successfully retrieved
+        force (bool): Refresh even if the dataset appears unchanged, and request groups
+            of timeseries that recently failed. Datasets on servers with an open circuit
+            are still skipped.
+        queue (str): Celery queue that the refresh is sent to, see `queue.route_task`
+        changes (dict): Values that changed by key, from an ERDDAP change message,
+            or None to refresh all the dataset's timeseries
+    """
+    try:
+        run_dataset_refresh(
+            dataset_id,
+            healthcheck=healthcheck,
+            clear_end_time=clear_end_time,
+            force=force,
+            changes=changes,
+        )
+    finally:
+        task_finished(refresh_dataset.name, refresh_dataset_args(dataset_id, changes))
+
+
 @shared_task
-def single_refresh_dataset(dataset_id: int, healthcheck: bool = False, clear_end_time: bool = False):
-    """Schedule dataset refresh, only if it does not already exist
+def single_refresh_dataset(
+    dataset_id: int,
+    healthcheck: bool = False,
+    clear_end_time: bool = False,
+    queue: str = BACKGROUND_QUEUE,
+    changes: Changes | None = None,
+):
+    """Schedule dataset refresh, only if it does not already exist on the queue
 
     Args:
         dataset_id: Primary key of ErddapDataset to refresh
         healthcheck: Should Healthchecks.io be signaled when complete
         clear_end_time: If True, clear the end_time field for timeseries
             when data is successfully retrieved
+        queue: Celery queue to send the refresh to
+        changes: Values that changed by key, to only refresh the timeseries they match
     """
     with sentry_sdk.new_scope() as scope:
         scope.set_tag("dataset_id", dataset_id)
 
+        task_args = refresh_dataset_args(dataset_id, changes)
         already_queued = task_queued(
             refresh_dataset.name,
-            [dataset_id],
-            {"healthcheck": healthcheck, "clear_end_time": clear_end_time},
+            task_args,
+            {"healthcheck": healthcheck, "clear_end_time": clear_end_time, "queue": queue},
         )
 
         if already_queued:
@@ -208,39 +601,131 @@ def single_refresh_dataset(dataset_id: int, healthcheck: bool = False, clear_end
                 exc_info=True,
             )
         else:
-            refresh_dataset.delay(dataset_id, healthcheck=healthcheck, clear_end_time=clear_end_time)
+            try:
+                refresh_dataset.delay(
+                    dataset_id,
+                    healthcheck=healthcheck,
+                    clear_end_time=clear_end_time,
+                    queue=queue,
+                    changes=changes,
+                )
+            except Exception:
+                task_finished(refresh_dataset.name, task_args)
+                raise
 
 
 @shared_task
-def refresh_server(server_id: int, healthcheck: bool = False):
+def refresh_server(server_id: int, healthcheck: bool = False, queue: str | None = None):
     """Refresh all the timeseries data for a server
 
+    Each dataset is refreshed by its own `refresh_server_dataset` task, which waits
+    for one of the server's `ErddapServer.max_dataset_refreshes` slots, so that only
+    that many datasets from a server are refreshed at once, without holding a worker
+    for the whole server, or one dataset that is killed holding up the others.
+
+    The server stays marked as queued until the last dataset of the run finishes,
+    so that another run isn't started while this one is still going.
+
     Params:
         server_id (int): Primary key of ErddapServer to update all TimeSeries for
         healthcheck (int): Should Healthchecks.io be singled after all timeseries are updated
+        queue (str): Celery queue to send the dataset refreshes to
     """
-    server = ErddapServer.objects.get(pk=server_id)
+    try:
+        server = ErddapServer.objects.get(pk=server_id)
 
-    if healthcheck:
-        server.healthcheck_start()
+        if healthcheck:
+            server.healthcheck_start()
 
-    for ds in server.erddapdataset_set.all():
-        refresh_dataset(ds.id)
+        dataset_ids = list(server.erddapdataset_set.values_list("id", flat=True))
 
-    if healthcheck:
-        server.healthcheck_complete()
+        if not dataset_ids:
+            task_finished(refresh_server.name, [server_id])
+            if healthcheck:
+                server.healthcheck_complete()
+            return
+
+        run_id = uuid4().hex
+        start_server_run(server.id, run_id, len(dataset_ids))
+
+        for dataset_id in dataset_ids:
+            refresh_server_dataset.delay(
+                server.id,
+                dataset_id,
+                run_id,
+                max_refreshes=server.max_dataset_refreshes,
+                healthcheck=healthcheck,
+                queue=queue,
+            )
+    except Exception:
+        task_finished(refresh_server.name, [server_id])
+        raise
+
+    logger.info(
+        f"Queued {len(dataset_ids)} datasets from {server} to be refreshed "
+        f"{server.max_dataset_refreshes} at a time as run {run_id}",
+    )
+
+
+@shared_task(bind=True, max_retries=None)
+def refresh_server_dataset(  # noqa: PLR0913
+    self,
+    server_id: int,
+    dataset_id: int,
+    run_id: str,
+    *,
+    max_refreshes: int = 1,
+    healthcheck: bool = False,
+    queue: str | None = None,
+):
+    """Refresh a dataset as part of a `refresh_server` run once one of the server's slots is free,
+    and complete the run if it is the last dataset to finish.
+
+    Params:
+        server_id (int): Primary key of the ErddapServer being refreshed
+        dataset_id (int): Primary key of the ErddapDataset to refresh
+        run_id (str): Server run that the dataset is part of
+        max_refreshes (int): How many of the server's datasets can be refreshed at once
+        healthcheck (bool): Should Healthchecks.io be signaled when the run completes?
+        queue (str): Celery queue that the refresh is sent to, see `queue.route_task`
+    """
+    lease = f"{run_id}:{dataset_id}"
+    if not acquire_dataset_slot(server_id, lease, max_refreshes):
+        # Jittered, so that waiting datasets don't all try again at once
+        raise self.retry(countdown=SLOT_RETRY_SECONDS * random.uniform(1, 2))  # noqa: S311
+
+    try:
+        run_dataset_refresh(dataset_id)
+    except Exception:
+        # Count the dataset as finished anyway, rather than stranding the run
+        logger.exception(f"Unable to refresh dataset {dataset_id} for server run {run_id}")
+    finally:
+        release_dataset_slot(server_id, lease)
+        progress = complete_server_dataset(run_id)
+
+    if progress is None:
+        return
+
+    completed, total = progress
+    logger.info(f"Refreshed {completed}/{total} datasets for server {server_id} in run {run_id}")
+
+    if completed == total:
+        logger.info(f"Finished refreshing server {server_id} in run {run_id}")
+        task_finished(refresh_server.name, [server_id])
+        if healthcheck:
+            ErddapServer.objects.get(pk=server_id).healthcheck_complete()
 
 
 @shared_task
-def single_refresh_server(server_id: int, healthcheck: bool = False):
-    """Schedule dataset refresh, only if it does not already exist"""
+def single_refresh_server(server_id: int, healthcheck: bool = False, queue: str = BACKGROUND_QUEUE):
+    """Schedule server refresh, only if it does not already exist on the queue"""
     with sentry_sdk.new_scope() as scope:
         scope.set_tag("server_id", server_id)
 
         already_queued = task_queued(
             refresh_server.name,
             [server_id],
-            {"healthcheck": healthcheck},
+            {"healthcheck": healthcheck, "queue": queue},
         )
 
         if already_queued:
@@ -249,4 +734,8 @@ def single_refresh_server(server_id: int, healthcheck: bool = False):
                 exc_info=True,
             )
         else:
-            refresh_server.delay(server_id, healthcheck=healthcheck)
+            try:
+                refresh_server.delay(server_id, healthcheck=healthcheck, queue=queue)
+            except Exception:
+                task_finished(refresh_server.name, [server_id])
+                raise
@@ -0,0 +1,146 @@
+"""Learn how often each dataset gets new data, and schedule its next refresh to match
+
+After each refresh, the spacing of the observations just retrieved (the median
+difference between the valid times in each timeseries' recent window) is folded into
+an exponentially weighted average of the dataset's update interval, and the next
+refresh is scheduled just after the value following the newest `value_time` is expected.
+The spacing is used rather than how far the newest value moved between refreshes,
+as that only measures how often we refresh.
+
+When a refresh doesn't find new data, the dataset is retried after a quarter of its
+interval, doubling with each miss up to `MAX_RETRY`, so datasets that have stopped
+updating are requested less and less often.
+
+Datasets with predictions or forecasts, or without enough values to learn
+their spacing from, are left to the hourly refresh.
+"""
+
+from collections.abc import Iterable
+from datetime import datetime, timedelta
+
+import numpy as np
+from django.db.models import Max
+from django.utils import timezone
+
+from deployments.models import ErddapDataset, TimeSeries
+from deployments.utils.recent_windows import load_windows
+
+# How much weight the latest spacing between values gets in the update interval
+INTERVAL_WEIGHT = 0.3
+MIN_INTERVAL = timedelta(minutes=5)
+MAX_INTERVAL = timedelta(days=1)
+MAX_RETRY = timedelta(days=1)
+MAX_DOUBLINGS = 10
+
+# How long after the next value is expected to refresh, to give ERDDAP time to load it
+MIN_GRACE = timedelta(minutes=2)
+GRACE_FRACTION = 0.1
+
+
+def current_observations(dataset: ErddapDataset):
+    return dataset.timeseries_set.filter(active=True, end_time=None).exclude(
+        timeseries_type__in=TimeSeries.FUTURE_TYPES,
+    )
+
+
+def latest_observation_time(dataset: ErddapDataset) -> datetime | None:
+    """The newest value_time of the observations in a dataset"""
+    return current_observations(dataset).aggregate(latest=Max("value_time"))["latest"]
+
+
+def median_spacing(windows: Iterable[tuple[np.ndarray, np.ndarray] | None]) -> timedelta | None:
+    """The median of each window's median difference between times,
+    or None if no window has more than one distinct time
+    """
+    spacings = []
+    for window in windows:
+        if window is None:
+            continue
+
+        times, _ = window
+        gaps = np.diff(times)
+        gaps = gaps[gaps > 0]
+        if gaps.size:
+            spacings.append(np.median(gaps))
+
+    if not spacings:
+        return None
+
+    return timedelta(seconds=float(np.median(spacings)))
+
+
+def observation_spacing(dataset: ErddapDataset) -> timedelta | None:
+    """How far apart the observations in the dataset's recent windows are"""
+    timeseries_ids = current_observations(dataset).values_list("id", flat=True)
+    return median_spacing(load_windows(timeseries_ids).values())
+
+
+def has_future_timeseries(dataset: ErddapDataset) -> bool:
+    return dataset.timeseries_set.filter(
+        active=True,
+        end_time=None,
+        timeseries_type__in=TimeSeries.FUTURE_TYPES,
+    ).exists()
+
+
+def updated_interval(interval_seconds: float | None, spacing: timedelta) -> float:
+    """Fold a new spacing between values into the average update interval"""
+    spacing_seconds = min(max(spacing, MIN_INTERVAL), MAX_INTERVAL).total_seconds()
+
+    if interval_seconds is None:
+        return spacing_seconds
+
+    return INTERVAL_WEIGHT * spacing_seconds + (1 - INTERVAL_WEIGHT) * interval_seconds
+
+
+def next_refresh_time(
+    last_value_time: datetime,
+    interval_seconds: float,
+    misses: int,
+    now: datetime,
+) -> datetime:
+    """When a dataset should next be refreshed"""
+    interval = timedelta(seconds=interval_seconds)
+    expected = last_value_time + interval + max(interval * GRACE_FRACTION, MIN_GRACE)
+
+    if misses == 0 and expected > now:
+        return expected
+
+    retry = min(interval / 4 * 2 ** min(max(misses - 1, 0), MAX_DOUBLINGS), MAX_RETRY)
+    return now + max(retry, MIN_INTERVAL)
+
+
+def schedule_next_refresh(dataset: ErddapDataset, now: datetime | None = None) -> list[str]:
+    """Update the dataset's learned interval and next refresh time after a refresh.
+
+    Returns the fields that need to be saved.
+    """
+    now = now or timezone.now()
+    update_fields = ["last_value_time", "update_interval_seconds", "refresh_misses", "next_refresh"]
+
+    if has_future_timeseries(dataset):
+        dataset.next_refresh = None
+        return update_fields
+
+    latest = latest_observation_time(dataset)
+
+    if latest is not None and (dataset.last_value_time is None or latest > dataset.last_value_time):
+        spacing = observation_spacing(dataset)
+        if spacing is not None:
+            dataset.update_interval_seconds = updated_interval(dataset.update_interval_seconds, spacing)
+        dataset.last_value_time = latest
+        dataset.refresh_misses = 0
+    else:
+        dataset.refresh_misses += 1
+
+    if dataset.update_interval_seconds is None or dataset.last_value_time is None:
+        dataset.next_refresh = None
+    else:
+        dataset.next_refresh = next_refresh_time(
+            dataset.last_value_time,
+            dataset.update_interval_seconds,
+            dataset.refresh_misses,
+            now,
+        )
+
+    return update_fields
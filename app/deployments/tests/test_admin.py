@@ -15,6 +15,7 @@ from deployments.models import (
     Platform,
     TimeSeries,
 )
+from deployments.tasks.queue import USER_QUEUE
 from deployments.widgets import EsriOceanBasemapWidget
 
 
@@ -63,7 +64,7 @@ class PlatformAdminObjectActionsTestCase(TestCase):
         request = _make_request()
         self.admin.refresh_platform_datasets(request, self.platform)
 
-        mock_delay.assert_called_once_with(self.dataset.id)
+        mock_delay.assert_called_once_with(self.dataset.id, force=True, queue=USER_QUEUE)
 
     @patch("deployments.tasks.refresh.refresh_dataset.delay")
     def test_refresh_platform_datasets_no_timeseries(self, mock_delay):
@@ -93,7 +94,7 @@ class PlatformAdminObjectActionsTestCase(TestCase):
         request = _make_request()
         self.admin.refresh_platform_datasets(request, self.platform)
 
-        mock_delay.assert_called_once_with(self.dataset.id)
+        mock_delay.assert_called_once_with(self.dataset.id, force=True, queue=USER_QUEUE)
 
 
 @pytest.mark.django_db
@@ -117,7 +118,12 @@ class ErddapDatasetAdminObjectActionsTestCase(TestCase):
         request = _make_request()
         self.admin.refresh_erddap_dataset(request, self.dataset)
 
-        mock_delay.assert_called_once_with(self.dataset.id, healthcheck=False)
+        mock_delay.assert_called_once_with(
+            self.dataset.id,
+            healthcheck=False,
+            force=True,
+            queue=USER_QUEUE,
+        )
 
     def test_refresh_status_never_refreshed(self):
         """Regression: refresh_attempted=None must not raise TypeError."""
@@ -137,6 +143,19 @@ class ErddapDatasetAdminObjectActionsTestCase(TestCase):
         self.assertIn("yellow", result)
         self.assertIn("More than 1 hour ago", result)
 
+    def test_refresh_status_unchanged(self):
+        self.dataset.refresh_attempted = timezone.now() - timedelta(minutes=30)
+        self.dataset.refresh_result = ErddapDataset.RefreshResult.UNCHANGED
+        result = self.admin.refresh_status(self.dataset)
+        self.assertIn("Less than 1 hour ago", result)
+        self.assertIn("checked, unchanged", result)
+
+    def test_refresh_status_refreshed(self):
+        self.dataset.refresh_attempted = timezone.now() - timedelta(minutes=30)
+        self.dataset.refresh_result = ErddapDataset.RefreshResult.REFRESHED
+        result = self.admin.refresh_status(self.dataset)
+        self.assertIn("(refreshed)", result)
+
     def test_refresh_status_more_than_one_day(self):
         self.dataset.refresh_attempted = timezone.now() - timedelta(days=2)
         result = self.admin.refresh_status(self.dataset)
@@ -161,7 +180,7 @@ class ErddapServerAdminObjectActionsTestCase(TestCase):
         request = _make_request()
         self.admin.refresh_erddap_server(request, self.erddap)
 
-        mock_delay.assert_called_once_with(self.erddap.id, healthcheck=False)
+        mock_delay.assert_called_once_with(self.erddap.id, healthcheck=False, queue=USER_QUEUE)
 
 
 class PlatformAdminGisWidgetTestCase(TestCase):
@@ -1,3 +1,4 @@
+import gzip
 from unittest.mock import patch
 
 import geojson
@@ -12,6 +13,7 @@ from deployments.models import (
     Platform,
     TimeSeries,
 )
+from deployments.utils import platform_snapshots
 
 from .vcr import my_vcr
 
@@ -235,6 +237,25 @@ class BuoyBarnPlatformAPITestCase(APITestCase):
             ),
         )
 
+    def test_platform_list_snapshot(self):
+        platform_snapshots.build_snapshot("mariners")
+
+        with patch.object(platform_snapshots, "render_snapshot") as render_snapshot:
+            response = self.client.get("/api/platforms/", headers={"Accept-Encoding": "gzip, deflate"})
+
+        render_snapshot.assert_not_called()
+        self.assertEqual("gzip", response["Content-Encoding"])
+        self.assertIn("Accept-Encoding", response["Vary"])
+
+        geo = geojson.loads(gzip.decompress(response.content))
+        self.assertEqual("FeatureCollection", geo["type"])
+        self.assertEqual(60, len(geo["features"]))
+
+        response = self.client.get("/api/platforms/", headers={"Accept-Encoding": "gzip;q=0"})
+
+        self.assertNotIn("Content-Encoding", response)
+        self.assertEqual(60, len(geojson.loads(response.content)["features"]))
+
     def test_server_list(self):
         response = self.client.get("/api/servers/", format="json")
 
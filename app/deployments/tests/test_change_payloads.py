@@ -0,0 +1,64 @@
+import json
+
+from deployments.models import TimeSeries
+from deployments.utils.change_payloads import (
+    MAX_VALUES,
+    changed_groups,
+    merge_changes,
+    parse_change_payload,
+)
+
+
+def group(**constraints) -> list[TimeSeries]:
+    return [TimeSeries(variable="wtmp", constraints=constraints)]
+
+
+def test_parse_change_payload():
+    payload = b'{"station": ["44013", "44007"], "file": "/data/ndbc/44098_2024.nc", "count": 3}'
+
+    assert parse_change_payload(payload) == {
+        "file": ["44098_2024.nc"],
+        "station": ["44007", "44013"],
+    }
+
+
+def test_parse_change_payload_without_changes():
+    assert parse_change_payload(b"") is None
+    assert parse_change_payload(b"Dataset changed") is None
+    assert parse_change_payload(b'["44013"]') is None
+    assert parse_change_payload(b'{"count": 3}') is None
+
+    stations = [f"station_{i}" for i in range(MAX_VALUES + 1)]
+    assert parse_change_payload(json.dumps({"station": stations}).encode()) is None
+
+
+def test_merge_changes():
+    assert merge_changes({"station": ["44013"]}, {"station": ["44007"], "file": ["a.nc"]}) == {
+        "file": ["a.nc"],
+        "station": ["44007", "44013"],
+    }
+    assert merge_changes({"station": ["44013"]}, None) is None
+    assert merge_changes(None, {"station": ["44013"]}) is None
+
+
+def test_changed_groups():
+    groups = {
+        "44007": group(**{"station=": "44007"}),
+        "44013": group(**{"station=": "44013"}),
+        "depth": group(**{"depth=": 1.0}),
+    }
+
+    assert list(changed_groups(groups, {"station": ["44013"]})) == ["44013"]
+    assert list(changed_groups(groups, {"file": ["44007_2024.nc"]})) == ["44007"]
+    assert changed_groups(groups, {"station": ["44098"]}) == groups
+
+
+def test_changed_groups_match_whole_parts_of_file_names():
+    groups = {
+        "44007": group(**{"station=": "44007"}),
+        "M01_sbe37": group(**{"station=": "M01_sbe37"}),
+    }
+
+    assert list(changed_groups(groups, {"file": ["M01_sbe37-2024.nc"]})) == ["M01_sbe37"]
+    assert changed_groups(groups, {"file": ["144007_2024.nc"]}) == groups, "Not part of 144007"
+    assert changed_groups(groups, {"file": ["2024_44007a.nc"]}) == groups
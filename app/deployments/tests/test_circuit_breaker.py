@@ -0,0 +1,135 @@
+from uuid import uuid4
+
+import httpx
+import pytest
+from django.conf import settings
+from django_redis import get_redis_connection
+
+from deployments.utils import circuit_breaker
+from deployments.utils.circuit_breaker import CircuitState
+
+
+@pytest.fixture
+def server():
+    """A server URL with keys that won't collide with other tests"""
+    server = f"https://erddap.example.com/{uuid4()}/erddap"
+    yield server
+    circuit_breaker.reset_circuit(server)
+
+
+def open_circuit(server):
+    for _ in range(settings.ERDDAP_CIRCUIT_FAILURE_THRESHOLD):
+        circuit_breaker.record_failure(server)
+
+
+def end_open_period(server):
+    get_redis_connection("default").delete(circuit_breaker.circuit_keys(server)[2])
+
+
+def status_error(status_code: int) -> httpx.HTTPError:
+    request = httpx.Request("GET", "https://erddap.example.com/erddap/tabledap/test.csvp")
+    response = httpx.Response(status_code, request=request)
+    try:
+        raise httpx.HTTPStatusError("error", request=request, response=response)
+    except httpx.HTTPStatusError as cause:
+        try:
+            raise httpx.HTTPError(response.text) from cause
+        except httpx.HTTPError as error:
+            return error
+
+
+def test_closed_circuit_allows_requests(server):
+    assert circuit_breaker.circuit_allows(server)
+    assert circuit_breaker.circuit_state(server) == (CircuitState.CLOSED, None)
+
+
+def test_failures_open_circuit(server):
+    for _ in range(settings.ERDDAP_CIRCUIT_FAILURE_THRESHOLD - 1):
+        assert not circuit_breaker.record_failure(server)
+    assert circuit_breaker.circuit_allows(server)
+
+    assert circuit_breaker.record_failure(server)
+
+    assert not circuit_breaker.circuit_allows(server)
+    assert circuit_breaker.circuit_state(server)[0] == CircuitState.OPEN
+    with pytest.raises(circuit_breaker.CircuitOpenError):
+        circuit_breaker.check_circuit(server)
+
+
+def test_success_resets_failures(server):
+    for _ in range(settings.ERDDAP_CIRCUIT_FAILURE_THRESHOLD - 1):
+        circuit_breaker.record_failure(server)
+    circuit_breaker.record_success(server)
+
+    assert not circuit_breaker.record_failure(server)
+    assert circuit_breaker.circuit_allows(server)
+
+
+def test_half_open_allows_single_trial(server):
+    open_circuit(server)
+    end_open_period(server)
+
+    assert circuit_breaker.circuit_state(server) == (CircuitState.HALF_OPEN, None)
+    assert circuit_breaker.circuit_allows(server)
+    assert not circuit_breaker.circuit_allows(server)
+
+
+def test_failed_trial_reopens_circuit(server):
+    open_circuit(server)
+    end_open_period(server)
+    circuit_breaker.circuit_allows(server)
+
+    assert circuit_breaker.record_failure(server)
+
+    assert circuit_breaker.circuit_state(server)[0] == CircuitState.OPEN
+
+
+def test_successful_trial_closes_circuit(server):
+    open_circuit(server)
+    end_open_period(server)
+    circuit_breaker.circuit_allows(server)
+
+    circuit_breaker.record_success(server)
+
+    assert circuit_breaker.circuit_state(server) == (CircuitState.CLOSED, None)
+    assert circuit_breaker.circuit_allows(server)
+
+
+@pytest.mark.parametrize("status_code", [403, 408, 429])
+def test_status_codes_trip_circuit(status_code):
+    assert circuit_breaker.trips_circuit(status_error(status_code))
+
+
+def test_other_errors_do_not_trip_circuit():
+    assert circuit_breaker.trips_circuit(httpx.ReadTimeout("timed out"))
+    assert not circuit_breaker.trips_circuit(status_error(500))
+    assert not circuit_breaker.trips_circuit(ValueError("bad value"))
+
+
+def test_circuit_breaker_records_failures(server):
+    for _ in range(settings.ERDDAP_CIRCUIT_FAILURE_THRESHOLD):
+        with pytest.raises(httpx.ReadTimeout), circuit_breaker.circuit_breaker(server):
+            raise httpx.ReadTimeout("timed out")
+
+    with pytest.raises(circuit_breaker.CircuitOpenError), circuit_breaker.circuit_breaker(server):
+        pytest.fail("Requests should not be made with an open circuit")
+
+
+def test_error_response_closes_circuit(server):
+    open_circuit(server)
+    end_open_period(server)
+
+    with pytest.raises(httpx.HTTPError), circuit_breaker.circuit_breaker(server):
+        raise status_error(404)
+
+    assert circuit_breaker.circuit_state(server) == (CircuitState.CLOSED, None)
+
+
+def test_other_errors_leave_circuit_alone(server):
+    for _ in range(settings.ERDDAP_CIRCUIT_FAILURE_THRESHOLD - 1):
+        circuit_breaker.record_failure(server)
+
+    with pytest.raises(ValueError), circuit_breaker.circuit_breaker(server):
+        raise ValueError("bad value")
+
+    assert circuit_breaker.record_failure(server), "The failures should still be counted"
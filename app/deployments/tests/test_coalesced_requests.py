@@ -0,0 +1,86 @@
+import pandas as pd
+
+from deployments.models import ErddapServer, TimeSeries
+from deployments.utils.coalesced_requests import (
+    CoalescedRequest,
+    coalescable_columns,
+    plan_coalesced_requests,
+    split_dataframe,
+)
+
+server = ErddapServer(base_url="https://coastwatch.pfeg.noaa.gov/erddap")
+
+
+def group(variable: str, **constraints) -> list[TimeSeries]:
+    return [TimeSeries(variable=variable, constraints=constraints)]
+
+
+def test_coalescable_columns():
+    constraints = {"station=": "44007", "depth=": 1.0, "time>=": "2024-01-01"}
+    assert coalescable_columns(constraints) == ["station"]
+    assert coalescable_columns({"station!=": "44007"}) == []
+    assert coalescable_columns({"station=": 'needs "escaping"'}) == []
+
+
+def test_plan_combines_groups_that_differ_by_station():
+    groups = [group("wtmp", **{"station=": station}) for station in ["44007", "44013", "44098"]]
+    groups.append(group("sea_water_temperature", **{"depth=": 1.0}))
+
+    requests, remaining = plan_coalesced_requests(server, "cwwcNDBCMet", groups)
+
+    assert len(requests) == 1
+    assert requests[0].column == "station"
+    assert requests[0].request_constraints() == {"station=~": "44007|44013|44098"}
+    assert remaining == groups[3:]
+
+
+def test_plan_keeps_different_shared_constraints_apart():
+    groups = [
+        group("wtmp", **{"station=": "44007", "depth=": 1.0}),
+        group("wtmp", **{"station=": "44013", "depth=": 1.0}),
+        group("wtmp", **{"station=": "44098", "depth=": 2.0}),
+    ]
+
+    requests, remaining = plan_coalesced_requests(server, "cwwcNDBCMet", groups)
+
+    assert len(requests) == 1
+    assert requests[0].constraints == {"depth=": 1.0}
+    assert remaining == groups[2:]
+
+
+def test_plan_chunks_long_urls():
+    stations = 100
+    max_url_length = 600
+    groups = [group("wtmp", **{"station=": f"station_{i:03}"}) for i in range(stations)]
+
+    requests, remaining = plan_coalesced_requests(
+        server,
+        "cwwcNDBCMet",
+        groups,
+        max_url_length=max_url_length,
+    )
+
+    assert len(requests) > 1
+    assert remaining == []
+    assert sum(len(request.groups) for request in requests) == stations
+    for request in requests:
+        url = request.erddap(server, "cwwcNDBCMet").get_download_url(response="csvp")
+        assert len(url) <= max_url_length
+
+
+def test_split_dataframe_by_station():
+    request = CoalescedRequest("station", {})
+    request.groups = {"44007": [], "44013": []}
+    df = pd.DataFrame(
+        {
+            "time (UTC)": ["2024-01-01T00:00:00Z", "2024-01-01T00:00:00Z", "2024-01-01T01:00:00Z"],
+            "station": ["44007", "44013", "44007"],
+            "wtmp (degree_C)": [5.0, 6.0, 5.5],
+        },
+    )
+
+    frames = split_dataframe(request, df)
+
+    assert set(frames) == {"44007", "44013"}
+    assert frames["44007"]["wtmp (degree_C)"].tolist() == [5.0, 5.5]
+    assert frames["44013"]["wtmp (degree_C)"].tolist() == [6.0]
@@ -0,0 +1,40 @@
+import asyncio
+
+from deployments.tasks.concurrent import AdaptiveConcurrencyLimiter
+
+
+def test_limiter_bounds_requests_in_flight():
+    limit = 2
+    limiter = AdaptiveConcurrencyLimiter(limit)
+    in_flight = 0
+    most_in_flight = 0
+
+    async def request():
+        nonlocal in_flight, most_in_flight
+        await limiter.acquire()
+        in_flight += 1
+        most_in_flight = max(most_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        await limiter.release()
+
+    async def run():
+        await asyncio.gather(*(request() for _ in range(6)))
+
+    asyncio.run(run())
+
+    assert most_in_flight == limit
+
+
+def test_limiter_backoff_halves_concurrency():
+    limit = 4
+    limiter = AdaptiveConcurrencyLimiter(limit)
+
+    limiter.backoff()
+    assert limiter.limit == limit // 2
+
+    limiter.backoff()
+    assert limiter.limit == 1
+
+    limiter.backoff()
+    assert limiter.limit == 1
@@ -0,0 +1,117 @@
+from datetime import UTC, datetime, timedelta
+
+import pandas as pd
+
+from deployments.models import ErddapServer, TimeSeries
+from deployments.utils.erddap_datasets import (
+    ERDDAP_TIME_COLUMN,
+    merge_window,
+    parse_csvp,
+    sort_dataframe,
+    window_key,
+    window_start,
+)
+
+server = ErddapServer(base_url="http://www.neracoos.org/erddap")
+
+
+def erddap_df(times: list[datetime], values: list[float]) -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            ERDDAP_TIME_COLUMN: [time.strftime("%Y-%m-%dT%H:%M:%SZ") for time in times],
+            "sea_water_temperature (celsius)": values,
+        },
+    )
+
+
+def test_window_key_only_for_observations(settings):
+    settings.ERDDAP_INCREMENTAL_REFRESH = True
+    observation = TimeSeries(variable="sea_water_temperature", constraints={"depth=": 1.0})
+    forecast = TimeSeries(
+        variable="sea_water_temperature",
+        timeseries_type=TimeSeries.TimeSeriesType.FORECAST,
+    )
+
+    key = window_key(server, "M01_sbe37_all", observation.constraints, [observation])
+    assert key == window_key(server, "M01_sbe37_all", {"depth=": 1.0}, [observation])
+    assert key != window_key(server, "M01_sbe37_all", {"depth=": 20.0}, [observation])
+    assert window_key(server, "M01_sbe37_all", None, [forecast]) is None
+
+
+def test_window_key_disabled(settings):
+    settings.ERDDAP_INCREMENTAL_REFRESH = False
+    observation = TimeSeries(variable="sea_water_temperature")
+
+    assert window_key(server, "M01_sbe37_all", None, [observation]) is None
+
+
+def test_window_start_is_last_row():
+    now = datetime.now(UTC).replace(microsecond=0)
+    window = erddap_df([now - timedelta(hours=1), now], [1.0, 2.0])
+
+    assert window_start(window) == now
+    assert window_start(None) is None
+
+
+def test_merge_window_drops_repeated_and_old_rows():
+    now = datetime.now(UTC).replace(microsecond=0)
+    window = erddap_df([now - timedelta(hours=25), now - timedelta(hours=1), now], [0.0, 1.0, 2.0])
+    new_rows = erddap_df([now, now + timedelta(minutes=10)], [2.0, 3.0])
+
+    merged = merge_window(window, new_rows)
+
+    assert merged["sea_water_temperature (celsius)"].tolist() == [1.0, 2.0, 3.0]
+
+
+def test_merge_window_keeps_revised_values():
+    now = datetime.now(UTC).replace(microsecond=0)
+    window = erddap_df([now - timedelta(hours=1), now], [1.0, 2.0])
+    new_rows = erddap_df([now], [2.5])
+
+    merged = merge_window(window, new_rows)
+
+    assert merged["sea_water_temperature (celsius)"].tolist() == [1.0, 2.5]
+
+
+CSVP_RESPONSE = b"""station,time (UTC),wtmp (degree_C),wspd (m s-1)
+04007,2024-01-01T01:00:00Z,5.5,NaN
+04007,2024-01-01T00:00:00Z,5.0,3.2
+44013,2024-01-01T00:00:00Z,6.0,4.1
+"""
+
+
+def test_parse_csvp_types():
+    df = parse_csvp(CSVP_RESPONSE, ["time", "wtmp"], string_variables=["station"])
+
+    assert list(df.columns) == ["station", ERDDAP_TIME_COLUMN, "wtmp (degree_C)"]
+    assert str(df[ERDDAP_TIME_COLUMN].dt.tz) == "UTC"
+    assert df["wtmp (degree_C)"].dtype == "float64"
+    assert df["station"].tolist() == ["04007", "04007", "44013"]
+
+
+def test_parse_csvp_all_columns():
+    df = parse_csvp(CSVP_RESPONSE)
+
+    assert list(df.columns) == ["station", ERDDAP_TIME_COLUMN, "wtmp (degree_C)", "wspd (m s-1)"]
+    assert df["wspd (m s-1)"].isna().sum() == 1
+
+
+def test_parse_csvp_non_numeric_values():
+    response = b"""time (UTC),sensor\n2024-01-01T00:00:00Z,abc\n"""
+
+    df = parse_csvp(response, ["sensor"])
+
+    assert df["sensor"].tolist() == ["abc"]
+
+
+def test_sort_dataframe_sorts_out_of_order_rows():
+    df = sort_dataframe(parse_csvp(CSVP_RESPONSE), "cwwcNDBCMet")
+
+    assert df[ERDDAP_TIME_COLUMN].is_monotonic_increasing
+    assert df["wtmp (degree_C)"].tolist() == [5.0, 6.0, 5.5]
+
+
+def test_sort_dataframe_keeps_ordered_rows():
+    df = parse_csvp(CSVP_RESPONSE).iloc[1:]
+
+    assert sort_dataframe(df, "cwwcNDBCMet") is df
@@ -1,14 +1,19 @@
 """Tests for the erddap_mqtt management command."""
 
+import asyncio
 from io import StringIO
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
 from django.core.management import call_command
 from django.core.management.base import CommandError
+from django.db import OperationalError
 
 from deployments.management.commands.erddap_mqtt import Command, get_client_id
 from deployments.models import ErddapDataset, ErddapServer
+from deployments.tasks.queue import PUSH_QUEUE
+from deployments.utils.mqtt_gateway import MqttGateway, ServerSubscription, configured_servers
+from deployments.utils.mqtt_notifications import ChangeDebouncer, DatasetIndex
 
 
 class TestGetClientId:
@@ -92,6 +97,22 @@ class TestErddapMqttCommand:
         with pytest.raises(CommandError, match="No MQTT credentials configured"):
             call_command("erddap_mqtt", "no-creds-server")
 
+    def test_requires_server_or_all(self):
+        """Command should raise error when neither a server nor --all is given."""
+        with pytest.raises(CommandError, match="Give the slug of an ERDDAP server"):
+            call_command("erddap_mqtt")
+
+    @patch("deployments.management.commands.erddap_mqtt.MqttGateway")
+    def test_all_runs_gateway(self, gateway_class):
+        """--all should subscribe to every server from the gateway."""
+        gateway_class.return_value.run = AsyncMock()
+        quiet_seconds = 5
+
+        call_command("erddap_mqtt", "--all", "--quiet-seconds", str(quiet_seconds), stdout=StringIO())
+
+        gateway_class.return_value.run.assert_awaited_once()
+        assert gateway_class.call_args.args[0] == quiet_seconds
+
     def test_get_erddap_server_success(self, command, erddap_server):
         """get_erddap_server should return the server when valid."""
         result = command.get_erddap_server("test-server")
@@ -216,14 +237,24 @@ class TestOnMessageCallback:
         command.style = MagicMock()
         command.style.SUCCESS = lambda x: x
 
+        command.debouncer = ChangeDebouncer(quiet_seconds=0, max_delay_seconds=0)
+
         on_message = command.create_on_message_callback(erddap_server)
 
         mock_msg = MagicMock()
         mock_msg.topic = "change/test_dataset"
 
         on_message(None, None, mock_msg)
+        mock_refresh.delay.assert_not_called()
 
-        mock_refresh.delay.assert_called_once_with(erddap_dataset.id, clear_end_time=True)
+        command.schedule_due_refreshes(erddap_server)
+
+        mock_refresh.delay.assert_called_once_with(
+            erddap_dataset.id,
+            clear_end_time=True,
+            queue=PUSH_QUEUE,
+            changes=None,
+        )
 
     @patch("deployments.management.commands.erddap_mqtt.single_refresh_dataset")
     def test_on_message_ignores_unknown_dataset(self, mock_refresh, erddap_server):
@@ -271,14 +302,366 @@ class TestOnMessageCallback:
         command.style = MagicMock()
         command.style.SUCCESS = lambda x: x
 
+        command.debouncer = ChangeDebouncer(quiet_seconds=0, max_delay_seconds=0)
+
         on_message = command.create_on_message_callback(erddap_server)
 
         mock_msg = MagicMock()
         mock_msg.topic = "change/category/subcategory/test_dataset"
 
         on_message(None, None, mock_msg)
+        command.schedule_due_refreshes(erddap_server)
+
+        mock_refresh.delay.assert_called_once_with(
+            erddap_dataset.id,
+            clear_end_time=True,
+            queue=PUSH_QUEUE,
+            changes=None,
+        )
+
+    @patch("deployments.management.commands.erddap_mqtt.count_notifications")
+    @patch("deployments.management.commands.erddap_mqtt.single_refresh_dataset")
+    def test_on_message_coalesces_bursts(
+        self,
+        mock_refresh,
+        count_notifications,
+        erddap_server,
+        erddap_dataset,
+    ):
+        """A burst of notifications for a dataset should schedule a single refresh."""
+        now = [0.0]
+        command = Command()
+        command.stdout = StringIO()
+        command.style = MagicMock()
+        command.style.SUCCESS = lambda x: x
+        command.debouncer = ChangeDebouncer(quiet_seconds=5, max_delay_seconds=60, clock=lambda: now[0])
+
+        on_message = command.create_on_message_callback(erddap_server)
+
+        mock_msg = MagicMock()
+        mock_msg.topic = "change/test_dataset"
+
+        for second in (0, 2, 4):
+            now[0] = second
+            on_message(None, None, mock_msg)
+            command.schedule_due_refreshes(erddap_server)
+
+        mock_refresh.delay.assert_not_called()
+
+        now[0] = 9
+        command.schedule_due_refreshes(erddap_server)
+        command.schedule_due_refreshes(erddap_server)
+
+        mock_refresh.delay.assert_called_once()
+        count_notifications.assert_any_call(erddap_server, messages=1)
+        count_notifications.assert_called_with(erddap_server, refreshes=1)
+
+    @patch("deployments.management.commands.erddap_mqtt.count_notifications")
+    @patch("deployments.management.commands.erddap_mqtt.single_refresh_dataset")
+    def test_on_message_passes_changes(
+        self,
+        mock_refresh,
+        count_notifications,
+        erddap_server,
+        erddap_dataset,
+    ):
+        """Stations from the change payloads of a burst should be refreshed together."""
+        command = Command()
+        command.stdout = StringIO()
+        command.style = MagicMock()
+        command.style.SUCCESS = lambda x: x
+        command.debouncer = ChangeDebouncer(quiet_seconds=0, max_delay_seconds=0)
+
+        on_message = command.create_on_message_callback(erddap_server)
+        for payload in (b'{"station": "B02"}', b'{"station": ["A01", "B02"]}'):
+            on_message(None, None, MagicMock(topic="change/test_dataset", payload=payload))
+        command.schedule_due_refreshes(erddap_server)
+
+        mock_refresh.delay.assert_called_once_with(
+            erddap_dataset.id,
+            clear_end_time=True,
+            queue=PUSH_QUEUE,
+            changes={"station": ["A01", "B02"]},
+        )
+
+    @patch("deployments.management.commands.erddap_mqtt.count_notifications")
+    @patch("deployments.management.commands.erddap_mqtt.single_refresh_dataset")
+    def test_failed_scheduling_is_retried(
+        self,
+        mock_refresh,
+        count_notifications,
+        erddap_server,
+        erddap_dataset,
+    ):
+        """Changes for a refresh that couldn't be scheduled should be kept for the next try."""
+        command = Command()
+        command.stdout = StringIO()
+        command.style = MagicMock()
+        command.style.SUCCESS = lambda x: x
+        command.debouncer = ChangeDebouncer(quiet_seconds=0, max_delay_seconds=0)
+
+        on_message = command.create_on_message_callback(erddap_server)
+        on_message(None, None, MagicMock(topic="change/test_dataset", payload=b'{"station": "A01"}'))
+
+        mock_refresh.delay.side_effect = ConnectionError("Broker unavailable")
+        command.schedule_due_refreshes(erddap_server)
+
+        assert command.debouncer.pending[erddap_dataset.id].changes == {"station": ["A01"]}
 
-        mock_refresh.delay.assert_called_once_with(erddap_dataset.id, clear_end_time=True)
+        mock_refresh.delay.side_effect = None
+        command.schedule_due_refreshes(erddap_server)
+
+        mock_refresh.delay.assert_called_with(
+            erddap_dataset.id,
+            clear_end_time=True,
+            queue=PUSH_QUEUE,
+            changes={"station": ["A01"]},
+        )
+        assert command.debouncer.pending == {}
+
+
+@pytest.mark.django_db
+class TestDatasetIndex:
+    """Tests for matching messages to datasets without querying the database."""
+
+    @pytest.fixture
+    def erddap_server(self):
+        return ErddapServer.objects.create(
+            name="test-server",
+            base_url="http://test.erddap.server/erddap",
+        )
+
+    @patch("deployments.management.commands.erddap_mqtt.count_notifications")
+    def test_on_message_does_not_query(
+        self,
+        count_notifications,
+        erddap_server,
+        django_assert_num_queries,
+    ):
+        ErddapDataset.objects.create(name="test_dataset", server=erddap_server)
+        command = Command()
+        command.stdout = StringIO()
+        command.style = MagicMock()
+
+        on_message = command.create_on_message_callback(erddap_server)
+
+        with django_assert_num_queries(0):
+            for topic in ("change/test_dataset", "change/unknown_dataset"):
+                on_message(None, None, MagicMock(topic=topic))
+
+        assert list(command.debouncer.pending) == [command.dataset_index.get("test_dataset")]
+        count_notifications.assert_not_called()
+
+        command.schedule_due_refreshes(erddap_server)
+
+        count_notifications.assert_called_once_with(erddap_server, messages=2, unknown=1)
+
+    @patch("deployments.utils.mqtt_notifications.close_old_connections")
+    def test_reloads_when_stale(self, close_old_connections, erddap_server):
+        now = [0.0]
+        refresh_seconds = 60
+        index = DatasetIndex(erddap_server, refresh_seconds=refresh_seconds, clock=lambda: now[0])
+        index.load()
+        dataset = ErddapDataset.objects.create(name="new_dataset", server=erddap_server)
+
+        now[0] = 30
+        index.reload_if_stale()
+        assert index.get("new_dataset") is None
+        assert index.seconds_until_stale() == refresh_seconds - now[0]
+
+        now[0] = refresh_seconds
+        index.reload_if_stale()
+        assert index.get("new_dataset") == dataset.id
+
+
+class TestChangeDebouncer:
+    """Tests for coalescing change notifications."""
+
+    def test_due_after_quiet_window(self):
+        now = [0.0]
+        debouncer = ChangeDebouncer(quiet_seconds=10, max_delay_seconds=60, clock=lambda: now[0])
+
+        debouncer.notify(1)
+        now[0] = 8
+        debouncer.notify(1)
+        debouncer.notify(2)
+
+        now[0] = 17
+        assert debouncer.pop_due() == {}
+
+        now[0] = 18
+        assert debouncer.pop_due() == {1: 2, 2: 1}
+        assert debouncer.pop_due() == {}
+
+    def test_due_after_max_delay(self):
+        now = [0.0]
+        debouncer = ChangeDebouncer(quiet_seconds=10, max_delay_seconds=30, clock=lambda: now[0])
+
+        for second in range(0, 31, 5):
+            now[0] = second
+            debouncer.notify(1)
+
+        assert debouncer.pop_due() == {1: 7}, "Refreshed even though notifications keep coming"
+
+
+def mqtt_server(server_id: int, broker: str = "mqtt.test.server") -> ErddapServer:
+    return ErddapServer(
+        id=server_id,
+        name=f"server-{server_id}",
+        mqtt_broker=broker,
+        mqtt_port=1883,
+        mqtt_username="test_user",
+        mqtt_password="test_password",
+    )
+
+
+@patch("deployments.utils.mqtt_gateway.DatasetIndex.load")
+@patch("deployments.utils.mqtt_gateway.mqtt.Client")
+class TestMqttGateway:
+    """Tests for subscribing to every configured server from one event loop."""
+
+    def sync(self, gateway: MqttGateway, servers: list[ErddapServer]):
+        async def sync():
+            with patch(
+                "deployments.utils.mqtt_gateway.configured_servers",
+                return_value={server.id: server for server in servers},
+            ):
+                await gateway.sync_servers()
+
+        asyncio.run(sync())
+
+    def test_follows_configured_servers(self, client_class, load):
+        clients = {}
+        client_class.side_effect = lambda *args, client_id: clients.setdefault(client_id, MagicMock())
+        gateway = MqttGateway(10, 60, 60, client_id="gateway")
+
+        self.sync(gateway, [mqtt_server(1), mqtt_server(2)])
+        assert set(gateway.subscriptions) == {1, 2}
+        clients["gateway-server-1"].connect_async.assert_called_once_with("mqtt.test.server", 1883, 60)
+        clients["gateway-server-1"].reconnect.assert_called_once()
+        first = gateway.subscriptions[1]
+
+        self.sync(gateway, [mqtt_server(1), mqtt_server(2, broker="mqtt.other.server")])
+        assert gateway.subscriptions[1] is first, "Unchanged servers keep their connection"
+        clients["gateway-server-2"].disconnect.assert_called_once()
+        assert gateway.subscriptions[2].config.broker == "mqtt.other.server"
+
+        self.sync(gateway, [mqtt_server(2, broker="mqtt.other.server")])
+        assert set(gateway.subscriptions) == {2}
+        clients["gateway-server-1"].disconnect.assert_called_once()
+
+    @patch("deployments.utils.mqtt_gateway.TICK_SECONDS", 0)
+    @patch("deployments.utils.mqtt_gateway.configured_servers")
+    def test_database_errors_keep_subscriptions(self, configured_servers, client_class, load):
+        class StopGateway(Exception):
+            pass
+
+        first = mqtt_server(1)
+        syncs = [
+            {1: first},
+            OperationalError("Database unavailable"),
+            {1: first, 2: mqtt_server(2)},
+            StopGateway,
+        ]
+        configured_servers.side_effect = syncs
+        gateway = MqttGateway(10, 60, index_refresh_seconds=0, client_id="gateway")
+
+        with pytest.raises(StopGateway):
+            asyncio.run(gateway.run())
+
+        assert configured_servers.call_count == len(syncs)
+        assert set(gateway.subscriptions) == {1, 2}, "Servers are synced again after the error"
+        assert gateway.subscriptions[1].server is first, "Subscriptions are kept through the error"
+        assert not gateway.subscriptions[1].stopped
+
+    @patch("deployments.utils.mqtt_gateway.count_notifications")
+    @patch("deployments.utils.mqtt_gateway.single_refresh_dataset")
+    def test_tick_enqueues_due_refreshes(self, mock_refresh, count_notifications, client_class, load):
+        now = [0.0]
+        server = mqtt_server(1)
+
+        async def run():
+            subscription = ServerSubscription(
+                server,
+                asyncio.get_running_loop(),
+                ChangeDebouncer(quiet_seconds=10, max_delay_seconds=60, clock=lambda: now[0]),
+                index_refresh_seconds=60,
+                client_id="gateway-server-1",
+            )
+            subscription.index.ids = {"test_dataset": 42}
+            subscription.index.loaded = subscription.index.clock()
+
+            for topic, payload in (
+                ("change/test_dataset", b'{"station": "A01"}'),
+                ("change/test_dataset", b'{"station": "A01"}'),
+                ("change/unknown", b""),
+            ):
+                subscription.on_message(None, None, MagicMock(topic=topic, payload=payload))
+            await subscription.tick()
+            mock_refresh.delay.assert_not_called()
+            count_notifications.assert_called_once_with(server, messages=3, unknown=1)
+
+            now[0] = 10
+            await subscription.tick()
+
+        asyncio.run(run())
+
+        mock_refresh.delay.assert_called_once_with(
+            42,
+            clear_end_time=True,
+            queue=PUSH_QUEUE,
+            changes={"station": ["A01"]},
+        )
+        count_notifications.assert_called_with(server, refreshes=1)
+
+    @patch("deployments.utils.mqtt_gateway.count_notifications")
+    @patch("deployments.utils.mqtt_gateway.single_refresh_dataset")
+    def test_failed_refreshes_are_retried(self, mock_refresh, count_notifications, client_class, load):
+        server = mqtt_server(1)
+        attempts = [ConnectionError("Broker unavailable"), None]
+        mock_refresh.delay.side_effect = attempts
+
+        async def run():
+            subscription = ServerSubscription(
+                server,
+                asyncio.get_running_loop(),
+                ChangeDebouncer(quiet_seconds=0, max_delay_seconds=0),
+                index_refresh_seconds=60,
+                client_id="gateway-server-1",
+            )
+            subscription.index.ids = {"test_dataset": 42}
+            subscription.index.loaded = subscription.index.clock()
+
+            subscription.on_message(None, None, MagicMock(topic="change/test_dataset", payload=b""))
+            await subscription.tick()
+            assert list(subscription.debouncer.pending) == [42]
+
+            await subscription.tick()
+            assert subscription.debouncer.pending == {}
+
+        asyncio.run(run())
+
+        assert mock_refresh.delay.call_count == len(attempts)
+        count_notifications.assert_called_with(server, refreshes=1)
+
+
+@pytest.mark.django_db
+def test_configured_servers():
+    server = ErddapServer.objects.create(
+        name="test-server",
+        base_url="http://test.erddap.server/erddap",
+        mqtt_broker="mqtt.test.server",
+        mqtt_username="test_user",
+        mqtt_password="test_password",
+    )
+    ErddapServer.objects.create(name="no-mqtt-server", base_url="http://test.erddap.server/erddap")
+    ErddapServer.objects.create(
+        name="no-creds-server",
+        base_url="http://test.erddap.server/erddap",
+        mqtt_broker="mqtt.test.server",
+    )
+
+    assert configured_servers() == {server.id: server}
 
 
 @pytest.mark.django_db
@@ -0,0 +1,74 @@
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from deployments import standard_names
+from deployments.benchmarks import legacy
+from deployments.models import DataType, TimeSeries
+from deployments.tasks.extrema import group_extrema
+from deployments.utils.erddap_datasets import ERDDAP_TIME_COLUMN
+from deployments.utils.group_arrays import GroupArrays
+
+
+def tide_df() -> pd.DataFrame:
+    times = pd.date_range("2024-01-01", periods=6 * 48, freq=timedelta(minutes=10), tz="UTC")
+    hours = np.arange(len(times)) / 6
+    water_level = np.sin(2 * np.pi * hours / 12.42)
+    temperature = np.linspace(5, 8, len(times))
+    temperature[10] = np.nan
+
+    return pd.DataFrame(
+        {
+            ERDDAP_TIME_COLUMN: times,
+            "water_level (m)": water_level,
+            "temperature (celsius)": temperature,
+            "empty (m)": np.nan,
+        },
+    )
+
+
+def group_timeseries() -> list[TimeSeries]:
+    return [
+        TimeSeries(
+            variable="water_level",
+            data_type=DataType(standard_name=standard_names.WATER_LEVEL[0]),
+        ),
+        TimeSeries(variable="temperature", data_type=DataType(standard_name="sea_water_temperature")),
+        TimeSeries(variable="empty", data_type=DataType(standard_name="sea_water_temperature")),
+    ]
+
+
+def test_group_extrema_matches_pandas_per_series():
+    df = tide_df()
+    timeseries = group_timeseries()
+
+    arrays = GroupArrays.from_dataframe(df, ["water_level", "temperature", "empty"])
+
+    extrema = group_extrema(arrays, timeseries)
+
+    for ts in timeseries[:2]:
+        expected = legacy.extrema_for_timeseries(ts, legacy.filter_dataframe(df, ts.variable))
+        assert extrema[ts.variable] == expected
+
+    assert "empty" not in extrema
+
+
+def test_group_extrema_tides_alternate():
+    extrema = group_extrema(
+        GroupArrays.from_dataframe(tide_df(), ["water_level", "temperature"]),
+        group_timeseries(),
+    )
+
+    # Two days of a 12.42 hour tide has 8 highs and lows
+    tides_in_two_days = 8
+    tides = [tide["tide"] for tide in extrema["water_level"]["tides"]]
+    assert len(tides) == tides_in_two_days
+    assert all(current != following for current, following in zip(tides, tides[1:], strict=False))
+    assert "tides" not in extrema["temperature"]
+
+
+def test_group_extrema_without_rows():
+    arrays = GroupArrays.from_dataframe(tide_df().iloc[:0], ["water_level", "temperature"])
+
+    assert group_extrema(arrays, group_timeseries()) == {}
@@ -0,0 +1,70 @@
+from datetime import UTC, datetime, timedelta
+from http import HTTPStatus
+
+import httpx
+import pytest
+
+from deployments.benchmarks.fake_erddap import (
+    FORECAST_HOURS,
+    FakeErddap,
+    FakeErddapConfig,
+    parse_tabledap_query,
+)
+from deployments.tasks.error_handling import is_backoff_error
+from deployments.utils.erddap_datasets import parse_csvp, raise_for_erddap_status
+
+
+@pytest.fixture
+def fake():
+    with FakeErddap(FakeErddapConfig(latency_seconds=0, stations=3)) as fake:
+        yield fake
+
+
+def test_parse_tabledap_query():
+    variables, constraints = parse_tabledap_query(
+        "time,station,wspd&station=~%2241000%7C41001%22&time%3E=1760000000.0",
+    )
+
+    assert variables == ["time", "station", "wspd"]
+    assert constraints == {"station=~": "41000|41001", "time>=": "1760000000.0"}
+
+
+def test_tabledap_rows_for_stations(fake):
+    start = (datetime.now(UTC) - timedelta(hours=2)).strftime("%Y-%m-%dT%H:%M:%SZ")
+    response = httpx.get(
+        f"{fake.url}/tabledap/cwwcNDBCMet.csvp?time,station,wspd"
+        f'&station=~"41000|41001|99999"&time>={start}',
+    )
+
+    df = parse_csvp(response.content, ["wspd"], string_variables=["station"])
+
+    assert response.status_code == HTTPStatus.OK
+    assert set(df["station"]) == {"41000", "41001"}
+    assert len(df) in {24, 26}, "A row every 10 minutes for each station"
+
+
+def test_tabledap_without_rows(fake):
+    future = (datetime.now(UTC) + timedelta(days=1)).strftime("%Y-%m-%dT%H:%M:%SZ")
+    response = httpx.get(f"{fake.url}/tabledap/cwwcNDBCMet.csvp?time,wspd&time>={future}")
+
+    assert response.status_code == HTTPStatus.NOT_FOUND
+    assert "nRows = 0" in response.text
+
+
+def test_injected_errors_are_backoffs():
+    with FakeErddap(FakeErddapConfig(latency_seconds=0, error_rates={429: 1})) as fake:
+        response = httpx.get(f"{fake.url}/tabledap/cwwcNDBCMet.csvp?time,wspd")
+
+    with pytest.raises(httpx.HTTPError) as error:
+        raise_for_erddap_status(response)
+
+    assert is_backoff_error(error.value)
+    assert fake.requests[429] == 1
+
+
+def test_griddap_json(fake):
+    response = httpx.get(f"{fake.url}/griddap/forecast.json?Tair[(last)][(43.0)][(-70.0)]")
+
+    table = response.json()["table"]
+    assert table["columnNames"] == ["time", "latitude", "longitude", "Tair"]
+    assert len(table["rows"]) == FORECAST_HOURS
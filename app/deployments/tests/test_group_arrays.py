@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from deployments.utils.erddap_datasets import ERDDAP_TIME_COLUMN
+from deployments.utils.group_arrays import GroupArrays
+
+
+@pytest.fixture
+def group_df() -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            ERDDAP_TIME_COLUMN: pd.to_datetime(
+                ["2024-01-01T00:00:00Z", "2024-01-01T01:00:00Z", None, "2024-01-01T03:00:00Z"],
+                utc=True,
+            ),
+            "temperature (celsius)": [5.0, np.nan, 7.0, 8.0],
+            "salinity (1e-3)": [31.0, 31.5, 32.0, np.nan],
+            "depth (m)": [1.0, 1.0, 1.0, 1.0],
+        },
+    )
+
+
+def test_series_views_share_group_arrays(group_df):
+    arrays = GroupArrays.from_dataframe(group_df, ["temperature", "salinity"])
+
+    assert arrays.block.shape == (4, 2)
+    assert "depth" not in arrays.columns
+
+    temperature = arrays.series("temperature")
+    assert np.shares_memory(temperature.value, arrays.block)
+    assert temperature.time is arrays.time
+
+
+def test_series_mask_invalid_times_and_values(group_df):
+    arrays = GroupArrays.from_dataframe(group_df, ["temperature", "salinity"])
+
+    assert arrays.series("temperature").valid_rows().tolist() == [0, 3]
+    assert arrays.series("salinity").valid_rows().tolist() == [0, 1]
+
+
+def test_series_timestamps_are_utc(group_df):
+    series = GroupArrays.from_dataframe(group_df, ["temperature"]).series("temperature")
+
+    assert series.timestamp(3) == pd.Timestamp("2024-01-01T03:00:00Z")
+    assert series.timestamp(3).tz is not None
+
+
+def test_string_times_and_values(group_df):
+    group_df[ERDDAP_TIME_COLUMN] = ["2024-01-01T00:00:00Z", "2024-01-01T01:00:00Z", None, "bad"]
+    group_df["temperature (celsius)"] = ["5.0", "warm", "7.0", "8.0"]
+
+    series = GroupArrays.from_dataframe(group_df, ["temperature"]).series("temperature")
+
+    assert series.valid_rows().tolist() == [0]
+
+
+def test_missing_variable(group_df):
+    arrays = GroupArrays.from_dataframe(group_df, ["temperature"])
+
+    with pytest.raises(KeyError):
+        arrays.series("salinity")
@@ -0,0 +1,46 @@
+from uuid import uuid4
+
+import pytest
+
+from deployments.models import ErddapServer
+from deployments.utils import http_clients
+
+
+@pytest.fixture
+def server():
+    return ErddapServer(
+        base_url=f"https://erddap.example.com/{uuid4()}/erddap/",
+        request_timeout_seconds=45,
+        request_concurrency=3,
+    )
+
+
+def test_client_is_reused_for_server(server):
+    client = http_clients.server_client(server)
+
+    assert http_clients.server_client(server) is client
+    assert http_clients.server_client(server.base_url.rstrip("/")) is client
+
+
+def test_client_uses_server_timeout(server):
+    client = http_clients.server_client(server)
+
+    assert client.timeout.read == server.request_timeout_seconds
+    assert client.follow_redirects
+
+
+def test_client_replaced_when_server_changes(server):
+    client = http_clients.server_client(server)
+
+    server.request_timeout_seconds = 10
+    replacement = http_clients.server_client(server)
+
+    assert replacement is not client
+    assert replacement.timeout.read == server.request_timeout_seconds
+    assert not client.is_closed, "Other threads may still be using the old client"
+
+
+def test_http2_needs_setting(settings):
+    settings.ERDDAP_HTTP2 = False
+
+    assert not http_clients.http2_enabled()
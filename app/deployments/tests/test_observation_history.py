@@ -0,0 +1,120 @@
+from datetime import UTC, date, datetime
+from http import HTTPStatus
+
+import numpy as np
+import pandas as pd
+import pytest
+from rest_framework.test import APIClient
+
+from deployments.models import (
+    DataType,
+    ErddapDataset,
+    ErddapServer,
+    ObservationRollup,
+    Platform,
+    TimeSeries,
+)
+from deployments.utils import observation_history
+from deployments.utils.group_arrays import SeriesArrays
+
+
+@pytest.fixture
+def timeseries(db):
+    observation_history.known_partitions.clear()
+    server = ErddapServer.objects.create(name="history", base_url="https://erddap.example.com/erddap")
+    return TimeSeries.objects.create(
+        platform=Platform.objects.create(name="M01"),
+        data_type=DataType.objects.get(standard_name="air_temperature"),
+        variable="air_temperature",
+        dataset=ErddapDataset.objects.create(name="M01_met_all", server=server),
+    )
+
+
+def rows(start: str, values: list[float]) -> tuple[np.ndarray, np.ndarray]:
+    times = pd.date_range(start, periods=len(values), freq="30min", tz="UTC")
+    return times.astype("int64").to_numpy() / 1e9, np.array(values)
+
+
+def test_months_between():
+    assert observation_history.months_between(
+        datetime(2026, 11, 30, tzinfo=UTC),
+        datetime(2027, 1, 1, tzinfo=UTC),
+    ) == [date(2026, 11, 1), date(2026, 12, 1), date(2027, 1, 1)]
+
+
+def test_new_rows_since_last_value_time():
+    time = pd.date_range("2026-10-17", periods=4, freq="h").to_numpy(dtype="datetime64[ns]")
+    time[3] = time[2]
+    value = np.array([1, 2, 3, 4], dtype="float64")
+    series_arrays = SeriesArrays(time=time, value=value, valid=~np.isnan(value))
+
+    seconds, values = observation_history.new_rows(
+        series_arrays,
+        datetime(2026, 10, 17, 2, tzinfo=UTC),
+    )
+
+    assert values.tolist() == [2, 3], "Rows from an hour before, with one value for each time"
+    assert seconds[0] == datetime(2026, 10, 17, 1, tzinfo=UTC).timestamp()
+
+
+@pytest.mark.parametrize(
+    ("seconds", "tier"),
+    [(0, "raw"), (600, "raw"), (3600, "hour"), (80_000, "hour"), (86_400 * 7, "day")],
+)
+def test_tier_for_resolution(seconds, tier):
+    assert observation_history.tier_for_resolution(seconds) == tier
+
+
+def test_rollups_are_updated_as_observations_arrive(timeseries):
+    first, second = [1, 3, 5], [7, 8]
+    observation_history.record_observations({timeseries.id: rows("2026-10-31T23:00Z", first)})
+    observation_history.record_observations({timeseries.id: rows("2026-11-01T00:00Z", second)})
+
+    assert timeseries.observations.count() == len(first) + len(second) - 1, (
+        "The value at midnight is replaced"
+    )
+    assert set(observation_history.partitions()) == {date(2026, 10, 1), date(2026, 11, 1)}
+
+    hours = timeseries.observation_rollups.filter(tier=ObservationRollup.Tier.HOUR).order_by("bucket")
+    assert [(hour.count, hour.mean) for hour in hours] == [(2, 2), (2, 7.5)], (
+        "The second hour is recalculated with the updated value"
+    )
+
+    days = timeseries.observation_rollups.filter(tier=ObservationRollup.Tier.DAY).order_by("bucket")
+    assert [(day.minimum, day.maximum) for day in days] == [(1, 3), (7, 8)]
+
+
+def test_dropping_old_partitions_keeps_rollups(timeseries):
+    # Two values on the last day of September, and two on the first of October
+    values_per_month = 2
+    observation_history.record_observations({timeseries.id: rows("2026-09-30T23:00Z", [1, 2, 3, 4])})
+
+    dropped = observation_history.drop_partitions_before(date(2026, 10, 1))
+
+    assert dropped == [observation_history.partition_name(date(2026, 9, 1))]
+    assert timeseries.observations.count() == values_per_month
+    days = timeseries.observation_rollups.filter(tier=ObservationRollup.Tier.DAY)
+    assert days.count() == len(dropped) + 1
+
+
+def test_history_api(timeseries, settings):
+    settings.OBSERVATION_HISTORY = True
+    observation_history.record_observations({timeseries.id: rows("2026-10-17T00:00Z", [1, 2, 3, 4])})
+    client = APIClient()
+
+    raw = client.get(
+        f"/api/timeseries/{timeseries.id}/history/",
+        {"start": "2026-10-17T00:00Z", "end": "2026-10-18T00:00Z"},
+    ).json()
+    hourly = client.get(
+        f"/api/timeseries/{timeseries.id}/history/",
+        {"start": "2026-10-17T00:30Z", "end": "2026-10-18T00:00Z", "resolution": 7200},
+    ).json()
+    bad = client.get(f"/api/timeseries/{timeseries.id}/history/", {"resolution": "weekly"})
+
+    assert raw["tier"] == "raw"
+    assert raw["value"] == [1, 2, 3, 4]
+    assert hourly["tier"] == "hour"
+    assert hourly["value"] == [1.5, 3.5], "Includes the hour that the range starts in"
+    assert hourly["count"] == [2, 2]
+    assert bad.status_code == HTTPStatus.BAD_REQUEST
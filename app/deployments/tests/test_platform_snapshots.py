@@ -0,0 +1,114 @@
+import gzip
+from unittest.mock import call, patch
+
+from deployments.models import ErddapDataset, ErddapServer, Platform
+from deployments.tasks import platform_snapshots as snapshot_tasks
+from deployments.tasks import queue
+from deployments.utils import platform_snapshots
+
+
+def test_visibility_key():
+    assert platform_snapshots.visibility_key(None) == "mariners"
+    assert platform_snapshots.visibility_key("DEV") == "dev"
+    assert platform_snapshots.visibility_key("everything") == "mariners"
+
+
+def test_accepted_encodings():
+    assert platform_snapshots.accepted_encodings("gzip, deflate, br;q=1.0") == {"gzip", "deflate", "br"}
+    assert platform_snapshots.accepted_encodings("br;q=0, gzip;q=0.5") == {"gzip"}
+    assert platform_snapshots.accepted_encodings("") == set()
+
+
+def test_choose_encoding():
+    encoded = platform_snapshots.encode_snapshot(b'{"type": "FeatureCollection"}')
+
+    assert platform_snapshots.choose_encoding(encoded, "") == ("identity", encoded["identity"])
+    encoding, content = platform_snapshots.choose_encoding(encoded, "gzip, deflate")
+    assert encoding == "gzip"
+    assert gzip.decompress(content) == b'{"type": "FeatureCollection"}'
+
+
+@patch("deployments.utils.platform_snapshots.brotli", None)
+@patch("deployments.utils.platform_snapshots.COMPRESSED_ENCODINGS", ["gzip"])
+def test_choose_encoding_without_brotli():
+    encoded = platform_snapshots.encode_snapshot(b"{}")
+
+    assert "br" not in encoded
+    assert platform_snapshots.choose_encoding(encoded, "br")[0] == "identity"
+    assert platform_snapshots.choose_encoding(encoded, "br, gzip")[0] == "gzip"
+
+
+@patch("deployments.tasks.platform_snapshots.build_snapshot")
+def test_rebuild_platform_snapshots(build_snapshot):
+    # Saves in other tests may have queued a rebuild
+    queue.task_finished(snapshot_tasks.rebuild_platform_snapshots.name, [])
+    assert not queue.task_queued(snapshot_tasks.rebuild_platform_snapshots.name, [], {})
+
+    snapshot_tasks.rebuild_platform_snapshots()
+
+    assert build_snapshot.call_args_list == [
+        call(visibility) for visibility in platform_snapshots.VISIBILITY_KEYS
+    ]
+    assert not queue.task_queued(snapshot_tasks.rebuild_platform_snapshots.name, [], {}), (
+        "Rebuilding should let another rebuild be queued"
+    )
+    queue.task_finished(snapshot_tasks.rebuild_platform_snapshots.name, [])
+
+
+@patch("deployments.tasks.platform_snapshots.rebuild_platform_snapshots.apply_async")
+def test_schedule_snapshot_rebuild_once(apply_async):
+    queue.task_finished(snapshot_tasks.rebuild_platform_snapshots.name, [])
+    try:
+        snapshot_tasks.schedule_snapshot_rebuild()
+        snapshot_tasks.schedule_snapshot_rebuild()
+
+        apply_async.assert_called_once()
+        assert apply_async.call_args.kwargs["kwargs"] == {"queue": queue.BACKGROUND_QUEUE}
+    finally:
+        queue.task_finished(snapshot_tasks.rebuild_platform_snapshots.name, [])
+
+
+@patch("deployments.tasks.platform_snapshots.schedule_snapshot_rebuild")
+def test_edits_rebuild_snapshots(schedule_snapshot_rebuild, db, django_capture_on_commit_callbacks):
+    with django_capture_on_commit_callbacks(execute=True):
+        platform = Platform.objects.create(name="M01")
+    schedule_snapshot_rebuild.assert_called_once()
+    schedule_snapshot_rebuild.reset_mock()
+
+    with django_capture_on_commit_callbacks(execute=True):
+        platform.delete()
+    schedule_snapshot_rebuild.assert_called_once()
+
+
+@patch("deployments.tasks.platform_snapshots.schedule_snapshot_rebuild")
+def test_refreshes_dont_rebuild_snapshots(
+    schedule_snapshot_rebuild,
+    db,
+    django_capture_on_commit_callbacks,
+):
+    server = ErddapServer.objects.create(name="snapshots", base_url="https://erddap.example.com/erddap")
+    dataset = ErddapDataset.objects.create(name="M01_met_all", server=server)
+    schedule_snapshot_rebuild.reset_mock()
+
+    with django_capture_on_commit_callbacks(execute=True):
+        dataset.save(update_fields=["refresh_attempted"])
+    schedule_snapshot_rebuild.assert_not_called()
+
+    with django_capture_on_commit_callbacks(execute=True):
+        dataset.public_name = "Western Maine Shelf"
+        dataset.save(update_fields=["public_name"])
+    schedule_snapshot_rebuild.assert_called_once()
+
+
+@patch("deployments.tasks.platform_snapshots.schedule_snapshot_rebuild")
+def test_edits_dont_fail_without_a_rebuild(
+    schedule_snapshot_rebuild,
+    db,
+    django_capture_on_commit_callbacks,
+):
+    schedule_snapshot_rebuild.side_effect = ConnectionError("Broker unavailable")
+
+    with django_capture_on_commit_callbacks(execute=True):
+        Platform.objects.create(name="M01")
+
+    assert Platform.objects.filter(name="M01").exists()
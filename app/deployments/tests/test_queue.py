@@ -0,0 +1,55 @@
+from uuid import uuid4
+
+import pytest
+
+from deployments.tasks import queue
+
+
+@pytest.fixture
+def task_name():
+    """A task name that won't collide with other tests"""
+    name = f"deployments.tasks.test_{uuid4().hex}"
+    yield name
+    queue.task_finished(name, [1])
+
+
+def test_first_caller_queues_task(task_name):
+    assert not queue.task_queued(task_name, [1], {})
+    assert queue.task_queued(task_name, [1], {})
+
+
+def test_tasks_matched_by_args_not_kwargs(task_name):
+    assert not queue.task_queued(task_name, [1], {"healthcheck": False})
+    assert queue.task_queued(task_name, [1], {"healthcheck": True})
+    assert not queue.task_queued(task_name, [2], {})
+
+    queue.task_finished(task_name, [2])
+
+
+def test_finished_task_can_be_queued_again(task_name):
+    assert not queue.task_queued(task_name, [1], {})
+    queue.task_finished(task_name, [1])
+
+    assert not queue.task_queued(task_name, [1], {})
+
+
+def test_each_queue_can_have_task_waiting(task_name):
+    assert not queue.task_queued(task_name, [1], {"queue": queue.BACKGROUND_QUEUE})
+    assert not queue.task_queued(task_name, [1], {"queue": queue.PUSH_QUEUE})
+    assert queue.task_queued(task_name, [1], {"queue": queue.PUSH_QUEUE})
+
+
+def test_finished_task_clears_every_queue(task_name):
+    queue.task_queued(task_name, [1], {"queue": queue.BACKGROUND_QUEUE})
+    queue.task_queued(task_name, [1], {"queue": queue.USER_QUEUE})
+
+    queue.task_finished(task_name, [1])
+
+    assert not queue.task_queued(task_name, [1], {"queue": queue.BACKGROUND_QUEUE})
+    assert not queue.task_queued(task_name, [1], {"queue": queue.USER_QUEUE})
+
+
+def test_tasks_routed_by_queue_kwarg():
+    assert queue.route_task("refresh", [1], {"queue": queue.PUSH_QUEUE}, {}) == {"queue": "push"}
+    assert queue.route_task("refresh", [1], {"healthcheck": True}, {}) is None
+    assert queue.route_task("refresh", [1], {"queue": "unknown"}, {}) is None
@@ -0,0 +1,41 @@
+from uuid import uuid4
+
+import pytest
+from django_redis import get_redis_connection
+
+from deployments.tasks import queue_metrics
+
+
+@pytest.fixture
+def queue_name():
+    name = f"test-{uuid4().hex}"
+    yield name
+    get_redis_connection("default").delete(queue_metrics.LATENCY_KEY.format(name))
+
+
+def test_no_latency_for_unused_queue(queue_name):
+    assert queue_metrics.queue_latency(queue_name) is None
+
+
+def test_latency_summary(queue_name):
+    # One task waited each whole number of seconds up to `samples`, so percentiles are in seconds
+    samples = 100
+    get_redis_connection("default").lpush(
+        queue_metrics.LATENCY_KEY.format(queue_name),
+        *[str(seconds) for seconds in range(1, samples + 1)],
+    )
+
+    summary = queue_metrics.queue_latency(queue_name)
+
+    assert summary["count"] == samples
+    assert summary["max"] == samples
+    assert summary["p50"] == pytest.approx(50, abs=1)
+    assert summary["p95"] == pytest.approx(95, abs=1)
+
+
+def test_publish_stamps_enqueued_time():
+    headers = {}
+
+    queue_metrics.stamp_enqueued_time(headers=headers)
+
+    assert queue_metrics.ENQUEUED_HEADER in headers
@@ -0,0 +1,84 @@
+from uuid import uuid4
+
+import pytest
+
+from deployments.models import ErddapServer
+from deployments.utils import rate_limit
+
+
+@pytest.fixture
+def server():
+    """An unsaved server with keys that won't collide with other tests"""
+    server = ErddapServer(
+        base_url=f"https://erddap.example.com/{uuid4()}/erddap",
+        request_refresh_time_seconds=10,
+        request_concurrency=2,
+    )
+    yield server
+    rate_limit.reset_rate_limit(server)
+
+
+def test_requests_within_burst_do_not_wait(server):
+    assert rate_limit.reserve_request_slot(server) == 0
+    assert rate_limit.reserve_request_slot(server) == 0
+
+
+def test_requests_past_burst_wait_for_interval(server):
+    rate_limit.reserve_request_slot(server)
+    rate_limit.reserve_request_slot(server)
+
+    interval = server.request_refresh_time_seconds
+    assert interval - 1 < rate_limit.reserve_request_slot(server) <= interval
+    assert 2 * interval - 1 < rate_limit.reserve_request_slot(server) <= 2 * interval
+
+
+def test_take_request_slot_does_not_wait(server):
+    server.request_concurrency = 1
+    rate_limit.take_request_slot(server)
+
+    with pytest.raises(rate_limit.RequestSlotUnavailable) as raised:
+        rate_limit.take_request_slot(server)
+
+    interval = server.request_refresh_time_seconds
+    assert interval - 1 < raised.value.wait_seconds <= interval
+    assert interval - 1 < rate_limit.reserve_request_slot(server) <= interval, (
+        "Requests that didn't wait shouldn't have reserved a slot"
+    )
+
+
+def test_server_without_interval_is_not_limited(server):
+    server.request_refresh_time_seconds = 0
+
+    for _ in range(5):
+        assert rate_limit.reserve_request_slot(server) == 0
+
+
+def test_backoff_doubles_interval_for_server(server):
+    server.request_concurrency = 1
+
+    assert rate_limit.report_backoff(server) == 1
+    assert rate_limit.backoff_level(server.base_url + "/") == 1
+
+    rate_limit.reserve_request_slot(server)
+    doubled = 2 * server.request_refresh_time_seconds
+    assert doubled - 1 < rate_limit.reserve_request_slot(server) <= doubled
+
+
+def test_backoff_level_is_capped(server, settings):
+    settings.ERDDAP_RATE_LIMIT_MAX_BACKOFF_LEVEL = 2
+
+    for _ in range(4):
+        rate_limit.report_backoff(server)
+
+    assert rate_limit.backoff_level(server) == settings.ERDDAP_RATE_LIMIT_MAX_BACKOFF_LEVEL
+
+
+def test_reset_rate_limit(server):
+    for _ in range(server.request_concurrency):
+        rate_limit.reserve_request_slot(server)
+    rate_limit.report_backoff(server)
+
+    rate_limit.reset_rate_limit(server)
+
+    assert rate_limit.backoff_level(server) == 0
+    assert rate_limit.reserve_request_slot(server) == 0
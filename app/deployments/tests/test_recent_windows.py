@@ -0,0 +1,52 @@
+from http import HTTPStatus
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+import pytest
+from rest_framework.test import APIClient
+
+from deployments.utils import recent_windows
+from deployments.utils.group_arrays import SeriesArrays
+
+
+def series_arrays(values: list[float]) -> SeriesArrays:
+    times = pd.date_range("2026-10-17", periods=len(values), freq="10min")
+    time = times.to_numpy(dtype="datetime64[ns]")
+    value = np.array(values, dtype="float64")
+    return SeriesArrays(time=time, value=value, valid=~np.isnan(value))
+
+
+def test_window_round_trip():
+    window = recent_windows.pack_window(series_arrays([1.5, np.nan, 2.25]))
+
+    times, values = recent_windows.unpack_window(window)
+
+    start = int(pd.Timestamp("2026-10-17", tz="UTC").timestamp())
+    assert times.tolist() == [start, start + 20 * 60], "Invalid rows are left out"
+    assert values.tolist() == [1.5, 2.25]
+    assert len(window) == 8 + 2 * 8
+
+
+def test_window_keeps_newest_points(settings):
+    settings.TIMESERIES_WINDOW_MAX_POINTS = 2
+
+    _, values = recent_windows.unpack_window(recent_windows.pack_window(series_arrays([1, 2, 3])))
+
+    assert values.tolist() == [2, 3]
+
+
+def test_window_json_rounds_to_float32_precision():
+    window = recent_windows.unpack_window(recent_windows.pack_window(series_arrays([12.3])))
+
+    assert recent_windows.window_json(window)["value"] == [12.3]
+    assert recent_windows.window_json(None) is None
+
+
+@pytest.mark.django_db
+@patch("deployments.views.load_windows")
+def test_windows_api_rejects_bad_ids(load_windows):
+    response = APIClient().get("/api/timeseries/windows/", {"ids": "1,two"})
+
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+    load_windows.assert_not_called()
@@ -0,0 +1,109 @@
+from datetime import timedelta
+from http import HTTPStatus
+
+import pytest
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from deployments.models import ErddapDataset, ErddapServer, RefreshRun, TimeSeries
+from deployments.utils import refresh_ledger
+
+
+@pytest.fixture
+def dataset(db):
+    server = ErddapServer.objects.create(name="ledger", base_url="https://erddap.example.com/erddap")
+    return ErddapDataset.objects.create(name="M01_met_all", server=server)
+
+
+def group(variable: str, depth: float) -> list[TimeSeries]:
+    return [TimeSeries(variable=variable, constraints={"depth=": depth})]
+
+
+def test_record_does_nothing_outside_a_refresh():
+    refresh_ledger.record(group("salinity", 1), fetch=1.0)
+    refresh_ledger.record_backoff(2)
+
+
+def test_refresh_saves_group_timings(dataset):
+    shallow = group("salinity", 1)
+    deep = group("salinity", 50)
+    shallow_timings = {"wait": 0.5, "fetch": 1.0, "bytes": 100, "rows": 10}
+    deep_timings = {"fetch": 3.0, "bytes": 300, "rows": 30}
+    save_seconds = 0.25
+    backoff_level = 2
+
+    with refresh_ledger.record_refresh(dataset) as ledger:
+        refresh_ledger.record(shallow, **shallow_timings)
+        refresh_ledger.record(deep, **deep_timings)
+        refresh_ledger.record(deep, save=save_seconds)
+        refresh_ledger.record_error(shallow, ValueError("bad value"))
+        refresh_ledger.record_backoff(backoff_level)
+        ledger.result = RefreshRun.Result.UNCHANGED
+
+    run = RefreshRun.objects.get(dataset=dataset)
+
+    assert run.result == RefreshRun.Result.UNCHANGED
+    assert run.wait_seconds == shallow_timings["wait"]
+    assert run.fetch_seconds == shallow_timings["fetch"] + deep_timings["fetch"]
+    assert run.save_seconds == save_seconds
+    assert run.bytes_downloaded == shallow_timings["bytes"] + deep_timings["bytes"]
+    assert run.rows == shallow_timings["rows"] + deep_timings["rows"]
+    assert run.group_count == len([shallow, deep])
+    assert run.error_count == 1
+    assert run.errors[0]["error"] == "ValueError"
+    assert run.backoff_level == backoff_level
+    assert run.groups[0]["group"] == refresh_ledger.group_label(deep), "Slowest group first"
+
+
+def test_combined_requests_are_split_between_groups(dataset):
+    groups = [group("salinity", 1), group("salinity", 50)]
+
+    with refresh_ledger.record_refresh(dataset) as ledger:
+        refresh_ledger.record_for_groups(groups, fetch=2.0, bytes=100)
+
+    assert [timings["fetch"] for timings in ledger.groups.values()] == [1.0, 1.0]
+    assert [timings["bytes"] for timings in ledger.groups.values()] == [50, 50]
+
+
+def test_failed_refresh_is_recorded(dataset):
+    with pytest.raises(RuntimeError), refresh_ledger.record_refresh(dataset):
+        raise RuntimeError("Refresh failed")
+
+    assert RefreshRun.objects.get(dataset=dataset).result == RefreshRun.Result.FAILED
+
+
+def test_slowest_datasets_and_servers(dataset):
+    other = ErddapDataset.objects.create(name="M01_sbe37_all", server=dataset.server)
+    now = timezone.now()
+    durations = [(dataset, 1), (dataset, 2), (other, 10)]
+    for run_dataset, duration in durations:
+        RefreshRun.objects.create(
+            dataset=run_dataset,
+            started=now,
+            duration_seconds=duration,
+            result=RefreshRun.Result.REFRESHED,
+        )
+    RefreshRun.objects.create(
+        dataset=dataset,
+        started=now - timedelta(days=3),
+        duration_seconds=100,
+        result=RefreshRun.Result.REFRESHED,
+    )
+
+    response = APIClient().get("/api/refresh-timings/", {"hours": 24})
+
+    dataset_durations = [duration for run_dataset, duration in durations if run_dataset == dataset]
+    assert response.status_code == HTTPStatus.OK
+    datasets = response.data["datasets"]
+    assert [summary["dataset__name"] for summary in datasets] == ["M01_sbe37_all", "M01_met_all"]
+    assert datasets[1]["runs"] == len(dataset_durations)
+    assert datasets[1]["total_seconds"] == sum(dataset_durations)
+    assert response.data["servers"][0]["total_seconds"] == sum(duration for _, duration in durations), (
+        "Runs older than the window are left out"
+    )
+
+
+def test_slowest_rejects_unknown_order(db):
+    response = APIClient().get("/api/refresh-timings/", {"order": "fastest"})
+
+    assert response.status_code == HTTPStatus.BAD_REQUEST
@@ -0,0 +1,42 @@
+from random import randint
+
+import pytest
+
+from deployments.utils import refresh_progress
+
+
+@pytest.fixture
+def server_id():
+    """A server id whose slots won't collide with other tests"""
+    server_id = randint(1_000_000, 9_999_999)  # noqa: S311
+    yield server_id
+    for lease in ("a", "b", "c"):
+        refresh_progress.release_dataset_slot(server_id, lease)
+
+
+def test_slots_are_limited_per_server(server_id):
+    limit = 2
+
+    assert refresh_progress.acquire_dataset_slot(server_id, "a", limit)
+    assert refresh_progress.acquire_dataset_slot(server_id, "b", limit)
+    assert not refresh_progress.acquire_dataset_slot(server_id, "c", limit)
+    assert refresh_progress.acquire_dataset_slot(server_id + 1, "c", limit), (
+        "Other servers should have their own slots"
+    )
+    refresh_progress.release_dataset_slot(server_id + 1, "c")
+
+
+def test_lease_keeps_its_slot(server_id):
+    assert refresh_progress.acquire_dataset_slot(server_id, "a", 1)
+    assert refresh_progress.acquire_dataset_slot(server_id, "a", 1), (
+        "A retried refresh should be able to take the slot it already holds"
+    )
+
+
+def test_released_slot_can_be_taken(server_id):
+    assert refresh_progress.acquire_dataset_slot(server_id, "a", 1)
+    assert not refresh_progress.acquire_dataset_slot(server_id, "b", 1)
+
+    refresh_progress.release_dataset_slot(server_id, "a")
+
+    assert refresh_progress.acquire_dataset_slot(server_id, "b", 1)
@@ -0,0 +1,147 @@
+from datetime import UTC, datetime, timedelta
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+
+from deployments.models import ErddapDataset
+from deployments.tasks import refresh_schedule
+
+NOW = datetime(2026, 10, 17, 12, 0, tzinfo=UTC)
+
+
+@pytest.fixture
+def dataset():
+    return ErddapDataset(name="M01_met_all")
+
+
+def schedule(dataset, latest, future=False, windows=()):
+    with (
+        patch.object(refresh_schedule, "latest_observation_time", return_value=latest),
+        patch.object(refresh_schedule, "has_future_timeseries", return_value=future),
+        patch.object(
+            refresh_schedule,
+            "observation_spacing",
+            return_value=refresh_schedule.median_spacing(windows),
+        ),
+    ):
+        return refresh_schedule.schedule_next_refresh(dataset, now=NOW)
+
+
+def window(end: datetime, spacing: timedelta, duration=timedelta(hours=1)):
+    """Times and values of a window of evenly spaced values up to `end`"""
+    times = np.arange(
+        (end - duration).timestamp(),
+        end.timestamp() + 1,
+        spacing.total_seconds(),
+        dtype=np.int64,
+    )
+    return times, np.zeros(len(times), dtype=np.float32)
+
+
+def test_spacing_is_median_of_windows():
+    spacing = timedelta(minutes=10)
+    times, values = window(NOW, spacing)
+    # A missed value shouldn't change the spacing
+    gappy = (np.delete(times, 3), np.delete(values, 3))
+
+    assert refresh_schedule.median_spacing([window(NOW, spacing), gappy, None]) == spacing
+
+
+def test_no_spacing_without_distinct_times():
+    single = (np.array([int(NOW.timestamp())] * 2), np.zeros(2, dtype=np.float32))
+
+    assert refresh_schedule.median_spacing([single, None]) is None
+
+
+def test_first_interval_is_the_gap():
+    gap = timedelta(minutes=10)
+
+    assert refresh_schedule.updated_interval(None, gap) == gap.total_seconds()
+
+
+def test_interval_is_weighted_towards_history():
+    previous = 600
+    gap = timedelta(minutes=20)
+
+    interval = refresh_schedule.updated_interval(previous, gap)
+
+    assert previous < interval < gap.total_seconds()
+
+
+def test_gaps_are_clamped():
+    assert refresh_schedule.updated_interval(None, timedelta(seconds=10)) == 5 * 60
+    assert refresh_schedule.updated_interval(None, timedelta(days=10)) == 24 * 60 * 60
+
+
+def test_refresh_scheduled_after_next_expected_value():
+    next_refresh = refresh_schedule.next_refresh_time(NOW, 600, 0, NOW)
+
+    assert NOW + timedelta(minutes=10) < next_refresh < NOW + timedelta(minutes=15)
+
+
+def test_misses_back_off_up_to_a_day():
+    last_value = NOW - timedelta(hours=2)
+    waits = [
+        refresh_schedule.next_refresh_time(last_value, 3600, misses, NOW) - NOW
+        for misses in range(1, 12)
+    ]
+
+    assert waits[0] == timedelta(minutes=15)
+    assert waits[1] == timedelta(minutes=30)
+    assert waits == sorted(waits)
+    assert waits[-1] == timedelta(days=1)
+
+
+def test_not_scheduled_until_interval_is_known(dataset):
+    latest = NOW - timedelta(minutes=5)
+    schedule(dataset, latest, windows=[(np.array([int(latest.timestamp())]), np.zeros(1))])
+
+    assert dataset.last_value_time == NOW - timedelta(minutes=5)
+    assert dataset.next_refresh is None
+
+
+def test_new_value_learns_interval(dataset):
+    spacing = timedelta(minutes=10)
+    latest = NOW - timedelta(minutes=5)
+    dataset.last_value_time = latest - spacing
+    dataset.refresh_misses = 2
+
+    fields = schedule(dataset, latest, windows=[window(latest, spacing)])
+
+    assert dataset.update_interval_seconds == spacing.total_seconds()
+    assert dataset.refresh_misses == 0
+    assert dataset.next_refresh > NOW
+    assert "next_refresh" in fields
+
+
+def test_interval_is_spacing_not_time_between_refreshes(dataset):
+    spacing = timedelta(minutes=10)
+    latest = NOW - timedelta(minutes=5)
+    # Refreshed hourly, so the newest value moved an hour since the last refresh
+    dataset.last_value_time = latest - timedelta(hours=1)
+
+    schedule(dataset, latest, windows=[window(latest, spacing), window(latest, spacing)])
+
+    assert dataset.update_interval_seconds == spacing.total_seconds()
+    assert NOW < dataset.next_refresh < latest + 2 * spacing
+
+
+def test_no_new_value_counts_a_miss(dataset):
+    interval = 3600
+    dataset.last_value_time = NOW - timedelta(hours=3)
+    dataset.update_interval_seconds = interval
+
+    schedule(dataset, dataset.last_value_time)
+
+    assert dataset.refresh_misses == 1
+    assert dataset.update_interval_seconds == interval
+    assert dataset.next_refresh == NOW + timedelta(minutes=15)
+
+
+def test_future_datasets_left_to_hourly_refresh(dataset):
+    dataset.next_refresh = NOW
+
+    schedule(dataset, NOW, future=True)
+
+    assert dataset.next_refresh is None
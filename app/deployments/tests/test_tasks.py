@@ -1,16 +1,25 @@
-from unittest.mock import patch
+from datetime import timedelta
+from unittest.mock import AsyncMock, patch
 
+import httpx
+import pandas as pd
 import pytest
 from django.test import TransactionTestCase
+from django.utils import timezone
 
 from deployments import tasks
+from deployments.benchmarks.refresh_throughput import eager_tasks
 from deployments.models import (
     DataType,
     ErddapDataset,
     ErddapServer,
+    FailedRequest,
     Platform,
     TimeSeries,
 )
+from deployments.tasks import error_handling, periodic_refresh, queue, refresh
+from deployments.utils.circuit_breaker import CircuitState
+from deployments.utils.failed_requests import remember_failure
 
 from .vcr import my_vcr
 
@@ -98,7 +107,8 @@ class TaskTestCase(TransactionTestCase):
 
     @patch("deployments.tasks.refresh.update_values_for_timeseries")
     def test_refresh_server(self, update_values_for_timeseries):
-        tasks.refresh_server(self.erddap.id)
+        with eager_tasks():
+            tasks.refresh_server(self.erddap.id)
 
         self.assertEqual(
             3,
@@ -119,6 +129,230 @@ class TaskTestCase(TransactionTestCase):
             "The dataset should have two groups of timeseries that have different constraints",
         )
 
+    @patch("deployments.tasks.refresh.retrieve_time_coverage_end")
+    @patch("deployments.tasks.refresh.update_values_for_timeseries")
+    def test_refresh_dataset_skips_unchanged(
+        self,
+        update_values_for_timeseries,
+        retrieve_time_coverage_end,
+    ):
+        time_coverage_end = timezone.now() - timedelta(hours=2)
+        retrieve_time_coverage_end.return_value = time_coverage_end
+        self.ds_M01_sbe37.refresh_attempted = timezone.now() - timedelta(hours=1)
+        self.ds_M01_sbe37.time_coverage_end = time_coverage_end
+        self.ds_M01_sbe37.save()
+
+        tasks.refresh_dataset(self.ds_M01_sbe37.id)
+
+        update_values_for_timeseries.assert_not_called()
+        self.ds_M01_sbe37.refresh_from_db()
+        self.assertEqual(ErddapDataset.RefreshResult.UNCHANGED, self.ds_M01_sbe37.refresh_result)
+
+        tasks.refresh_dataset(self.ds_M01_sbe37.id, force=True)
+
+        self.assertEqual(
+            2,
+            update_values_for_timeseries.call_count,
+            "Forced refreshes should not be skipped",
+        )
+
+    @patch("deployments.tasks.refresh.retrieve_time_coverage_end")
+    @patch("deployments.tasks.refresh.update_values_for_timeseries")
+    def test_refresh_dataset_records_changed_coverage(
+        self,
+        update_values_for_timeseries,
+        retrieve_time_coverage_end,
+    ):
+        time_coverage_end = timezone.now() - timedelta(minutes=10)
+        retrieve_time_coverage_end.return_value = time_coverage_end
+        self.ds_M01_sbe37.refresh_attempted = timezone.now() - timedelta(hours=1)
+        self.ds_M01_sbe37.time_coverage_end = time_coverage_end - timedelta(hours=1)
+        self.ds_M01_sbe37.save()
+
+        tasks.refresh_dataset(self.ds_M01_sbe37.id)
+
+        self.assertEqual(2, update_values_for_timeseries.call_count)
+        self.ds_M01_sbe37.refresh_from_db()
+        self.assertEqual(ErddapDataset.RefreshResult.REFRESHED, self.ds_M01_sbe37.refresh_result)
+        self.assertEqual(time_coverage_end, self.ds_M01_sbe37.time_coverage_end)
+
+    @patch("deployments.tasks.refresh.retrieve_time_coverage_end")
+    @patch("deployments.tasks.refresh.update_values_for_timeseries")
+    def test_refresh_dataset_keeps_coverage_when_groups_fail(
+        self,
+        update_values_for_timeseries,
+        retrieve_time_coverage_end,
+    ):
+        previous_coverage_end = timezone.now() - timedelta(hours=1)
+        retrieve_time_coverage_end.return_value = timezone.now() - timedelta(minutes=10)
+        update_values_for_timeseries.side_effect = [True, False]
+        self.ds_M01_sbe37.refresh_attempted = timezone.now() - timedelta(hours=1)
+        self.ds_M01_sbe37.time_coverage_end = previous_coverage_end
+        self.ds_M01_sbe37.save()
+
+        tasks.refresh_dataset(self.ds_M01_sbe37.id)
+
+        self.ds_M01_sbe37.refresh_from_db()
+        self.assertEqual(ErddapDataset.RefreshResult.PARTIAL, self.ds_M01_sbe37.refresh_result)
+        self.assertEqual(
+            previous_coverage_end,
+            self.ds_M01_sbe37.time_coverage_end,
+            "The failed group should be requested again, even if the dataset doesn't change",
+        )
+
+    @patch("deployments.tasks.refresh.retrieve_time_coverage_end")
+    @patch("deployments.tasks.refresh.update_values_from_dataframe")
+    @patch("deployments.tasks.refresh.retrieve_dataframe")
+    def test_refresh_dataset_with_dead_station_records_coverage(
+        self,
+        retrieve_dataframe,
+        update_values_from_dataframe,
+        retrieve_time_coverage_end,
+    ):
+        for station in ["A01", "B01"]:
+            TimeSeries.objects.create(
+                platform=self.platform,
+                data_type=self.water_temp,
+                variable="temperature",
+                constraints={"station=": station},
+                start_time="2004-06-03 21:00:00+00",
+                dataset=self.ds_M01_sbe37,
+            )
+
+        def retrieve(server, dataset, constraints, timeseries):
+            if constraints == {"station=": "B01"}:
+                raise httpx.HTTPError(
+                    "Error {code=404, message=Not Found: Your query produced no matching results. "
+                    "(There are no matching stations.)}",
+                )
+            return pd.DataFrame()
+
+        retrieve_dataframe.side_effect = retrieve
+        time_coverage_end = timezone.now() - timedelta(minutes=10)
+        retrieve_time_coverage_end.return_value = time_coverage_end
+
+        for _ in range(2):
+            tasks.refresh_dataset(self.ds_M01_sbe37.id)
+
+            self.ds_M01_sbe37.refresh_from_db()
+            self.assertEqual(
+                ErddapDataset.RefreshResult.REFRESHED,
+                self.ds_M01_sbe37.refresh_result,
+                "Failing and then being skipped for a lasting reason counts as refreshed",
+            )
+            self.assertEqual(time_coverage_end, self.ds_M01_sbe37.time_coverage_end)
+            time_coverage_end += timedelta(minutes=5)
+            retrieve_time_coverage_end.return_value = time_coverage_end
+
+        failure = FailedRequest.objects.get()
+        self.assertEqual(FailedRequest.Reason.NO_MATCHING_STATION, failure.reason)
+        self.assertEqual({"station=": "B01"}, failure.constraints)
+
+    @patch("deployments.tasks.refresh.retrieve_time_coverage_end")
+    @patch("deployments.tasks.refresh.update_values_for_timeseries")
+    def test_forced_refresh_records_coverage(
+        self,
+        update_values_for_timeseries,
+        retrieve_time_coverage_end,
+    ):
+        time_coverage_end = timezone.now() - timedelta(minutes=10)
+        retrieve_time_coverage_end.return_value = time_coverage_end
+
+        tasks.refresh_dataset(self.ds_M01_sbe37.id, force=True)
+
+        self.ds_M01_sbe37.refresh_from_db()
+        self.assertEqual(time_coverage_end, self.ds_M01_sbe37.time_coverage_end)
+
+    @patch("deployments.tasks.refresh.retrieve_time_coverage_end")
+    @patch("deployments.tasks.refresh.update_values_for_timeseries")
+    def test_refresh_of_changes_keeps_coverage(
+        self,
+        update_values_for_timeseries,
+        retrieve_time_coverage_end,
+    ):
+        TimeSeries.objects.create(
+            platform=self.platform,
+            data_type=self.water_temp,
+            variable="temperature",
+            constraints={"station=": "A01"},
+            start_time="2004-06-03 21:00:00+00",
+            dataset=self.ds_M01_sbe37,
+        )
+        previous_coverage_end = timezone.now() - timedelta(hours=1)
+        self.ds_M01_sbe37.refresh_attempted = timezone.now() - timedelta(hours=1)
+        self.ds_M01_sbe37.time_coverage_end = previous_coverage_end
+        self.ds_M01_sbe37.save()
+
+        tasks.refresh_dataset(self.ds_M01_sbe37.id, changes={"station": ["A01"]})
+
+        update_values_for_timeseries.assert_called_once()
+        retrieve_time_coverage_end.assert_not_called()
+        self.ds_M01_sbe37.refresh_from_db()
+        self.assertEqual(ErddapDataset.RefreshResult.REFRESHED, self.ds_M01_sbe37.refresh_result)
+        self.assertEqual(
+            previous_coverage_end,
+            self.ds_M01_sbe37.time_coverage_end,
+            "The groups that weren't refreshed may still be behind",
+        )
+
+    @patch("deployments.tasks.refresh.update_values_from_dataframe")
+    @patch("deployments.tasks.concurrent.aretrieve_dataframe", new_callable=AsyncMock)
+    def test_refresh_dataset_concurrently(self, aretrieve_dataframe, update_values_from_dataframe):
+        self.erddap.request_concurrency = 2
+        self.erddap.save()
+
+        tasks.refresh_dataset(self.ds_M01_sbe37.id)
+
+        self.assertEqual(
+            2,
+            aretrieve_dataframe.call_count,
+            "Each constraint group should be requested",
+        )
+        self.assertEqual(2, update_values_from_dataframe.call_count)
+
+    @patch("deployments.tasks.refresh.refresh_groups_sequentially")
+    @patch("deployments.tasks.refresh.update_values_from_dataframe")
+    @patch("deployments.tasks.refresh.retrieve_coalesced_dataframe")
+    def test_refresh_dataset_coalesced(
+        self,
+        retrieve_coalesced_dataframe,
+        update_values_from_dataframe,
+        refresh_groups_sequentially,
+    ):
+        dataset = ErddapDataset.objects.create(
+            name="cwwcNDBCMet",
+            server=self.erddap,
+            coalesce_requests=True,
+        )
+        for station in ["44007", "44013", "44098"]:
+            TimeSeries.objects.create(
+                platform=self.platform,
+                data_type=self.water_temp,
+                variable="wtmp",
+                constraints={"station=": station},
+                start_time="2004-06-03 21:00:00+00",
+                dataset=dataset,
+            )
+        retrieve_coalesced_dataframe.return_value = pd.DataFrame(
+            {
+                "time (UTC)": ["2024-01-01T00:00:00Z", "2024-01-01T00:00:00Z"],
+                "station": ["44007", "44013"],
+                "wtmp (degree_C)": [5.0, 6.0],
+            },
+        )
+
+        tasks.refresh_dataset(dataset.id)
+
+        self.assertEqual(1, retrieve_coalesced_dataframe.call_count, "Stations should be combined")
+        self.assertEqual(2, update_values_from_dataframe.call_count)
+
+        remaining = refresh_groups_sequentially.call_args[0][1]
+        self.assertEqual(
+            [{"station=": "44098"}],
+            [timeseries[0].constraints for timeseries in remaining.values()],
+            "Stations missing from the combined response should be requested individually",
+        )
+
     @my_vcr.use_cassette("tasks_update_values.yaml")
     def test_update_values(self):
         self.assertIsNone(self.ts1.value)
@@ -129,6 +363,35 @@ class TaskTestCase(TransactionTestCase):
         self.assertIsNotNone(self.ts1.value)
         self.assertIsNotNone(self.ts2.value)
 
+    @my_vcr.use_cassette("tasks_update_values.yaml")
+    def test_update_values_saves_changes(self):
+        tasks.update_values_for_timeseries((self.ts1, self.ts2))
+
+        self.ts1.refresh_from_db()
+        self.ts2.refresh_from_db()
+
+        self.assertIsNotNone(self.ts1.value)
+        self.assertIsNotNone(self.ts1.value_time)
+        self.assertIn("max", self.ts1.extrema_values)
+        self.assertIsNotNone(self.ts2.value)
+
+    @patch("deployments.tasks.refresh.schedule_snapshot_rebuild")
+    def test_save_timeseries_changes_skips_unchanged(self, schedule_snapshot_rebuild):
+        with self.assertNumQueries(0):
+            refresh.save_timeseries_changes({self.ts1: set(), self.ts2: set()})
+
+        schedule_snapshot_rebuild.assert_not_called()
+
+    @patch("deployments.tasks.refresh.schedule_snapshot_rebuild")
+    def test_save_timeseries_changes_only_writes_changed_series(self, schedule_snapshot_rebuild):
+        self.ts1.value = 12.5
+
+        refresh.save_timeseries_changes({self.ts1: {"value"}, self.ts2: set()})
+
+        self.ts1.refresh_from_db()
+        self.assertEqual(12.5, self.ts1.value)
+        schedule_snapshot_rebuild.assert_called_once()
+
     @patch("deployments.tasks.refresh.refresh_dataset.delay")
     @patch("deployments.tasks.refresh.task_queued")
     def test_single_refresh_dataset_skips_when_queued(self, task_queued, refresh_dataset_delay):
@@ -149,6 +412,8 @@ class TaskTestCase(TransactionTestCase):
             self.ds_M01_sbe37.id,
             healthcheck=True,
             clear_end_time=True,
+            queue=queue.BACKGROUND_QUEUE,
+            changes=None,
         )
 
         self.assertEqual(
@@ -157,6 +422,155 @@ class TaskTestCase(TransactionTestCase):
             "task_queued should be called with the actual registered task name",
         )
 
+    @patch("deployments.tasks.refresh.circuit_state")
+    @patch("deployments.tasks.refresh.update_values_for_timeseries")
+    def test_refresh_dataset_skips_open_circuit(self, update_values_for_timeseries, circuit_state):
+        circuit_state.return_value = (CircuitState.OPEN, 60)
+
+        tasks.refresh_dataset(self.ds_M01_sbe37.id, force=True)
+
+        update_values_for_timeseries.assert_not_called()
+        self.ds_M01_sbe37.refresh_from_db()
+        self.assertIsNone(self.ds_M01_sbe37.refresh_attempted)
+
+    @patch("deployments.tasks.refresh.update_values_for_timeseries")
+    def test_refresh_dataset_skips_failed_requests(self, update_values_for_timeseries):
+        remember_failure([self.ts1, self.ts2], FailedRequest.Reason.NO_MATCHING_STATION, "No station")
+
+        tasks.refresh_dataset(self.ds_M01_sbe37.id)
+
+        self.assertEqual(1, update_values_for_timeseries.call_count, "The failed group is skipped")
+
+        tasks.refresh_dataset(self.ds_M01_sbe37.id, force=True)
+
+        self.assertEqual(3, update_values_for_timeseries.call_count, "Forced refreshes request it")
+        self.assertFalse(FailedRequest.objects.exists())
+
+    @patch("deployments.tasks.refresh.update_values_for_timeseries")
+    def test_refresh_dataset_limits_to_changes(self, update_values_for_timeseries):
+        for station in ["A01", "B01"]:
+            TimeSeries.objects.create(
+                platform=self.platform,
+                data_type=self.water_temp,
+                variable="temperature",
+                constraints={"station=": station},
+                start_time="2004-06-03 21:00:00+00",
+                dataset=self.ds_M01_sbe37,
+            )
+
+        tasks.refresh_dataset(self.ds_M01_sbe37.id, changes={"station": ["A01"]})
+
+        update_values_for_timeseries.assert_called_once()
+        group = update_values_for_timeseries.call_args.args[0]
+        self.assertEqual([{"station=": "A01"}], [ts.constraints for ts in group])
+
+        tasks.refresh_dataset(self.ds_M01_sbe37.id, changes={"file": ["B01_2024.nc"]})
+
+        group = update_values_for_timeseries.call_args.args[0]
+        self.assertEqual([{"station=": "B01"}], [ts.constraints for ts in group])
+
+        tasks.refresh_dataset(self.ds_M01_sbe37.id, changes={"station": ["C01"]})
+
+        self.assertEqual(
+            6,
+            update_values_for_timeseries.call_count,
+            "Changes that don't match any group refresh the whole dataset",
+        )
+
+    @patch("deployments.tasks.refresh.update_values_for_timeseries")
+    def test_refresh_dataset_clears_queued_mark(self, update_values_for_timeseries):
+        self.assertFalse(queue.task_queued(tasks.refresh_dataset.name, [self.ds_M01_sbe37.id], {}))
+
+        tasks.refresh_dataset(self.ds_M01_sbe37.id)
+
+        self.assertFalse(
+            queue.task_queued(tasks.refresh_dataset.name, [self.ds_M01_sbe37.id], {}),
+            "Once refreshed, the dataset should be able to be queued again",
+        )
+        queue.task_finished(tasks.refresh_dataset.name, [self.ds_M01_sbe37.id])
+
+    @patch("deployments.tasks.refresh.run_dataset_refresh")
+    @patch.object(ErddapServer, "healthcheck_complete")
+    def test_refresh_server_completes_healthcheck_after_last_dataset(
+        self,
+        healthcheck_complete,
+        run_dataset_refresh,
+    ):
+        self.erddap.max_dataset_refreshes = 2
+        self.erddap.save()
+        dataset_count = self.erddap.erddapdataset_set.count()
+
+        def refresh(dataset_id):
+            healthcheck_complete.assert_not_called()
+
+        run_dataset_refresh.side_effect = refresh
+
+        with eager_tasks():
+            tasks.refresh_server(self.erddap.id, healthcheck=True)
+
+        self.assertEqual(dataset_count, run_dataset_refresh.call_count)
+        healthcheck_complete.assert_called_once()
+
+    @patch("deployments.tasks.refresh.run_dataset_refresh")
+    @patch.object(ErddapServer, "healthcheck_complete")
+    def test_refresh_server_continues_after_dataset_error(
+        self,
+        healthcheck_complete,
+        run_dataset_refresh,
+    ):
+        run_dataset_refresh.side_effect = ValueError("Bad dataset")
+
+        with eager_tasks():
+            tasks.refresh_server(self.erddap.id, healthcheck=True)
+
+        self.assertEqual(self.erddap.erddapdataset_set.count(), run_dataset_refresh.call_count)
+        healthcheck_complete.assert_called_once()
+
+    @patch("deployments.tasks.refresh.run_dataset_refresh")
+    @patch("deployments.tasks.refresh.refresh_server_dataset.delay")
+    def test_refresh_server_stays_queued_until_last_dataset(
+        self,
+        refresh_server_dataset_delay,
+        run_dataset_refresh,
+    ):
+        server_args = [self.erddap.id]
+
+        try:
+            self.assertFalse(queue.task_queued(tasks.refresh_server.name, server_args, {}))
+            tasks.refresh_server(self.erddap.id)
+
+            dataset_refreshes = refresh_server_dataset_delay.call_args_list
+            self.assertEqual(self.erddap.erddapdataset_set.count(), len(dataset_refreshes))
+
+            for dataset_refresh in dataset_refreshes:
+                self.assertTrue(
+                    queue.task_queued(tasks.refresh_server.name, server_args, {}),
+                    "The server shouldn't be queued again while the run is in flight",
+                )
+                tasks.refresh_server_dataset(*dataset_refresh.args, **dataset_refresh.kwargs)
+
+            self.assertFalse(
+                queue.task_queued(tasks.refresh_server.name, server_args, {}),
+                "Once the run completes, the server should be able to be queued again",
+            )
+        finally:
+            queue.task_finished(tasks.refresh_server.name, server_args)
+
+    @patch("deployments.tasks.refresh.update_values_for_timeseries")
+    def test_refresh_server_leaves_queued_marks(self, update_values_for_timeseries):
+        self.assertFalse(queue.task_queued(tasks.refresh_dataset.name, [self.ds_M01_sbe37.id], {}))
+
+        try:
+            with eager_tasks():
+                tasks.refresh_server(self.erddap.id)
+
+            self.assertTrue(
+                queue.task_queued(tasks.refresh_dataset.name, [self.ds_M01_sbe37.id], {}),
+                "Server runs shouldn't let a duplicate of an already queued refresh be queued",
+            )
+        finally:
+            queue.task_finished(tasks.refresh_dataset.name, [self.ds_M01_sbe37.id])
+
     @patch("deployments.tasks.refresh.refresh_server.delay")
     @patch("deployments.tasks.refresh.task_queued")
     def test_single_refresh_server_skips_when_queued(self, task_queued, refresh_server_delay):
@@ -173,7 +587,11 @@ class TaskTestCase(TransactionTestCase):
 
         tasks.single_refresh_server(self.erddap.id, healthcheck=True)
 
-        refresh_server_delay.assert_called_once_with(self.erddap.id, healthcheck=True)
+        refresh_server_delay.assert_called_once_with(
+            self.erddap.id,
+            healthcheck=True,
+            queue=queue.BACKGROUND_QUEUE,
+        )
 
         self.assertEqual(
             task_queued.call_args[0][0],
@@ -182,6 +600,25 @@ class TaskTestCase(TransactionTestCase):
         )
         self.assertEqual(task_queued.call_args[0][1], [self.erddap.id])
 
+    def test_not_recently_refreshed_skips_scheduled_datasets(self):
+        ErddapDataset.objects.update(refresh_attempted=None, next_refresh=None)
+        self.ds_M01_sbe37.next_refresh = timezone.now() + timedelta(hours=3)
+        self.ds_M01_sbe37.save()
+
+        dataset_ids = periodic_refresh.not_recently_refreshed_datasets(periodic_refresh.NOT_RECENTLY)
+
+        self.assertNotIn(self.ds_M01_sbe37.id, dataset_ids)
+        self.assertIn(self.ds_M01_aanderaa.id, dataset_ids)
+
+    def test_due_datasets(self):
+        ErddapDataset.objects.update(next_refresh=None)
+        self.ds_M01_sbe37.next_refresh = timezone.now() - timedelta(minutes=1)
+        self.ds_M01_sbe37.save()
+        self.ds_M01_aanderaa.next_refresh = timezone.now() + timedelta(minutes=30)
+        self.ds_M01_aanderaa.save()
+
+        self.assertEqual([self.ds_M01_sbe37.id], periodic_refresh.due_datasets())
+
 
 @pytest.mark.django_db
 class TaskErrorTestCase(TransactionTestCase):
@@ -269,6 +706,7 @@ class TaskErrorTestCase(TransactionTestCase):
         ts.refresh_from_db()
 
         assert ts.value is None
+        assert FailedRequest.objects.get(dataset=dataset).reason == FailedRequest.Reason.NO_ROWS
 
         # assert "did not return any results" in self.caplog.text
 
@@ -444,3 +882,17 @@ class TaskErrorTestCase(TransactionTestCase):
 
     #     assert ts.value is None
     #     assert "Unrecognized variable for dataset" in self.caplog.text
+
+
+@pytest.mark.parametrize(
+    ("text", "reason"),
+    [
+        ("Error {code=404; message=Not Found: Currently unknown datasetID=M01_x}", "unknown_dataset"),
+        ("No matching results. There are no matching stations.", "no_matching_station"),
+        ("Your query produced no matching results. (nRows = 0)", "no_rows"),
+        ("Error {code=429; message=Too Many Requests}", None),
+    ],
+)
+def test_failure_reason(text, reason):
+    assert error_handling.failure_reason(httpx.HTTPError(text)) == reason
+    assert error_handling.failure_reason(ValueError(text)) is None
@@ -6,6 +6,7 @@ from forecasts.views import ForecastViewSet
 from .views import (
     DatasetViewSet,
     PlatformViewset,
+    RefreshTimingViewSet,
     ServerViewSet,
     TimeSeriesViewSet,
     server_proxy,
@@ -17,6 +18,7 @@ router.register("datasets", DatasetViewSet)
 router.register("servers", ServerViewSet)
 router.register("forecasts", ForecastViewSet, basename="forecast")
 router.register("timeseries", TimeSeriesViewSet)
+router.register("refresh-timings", RefreshTimingViewSet, basename="refresh-timings")
 
 urlpatterns = [
     re_path(
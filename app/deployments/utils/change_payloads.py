@@ -0,0 +1,117 @@
+"""Limit refreshes from ERDDAP MQTT change messages to the groups of timeseries that changed
+
+When ERDDAP's change message for a dataset has a JSON payload saying what changed,
+`parse_change_payload` keeps its text values by key (say the `station` or `file` that changed),
+and `changed_groups` picks the groups of timeseries that they match, either by the value
+of a text constraint (`station=`), or by that value being a whole part of a changed file's name
+(`44007` matches `44007_2024.nc`, but not `144007_2024.nc`).
+A change to one station of a multi-station dataset then refreshes that station alone,
+while the other groups keep their current values.
+
+Messages without a payload that can be understood, or whose changes don't match any group,
+refresh the whole dataset as before.
+"""
+
+import json
+import logging
+import re
+from pathlib import PurePosixPath
+
+from ..models import TimeSeries
+from .coalesced_requests import coalescable_columns
+
+logger = logging.getLogger(__name__)
+
+Changes = dict[str, list[str]]
+
+FILE_KEY = "file"
+FILE_KEYS = {"file", "files", "fileName", "fileNames", "filename", "filenames"}
+
+# What file names are split on to find the values they contain
+FILE_NAME_SEPARATORS = re.compile(r"[_\-.]")
+
+# More values than this are unlikely to save many requests, so the whole dataset is refreshed
+MAX_VALUES = 100
+
+
+def parse_change_payload(payload: bytes) -> Changes | None:
+    """The text values of a change message's payload by key, with file names under `file`,
+    or None if the payload doesn't say what changed
+    """
+    try:
+        message = json.loads(payload)
+    except (TypeError, ValueError):
+        return None
+
+    if not isinstance(message, dict):
+        return None
+
+    changes = {}
+    for key, value in message.items():
+        values = [value] if isinstance(value, str) else value
+        if not isinstance(values, list) or not all(isinstance(item, str) for item in values):
+            continue
+
+        name = FILE_KEY if key in FILE_KEYS else key
+        if name == FILE_KEY:
+            values = [PurePosixPath(path).name for path in values]
+        changes.setdefault(name, set()).update(values)
+
+    return normalize_changes(changes)
+
+
+def normalize_changes(changes: dict[str, set[str]]) -> Changes | None:
+    """Sorted, so the same changes are always queued the same way"""
+    changes = {key: values for key, values in changes.items() if values}
+    if not changes or sum(len(values) for values in changes.values()) > MAX_VALUES:
+        return None
+
+    return {key: sorted(values) for key, values in sorted(changes.items())}
+
+
+def merge_changes(changes: Changes | None, other: Changes | None) -> Changes | None:
+    """Changes from either message, or None if either is for the whole dataset"""
+    if changes is None or other is None:
+        return None
+
+    merged = {key: set(values) for key, values in changes.items()}
+    for key, values in other.items():
+        merged.setdefault(key, set()).update(values)
+    return normalize_changes(merged)
+
+
+def name_parts(name: str) -> list[str]:
+    return FILE_NAME_SEPARATORS.split(name)
+
+
+def in_file_name(value: str, parts: list[str]) -> bool:
+    """Is the value one or more whole consecutive parts of a file name?"""
+    value_parts = name_parts(value)
+    count = len(value_parts)
+    return any(parts[i : i + count] == value_parts for i in range(len(parts) - count + 1))
+
+
+def group_changed(timeseries: list[TimeSeries], changes: Changes) -> bool:
+    constraints = timeseries[0].constraints or {}
+    files = [name_parts(PurePosixPath(file).stem) for file in changes.get(FILE_KEY, [])]
+
+    for column in coalescable_columns(constraints):
+        value = constraints[f"{column}="]
+        if value in changes.get(column, []) or any(in_file_name(value, parts) for parts in files):
+            return True
+    return False
+
+
+def changed_groups(
+    groups: dict[tuple[tuple, str], list[TimeSeries]],
+    changes: Changes,
+) -> dict[tuple[tuple, str], list[TimeSeries]]:
+    """The groups of timeseries that the changes match, or all of them if none match"""
+    changed = {
+        key: timeseries for key, timeseries in groups.items() if group_changed(timeseries, changes)
+    }
+    if not changed:
+        logger.info(f"Changes {changes} don't match any groups of timeseries, refreshing all of them")
+        return groups
+
+    return changed
@@ -0,0 +1,278 @@
+"""Stop making requests to ERDDAP servers that are down or blocking us
+
+Each server has a circuit in Redis that is shared by all workers and web processes.
+
+- Closed: requests are made as normal. Timeouts, connection errors, and 403, 408,
+  or 429 responses are counted, and any other response resets the count.
+- Open: after `settings.ERDDAP_CIRCUIT_FAILURE_THRESHOLD` failures in a row, requests
+  to the server raise `CircuitOpenError` without being made, for
+  `settings.ERDDAP_CIRCUIT_OPEN_SECONDS`.
+- Half-open: once that has passed, a single trial request is let through.
+  If it succeeds the circuit closes, otherwise it opens again.
+
+If Redis is unavailable, requests are made as if the circuit were closed.
+"""
+
+import asyncio
+import logging
+from contextlib import asynccontextmanager, contextmanager
+from enum import StrEnum
+from http import HTTPStatus
+
+import httpcore
+import httpx
+import requests
+from django.conf import settings
+from django_redis import get_redis_connection
+from django_redis.exceptions import ConnectionInterrupted
+from redis.exceptions import RedisError
+
+from ..models import ErddapServer
+from .rate_limit import server_key
+
+logger = logging.getLogger(__name__)
+
+FAILURES_KEY = "erddap-circuit-failures:{}"
+TRIPPED_KEY = "erddap-circuit-tripped:{}"
+OPEN_KEY = "erddap-circuit-open:{}"
+TRIAL_KEY = "erddap-circuit-trial:{}"
+
+# How long a tripped circuit waits for a successful trial before being forgotten
+TRIPPED_SECONDS = 24 * 60 * 60
+
+CIRCUIT_STATUS_CODES = {
+    HTTPStatus.FORBIDDEN,
+    HTTPStatus.REQUEST_TIMEOUT,
+    HTTPStatus.TOO_MANY_REQUESTS,
+}
+CIRCUIT_ERRORS = (
+    httpx.TimeoutException,
+    httpx.ConnectError,
+    httpcore.ConnectError,
+    requests.Timeout,
+    requests.ConnectionError,
+)
+
+# Returns 1 if a request can be made, claiming the trial request if the circuit is half-open
+ALLOW_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+  return 1
+end
+if redis.call('EXISTS', KEYS[2]) == 1 then
+  return 0
+end
+if redis.call('SET', KEYS[3], '1', 'NX', 'EX', ARGV[1]) then
+  return 1
+end
+return 0
+"""
+
+# Returns 1 if the failure opened the circuit
+FAILURE_SCRIPT = """
+if redis.call('EXISTS', KEYS[2]) == 1 then
+  redis.call('SET', KEYS[3], '1', 'EX', ARGV[3])
+  redis.call('DEL', KEYS[4])
+  return 1
+end
+local failures = redis.call('INCR', KEYS[1])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+if failures >= tonumber(ARGV[1]) then
+  redis.call('DEL', KEYS[1])
+  redis.call('SET', KEYS[2], '1', 'EX', ARGV[2])
+  redis.call('SET', KEYS[3], '1', 'EX', ARGV[3])
+  return 1
+end
+return 0
+"""
+
+# Returns 1 if the success closed a tripped circuit
+SUCCESS_SCRIPT = """
+local tripped = redis.call('EXISTS', KEYS[2])
+redis.call('DEL', KEYS[1], KEYS[2], KEYS[3], KEYS[4])
+return tripped
+"""
+
+_scripts = {}
+
+
+class CircuitState(StrEnum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of making a request to a server whose circuit is open"""
+
+
+class CircuitStatusError(Exception):
+    """Raised for responses whose status counts towards opening a circuit"""
+
+    def __init__(self, response):
+        super().__init__(f"{response.status_code} response from {response.url}")
+        self.response = response
+
+
+def raise_for_circuit_status(response):
+    """Raise CircuitStatusError if a response should count towards opening a circuit,
+    for clients that don't otherwise raise for their status
+    """
+    if response.status_code in CIRCUIT_STATUS_CODES:
+        raise CircuitStatusError(response)
+
+
+def circuit_keys(server: ErddapServer | str) -> list[str]:
+    key = server_key(server if isinstance(server, str) else server.base_url)
+    return [
+        FAILURES_KEY.format(key),
+        TRIPPED_KEY.format(key),
+        OPEN_KEY.format(key),
+        TRIAL_KEY.format(key),
+    ]
+
+
+def run_script(name: str, script: str, keys: list[str], args: list) -> int:
+    if name not in _scripts:
+        _scripts[name] = get_redis_connection("default").register_script(script)
+    return _scripts[name](keys=keys, args=args)
+
+
+def response_status(error: Exception) -> int | None:
+    """The status code of the response an error was raised for, or None if the server didn't respond"""
+    for cause in (error, error.__cause__):
+        response = getattr(cause, "response", None)
+        status_code = getattr(response, "status_code", None)
+        if status_code is not None:
+            return status_code
+
+    return None
+
+
+def trips_circuit(error: Exception) -> bool:
+    """Should this error count towards opening a server's circuit?"""
+    if isinstance(error, CIRCUIT_ERRORS):
+        return True
+
+    return response_status(error) in CIRCUIT_STATUS_CODES
+
+
+def circuit_allows(server: ErddapServer | str) -> bool:
+    """Can a request be made to the server? Claims the trial request when half-open"""
+    _, tripped, open_, trial = circuit_keys(server)
+
+    try:
+        allowed = run_script(
+            "allow",
+            ALLOW_SCRIPT,
+            [tripped, open_, trial],
+            [settings.ERDDAP_CIRCUIT_OPEN_SECONDS],
+        )
+    except (RedisError, ConnectionInterrupted) as error:
+        logger.warning(f"Unable to check circuit for {server}, continuing: {error}")
+        return True
+
+    return bool(allowed)
+
+
+def check_circuit(server: ErddapServer | str):
+    """Raise CircuitOpenError if a request can't be made to the server"""
+    if not circuit_allows(server):
+        raise CircuitOpenError(f"Circuit is open for {server}, not making request")
+
+
+def record_failure(server: ErddapServer | str) -> bool:
+    """Count a failed request to the server. Returns True if the circuit opened"""
+    try:
+        opened = run_script(
+            "failure",
+            FAILURE_SCRIPT,
+            circuit_keys(server),
+            [
+                settings.ERDDAP_CIRCUIT_FAILURE_THRESHOLD,
+                TRIPPED_SECONDS,
+                settings.ERDDAP_CIRCUIT_OPEN_SECONDS,
+            ],
+        )
+    except (RedisError, ConnectionInterrupted) as error:
+        logger.warning(f"Unable to record circuit failure for {server}: {error}")
+        return False
+
+    if opened:
+        logger.warning(
+            f"Opened circuit for {server}, skipping requests for "
+            f"{settings.ERDDAP_CIRCUIT_OPEN_SECONDS} seconds",
+        )
+    return bool(opened)
+
+
+def record_success(server: ErddapServer | str):
+    """Reset the failures for a server, closing its circuit if it was tripped"""
+    try:
+        closed = run_script("success", SUCCESS_SCRIPT, circuit_keys(server), [])
+    except (RedisError, ConnectionInterrupted) as error:
+        logger.warning(f"Unable to record circuit success for {server}: {error}")
+        return
+
+    if closed:
+        logger.info(f"Closed circuit for {server}")
+
+
+def circuit_state(server: ErddapServer | str) -> tuple[CircuitState, int | None]:
+    """Returns the state of a server's circuit, and how many seconds until an open circuit
+    will let a trial request through
+    """
+    _, tripped, open_, _ = circuit_keys(server)
+
+    try:
+        pipe = get_redis_connection("default").pipeline()
+        pipe.exists(tripped)
+        pipe.ttl(open_)
+        is_tripped, open_seconds = pipe.execute()
+    except RedisError as error:
+        logger.warning(f"Unable to load circuit for {server}: {error}")
+        return CircuitState.CLOSED, None
+
+    if not is_tripped:
+        return CircuitState.CLOSED, None
+    if open_seconds > 0:
+        return CircuitState.OPEN, open_seconds
+    return CircuitState.HALF_OPEN, None
+
+
+def reset_circuit(server: ErddapServer | str):
+    """Close a server's circuit and forget its failures"""
+    get_redis_connection("default").delete(*circuit_keys(server))
+
+
+@contextmanager
+def circuit_breaker(server: ErddapServer | str):
+    """Raise CircuitOpenError rather than making requests to a server with an open circuit,
+    and record the outcome of requests made within the block.
+    """
+    check_circuit(server)
+    try:
+        yield
+    except Exception as error:
+        if trips_circuit(error):
+            record_failure(server)
+        elif response_status(error) is not None:
+            # Other error responses still show the server is answering
+            record_success(server)
+        raise
+    record_success(server)
+
+
+@asynccontextmanager
+async def acircuit_breaker(server: ErddapServer | str):
+    """Asynchronous `circuit_breaker` that doesn't block the event loop on Redis"""
+    if not await asyncio.to_thread(circuit_allows, server):
+        raise CircuitOpenError(f"Circuit is open for {server}, not making request")
+    try:
+        yield
+    except Exception as error:
+        if trips_circuit(error):
+            await asyncio.to_thread(record_failure, server)
+        elif response_status(error) is not None:
+            await asyncio.to_thread(record_success, server)
+        raise
+    await asyncio.to_thread(record_success, server)
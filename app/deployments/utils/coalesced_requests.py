@@ -0,0 +1,241 @@
+"""Combine requests for groups of timeseries that only differ by a single text constraint
+
+Datasets with many stations (say NDBC or tide gauge datasets) are often attached
+to many platforms, with each platform's timeseries constrained to a station (`station=`).
+Rather than requesting each station separately, the stations are requested together
+with a regex constraint (`station=~"A|B|C"`), and the returned dataframe is split
+back into a dataframe for each group of timeseries.
+"""
+
+import re
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from urllib.parse import quote
+
+import pandas as pd
+from django.conf import settings
+from erddapy import ERDDAP
+
+from ..models import ErddapServer, TimeSeries
+from . import refresh_ledger
+from .circuit_breaker import circuit_breaker
+from .erddap_datasets import parse_csvp, raise_for_erddap_status, setup_variables, sort_dataframe
+from .http_clients import server_client
+from .rate_limit import wait_for_request_slot
+
+# Values that can be combined into a regex without escaping.
+# `.` will match any character, but the response is split by exact values anyways.
+COALESCABLE_VALUE = re.compile(r"[\w .:-]+")
+
+# Combining fewer values than this doesn't save any requests
+MIN_COALESCED_VALUES = 2
+
+
+@dataclass
+class CoalescedRequest:
+    """A single request for groups of timeseries that only differ by the value of `column`"""
+
+    column: str
+    constraints: dict
+    forecast: bool = False
+    groups: dict[str, list[list[TimeSeries]]] = field(default_factory=dict)
+
+    @property
+    def timeseries_groups(self) -> list[list[TimeSeries]]:
+        return [group for groups in self.groups.values() for group in groups]
+
+    def request_constraints(self) -> dict:
+        """Shared constraints, along with a regex matching all the values of `column`"""
+        constraints = self.constraints.copy()
+        constraints[f"{self.column}=~"] = "|".join(self.groups)
+        return constraints
+
+    def erddap(self, server: ErddapServer, dataset: str) -> ERDDAP:
+        """Configure an ERDDAP request for all the groups"""
+        variables = {self.column} | {
+            series.variable for group in self.timeseries_groups for series in group
+        }
+        return setup_variables(
+            server.connection(),
+            dataset,
+            sorted(variables),
+            constraints=self.request_constraints(),
+            forecast=self.forecast,
+        )
+
+
+def coalescable_columns(constraints: dict) -> list[str]:
+    """Returns the variables of text equality constraints that requests could be combined by"""
+    return [
+        key[:-1]
+        for key, value in constraints.items()
+        if key.endswith("=")
+        and key[-2:] not in ("!=", "<=", ">=")
+        and isinstance(value, str)
+        and COALESCABLE_VALUE.fullmatch(value)
+    ]
+
+
+def plan_coalesced_requests(
+    server: ErddapServer,
+    dataset: str,
+    groups: list[list[TimeSeries]],
+    max_url_length: int | None = None,
+) -> tuple[list[CoalescedRequest], list[list[TimeSeries]]]:
+    """Combine groups of timeseries that only differ by a single text constraint into requests,
+    split up so that their URLs stay under `max_url_length`.
+
+    Returns the combined requests, and the groups that still need to be requested on their own.
+    """
+    max_url_length = max_url_length or settings.ERDDAP_MAX_URL_LENGTH
+
+    candidates = defaultdict(list)
+    for group in groups:
+        constraints = group[0].constraints or {}
+        forecast = any(ts.timeseries_type in TimeSeries.FUTURE_TYPES for ts in group)
+
+        for column in coalescable_columns(constraints):
+            shared = tuple(
+                (key, repr(value)) for key, value in sorted(constraints.items()) if key != f"{column}="
+            )
+            candidates[(column, forecast, shared)].append(group)
+
+    requests = []
+    coalesced = set()
+
+    # Combine by the constraints that would cover the most groups first
+    for (column, forecast, _), candidate_groups in sorted(
+        candidates.items(),
+        key=lambda item: len(item[1]),
+        reverse=True,
+    ):
+        remaining = [group for group in candidate_groups if id(group) not in coalesced]
+        if len({group[0].constraints[f"{column}="] for group in remaining}) < MIN_COALESCED_VALUES:
+            continue
+
+        shared = {
+            key: value for key, value in remaining[0][0].constraints.items() if key != f"{column}="
+        }
+
+        for request in chunk_request(
+            server,
+            dataset,
+            CoalescedRequest(column, shared, forecast),
+            remaining,
+            max_url_length,
+        ):
+            if len(request.groups) < MIN_COALESCED_VALUES:
+                continue
+
+            requests.append(request)
+            coalesced.update(id(group) for group in request.timeseries_groups)
+
+    return requests, [group for group in groups if id(group) not in coalesced]
+
+
+def request_url_length(server: ErddapServer, dataset: str, request: CoalescedRequest) -> int:
+    return len(request.erddap(server, dataset).get_download_url(response="csvp"))
+
+
+def value_url_length(value: str) -> int:
+    """The most that adding a value to the regex can lengthen a URL, however it's escaped"""
+    return len(quote(f"|{value}", safe=""))
+
+
+def chunk_request(
+    server: ErddapServer,
+    dataset: str,
+    empty_request: CoalescedRequest,
+    groups: list[list[TimeSeries]],
+    max_url_length: int,
+):
+    """Yield requests for the groups, starting a new request when the URL would get too long
+
+    Rather than building the URL for each group, the URL is only measured when a group
+    adds variables, and otherwise grows by the most that each new value could add.
+    """
+    column = empty_request.column
+
+    def new_request() -> CoalescedRequest:
+        return CoalescedRequest(column, empty_request.constraints, empty_request.forecast)
+
+    request = new_request()
+    variables = set()
+    url_length = 0
+
+    for group in groups:
+        value = group[0].constraints[f"{column}="]
+        group_variables = {series.variable for series in group}
+        new_value = value not in request.groups
+        request.groups.setdefault(value, []).append(group)
+
+        if group_variables <= variables:
+            url_length += value_url_length(value) if new_value else 0
+        else:
+            variables |= group_variables
+            url_length = request_url_length(server, dataset, request)
+
+        if url_length > max_url_length and len(request.groups) > 1:
+            request.groups[value].pop()
+            if not request.groups[value]:
+                del request.groups[value]
+
+            yield request
+
+            request = new_request()
+            request.groups[value] = [group]
+            variables = group_variables
+            url_length = request_url_length(server, dataset, request)
+
+    if request.groups:
+        yield request
+
+
+def retrieve_coalesced_dataframe(
+    server: ErddapServer,
+    dataset: str,
+    request: CoalescedRequest,
+) -> pd.DataFrame:
+    """Returns a dataframe from ERDDAP for all the groups of a combined request
+
+    Waits for the server's rate limit before requesting, and
+    attempts to sort the dataframe by time
+    """
+    e = request.erddap(server, dataset)
+    url = e.get_download_url(response="csvp")
+
+    with circuit_breaker(server):
+        wait = wait_for_request_slot(server)
+        start = time.perf_counter()
+        response = server_client(server).get(url)
+        fetch = time.perf_counter() - start
+        raise_for_erddap_status(response)
+
+    start = time.perf_counter()
+    erddap_df = parse_csvp(response.content, e.variables, string_variables=[request.column])
+    erddap_df = sort_dataframe(erddap_df, dataset)
+
+    refresh_ledger.record_for_groups(
+        request.timeseries_groups,
+        wait=wait,
+        fetch=fetch,
+        parse=time.perf_counter() - start,
+        bytes=len(response.content),
+        rows=len(erddap_df),
+    )
+
+    return erddap_df
+
+
+def split_dataframe(request: CoalescedRequest, df: pd.DataFrame) -> dict[str, pd.DataFrame]:
+    """Split a combined dataframe by the value of the request's column.
+
+    Values without any rows are left out.
+    """
+    column_name = [col for col in df.columns if col.split(" ")[0] == request.column][0]
+    values = df[column_name].astype(str)
+
+    return {
+        value: value_df for value, value_df in df.groupby(values, sort=False) if value in request.groups
+    }
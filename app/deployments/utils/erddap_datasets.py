@@ -1,10 +1,24 @@
+import asyncio
+import csv
+import hashlib
+import json
+from collections.abc import Iterable
 from datetime import UTC, datetime, timedelta
+from io import BytesIO
 from logging import getLogger
 
+import httpx
 import pandas as pd
+from django.conf import settings
+from django.core.cache import cache
+from django_redis.exceptions import ConnectionInterrupted
 from erddapy import ERDDAP
 
 from ..models import ErddapServer, TimeSeries
+from . import refresh_ledger
+from .circuit_breaker import acircuit_breaker, circuit_breaker
+from .http_clients import server_client
+from .rate_limit import await_request_slot, server_key, wait_for_request_slot
 
 logger = getLogger(__name__)
 
@@ -13,16 +27,11 @@ ERDDAP_TIME_COLUMN = "time (UTC)"
 TIME_COLUMN = "time"
 VALUE_COLUMN = "value"
 
-
-def filter_dataframe(df_to_filter: pd.DataFrame, column: str) -> pd.DataFrame:
-    """Remove invalid times and for the specified column, and renames time and value columns"""
-    filtered_df = df_to_filter[df_to_filter[ERDDAP_TIME_COLUMN].notna()]
-    column_name = [col for col in filtered_df.columns if col.split(" ")[0] == column][0]
-    filtered_df = filtered_df[filtered_df[column_name].notna()]
-    filtered_df = filtered_df[[ERDDAP_TIME_COLUMN, column_name]]
-    filtered_df = filtered_df.rename(columns={column_name: VALUE_COLUMN, ERDDAP_TIME_COLUMN: "time"})
-    filtered_df[TIME_COLUMN] = pd.to_datetime(filtered_df[TIME_COLUMN])
-    return filtered_df
+# Observations keep the most recent window of rows for each group of timeseries
+# in the Django cache, so that refreshes only need to request the rows since the last refresh.
+# Predictions and forecasts are fully requested each time, as future values get replaced.
+WINDOW_KEY = "erddap-window:{}"
+WINDOW = timedelta(hours=24)
 
 
 def setup_variables(  # noqa: PLR0913
@@ -60,33 +69,287 @@ def setup_variables(  # noqa: PLR0913
     return server
 
 
-def retrieve_dataframe(
+def dataset_request(
     server: ErddapServer,
     dataset: str,
     constraints,
     timeseries: list[TimeSeries],
-) -> pd.DataFrame:
-    """Returns a dataframe from ERDDAP for a given dataset
-
-    Attempts to sort the dataframe by time
-    """
+    time: datetime | None = None,
+) -> ERDDAP:
+    """Configure an ERDDAP request for the variables of a group of timeseries"""
     forecast = any(ts.timeseries_type in TimeSeries.FUTURE_TYPES for ts in timeseries)
-    e = setup_variables(
+    return setup_variables(
         server.connection(),
         dataset,
         list({series.variable for series in timeseries}),
         constraints=constraints,
+        time=time,
         forecast=forecast,
     )
 
-    timeout_seconds = server.request_timeout_seconds
-    e.requests_kwargs["timeout"] = timeout_seconds
-
-    erddap_df = e.to_pandas(parse_dates=True)
 
+def sort_dataframe(erddap_df: pd.DataFrame, dataset: str) -> pd.DataFrame:
+    """Attempts to sort the dataframe by time, unless ERDDAP already returned it in order"""
     try:
-        erddap_df = erddap_df.sort_values("time (UTC)")
+        if not erddap_df[ERDDAP_TIME_COLUMN].is_monotonic_increasing:
+            erddap_df = erddap_df.sort_values(ERDDAP_TIME_COLUMN, kind="stable")
     except KeyError:
-        logger.warning(f"Unable to sort dataframe by `time (UTC)` for {dataset}")
+        logger.warning(f"Unable to sort dataframe by `{ERDDAP_TIME_COLUMN}` for {dataset}")
+
+    return erddap_df
+
+
+def parse_csvp(
+    content: bytes,
+    variables: Iterable[str] | None = None,
+    string_variables: Iterable[str] = (),
+) -> pd.DataFrame:
+    """Parse a tabledap `.csvp` response with the schema that refreshes expect
+
+    Only time and the requested variables are read (or every column if not given).
+    Values are read as float64, other than `string_variables`, and time is parsed once
+    into UTC datetimes.
+
+    If any values aren't numeric, the columns are read with inferred types instead.
+    """
+    header_line = content.split(b"\n", 1)[0].decode("latin-1").strip()
+    header = next(csv.reader([header_line]))
+    columns = {name.split(" ")[0]: name for name in header}
+
+    string_columns = {columns[variable] for variable in string_variables if variable in columns}
+    if variables is None:
+        usecols = header
+    else:
+        wanted = {"time", *variables, *string_variables}
+        usecols = [name for variable, name in columns.items() if variable in wanted]
+
+    dtype = {
+        name: str if name in string_columns else "float64"
+        for name in usecols
+        if name != ERDDAP_TIME_COLUMN
+    }
+
+    try:
+        erddap_df = pd.read_csv(BytesIO(content), usecols=usecols, dtype=dtype)
+    except ValueError:
+        erddap_df = pd.read_csv(
+            BytesIO(content),
+            usecols=usecols,
+            dtype=dict.fromkeys(string_columns, str),
+        )
+
+    if ERDDAP_TIME_COLUMN in erddap_df:
+        erddap_df[ERDDAP_TIME_COLUMN] = pd.to_datetime(
+            erddap_df[ERDDAP_TIME_COLUMN],
+            format="ISO8601",
+            utc=True,
+        )
 
     return erddap_df
+
+
+def raise_for_erddap_status(response: httpx.Response):
+    """Raise errors the same way that erddapy does, so they can be handled by `handle_http_errors`"""
+    try:
+        response.raise_for_status()
+    except httpx.HTTPStatusError as error:
+        raise httpx.HTTPError(response.text) from error
+
+
+def window_key(
+    server: ErddapServer,
+    dataset: str,
+    constraints,
+    timeseries: list[TimeSeries],
+) -> str | None:
+    """Cache key for the window of a group of timeseries,
+    or None if the group shouldn't be refreshed incrementally
+    """
+    if not settings.ERDDAP_INCREMENTAL_REFRESH:
+        return None
+
+    if any(ts.timeseries_type in TimeSeries.FUTURE_TYPES for ts in timeseries):
+        return None
+
+    group = json.dumps(
+        {
+            "server": server_key(server.base_url),
+            "dataset": dataset,
+            "constraints": constraints or {},
+            "variables": sorted({ts.variable for ts in timeseries}),
+        },
+        sort_keys=True,
+        default=str,
+    )
+    return WINDOW_KEY.format(hashlib.sha256(group.encode()).hexdigest())
+
+
+def cached_window(key: str | None) -> pd.DataFrame | None:
+    """Returns the cached window for a group, if there is one"""
+    if key is None:
+        return None
+
+    try:
+        return cache.get(key)
+    except ConnectionInterrupted as error:
+        logger.warning(f"Unable to load cached window, requesting full window: {error}")
+        return None
+
+
+def window_start(window: pd.DataFrame | None) -> datetime | None:
+    """The time to request new rows from, which is the time of the last row in the window.
+
+    The last row is requested again, so that ERDDAP always has a row to return,
+    rather than erroring when there are no new rows.
+    """
+    if window is None or window.empty:
+        return None
+
+    return pd.to_datetime(window[ERDDAP_TIME_COLUMN], utc=True).max().to_pydatetime()
+
+
+def merge_window(window: pd.DataFrame | None, new_df: pd.DataFrame) -> pd.DataFrame:
+    """Add new rows to a window, dropping repeated rows and rows older than the window
+
+    Rows for a time that is already in the window replace it, so that values
+    revised by the server don't leave the old value behind.
+    """
+    if window is None or window.empty:
+        return new_df
+
+    merged = pd.concat([window, new_df], ignore_index=True)
+    merged = merged.drop_duplicates(subset=[ERDDAP_TIME_COLUMN], keep="last")
+    merged = merged.sort_values(ERDDAP_TIME_COLUMN, kind="stable")
+
+    times = pd.to_datetime(merged[ERDDAP_TIME_COLUMN], utc=True)
+    return merged[times >= times.max() - WINDOW].reset_index(drop=True)
+
+
+def store_window(key: str | None, window: pd.DataFrame):
+    """Cache the window for a group, as long as it has current data to build on"""
+    if key is None or window.empty or ERDDAP_TIME_COLUMN not in window:
+        return
+
+    latest = pd.to_datetime(window[ERDDAP_TIME_COLUMN], utc=True).max()
+    if pd.isna(latest) or latest < datetime.now(UTC) - WINDOW:
+        return
+
+    try:
+        cache.set(key, window, int(WINDOW.total_seconds()))
+    except ConnectionInterrupted as error:
+        logger.warning(f"Unable to cache window: {error}")
+
+
+def clear_window(key: str | None):
+    """Drop the cached window for a group, so that the next refresh requests the full window"""
+    if key is None:
+        return
+
+    try:
+        cache.delete(key)
+    except ConnectionInterrupted as error:
+        logger.warning(f"Unable to clear cached window: {error}")
+
+
+def retrieve_dataframe(
+    server: ErddapServer,
+    dataset: str,
+    constraints,
+    timeseries: list[TimeSeries],
+) -> pd.DataFrame:
+    """Returns a dataframe from ERDDAP for a given dataset
+
+    Waits for the server's rate limit before requesting, and
+    attempts to sort the dataframe by time.
+
+    For observations with a cached window, only rows since the window are requested,
+    and the full window is returned.
+    """
+    key = window_key(server, dataset, constraints, timeseries)
+    window = cached_window(key)
+
+    e = dataset_request(server, dataset, constraints, timeseries, time=window_start(window))
+    url = e.get_download_url(response="csvp")
+
+    with circuit_breaker(server):
+        refresh_ledger.record(timeseries, wait=wait_for_request_slot(server))
+        try:
+            with refresh_ledger.timed("fetch", timeseries):
+                response = server_client(server).get(url)
+            raise_for_erddap_status(response)
+        except httpx.HTTPError:
+            clear_window(key)
+            raise
+
+    with refresh_ledger.timed("parse", timeseries):
+        erddap_df = parse_csvp(response.content, e.variables)
+        refresh_ledger.record(timeseries, bytes=len(response.content), rows=len(erddap_df))
+
+        erddap_df = merge_window(window, sort_dataframe(erddap_df, dataset))
+    store_window(key, erddap_df)
+
+    return erddap_df
+
+
+async def aretrieve_dataframe(
+    client: httpx.AsyncClient,
+    server: ErddapServer,
+    dataset: str,
+    constraints,
+    timeseries: list[TimeSeries],
+) -> pd.DataFrame:
+    """Asynchronously returns a dataframe from ERDDAP for a given dataset
+
+    Requests the same URL and raises the same errors as `retrieve_dataframe`.
+    """
+    key = window_key(server, dataset, constraints, timeseries)
+    window = await asyncio.to_thread(cached_window, key)
+
+    e = dataset_request(server, dataset, constraints, timeseries, time=window_start(window))
+    url = e.get_download_url(response="csvp")
+
+    async with acircuit_breaker(server):
+        refresh_ledger.record(timeseries, wait=await await_request_slot(server))
+        with refresh_ledger.timed("fetch", timeseries):
+            response = await client.get(url)
+        try:
+            raise_for_erddap_status(response)
+        except httpx.HTTPError:
+            await asyncio.to_thread(clear_window, key)
+            raise
+
+    with refresh_ledger.timed("parse", timeseries):
+        erddap_df = parse_csvp(response.content, e.variables)
+        refresh_ledger.record(timeseries, bytes=len(response.content), rows=len(erddap_df))
+
+        erddap_df = merge_window(window, sort_dataframe(erddap_df, dataset))
+    await asyncio.to_thread(store_window, key, erddap_df)
+
+    return erddap_df
+
+
+def retrieve_time_coverage_end(server: ErddapServer, dataset: str) -> datetime | None:
+    """Returns the `time_coverage_end` of a dataset from its info, if it has one
+
+    Raises httpx errors if the info could not be retrieved.
+    """
+    url = server.connection().get_info_url(dataset, response="csv")
+
+    with circuit_breaker(server):
+        wait_for_request_slot(server)
+        response = server_client(server).get(url)
+        raise_for_erddap_status(response)
+
+    info = pd.read_csv(BytesIO(response.content))
+    values = info[
+        (info["Variable Name"] == "NC_GLOBAL") & (info["Attribute Name"] == "time_coverage_end")
+    ]["Value"]
+
+    if values.empty:
+        return None
+
+    time_coverage_end = pd.to_datetime(values.iloc[0], utc=True, errors="coerce")
+    if pd.isna(time_coverage_end):
+        return None
+
+    return time_coverage_end.to_pydatetime()
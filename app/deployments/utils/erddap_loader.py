@@ -1,9 +1,11 @@
 import logging
 from datetime import datetime, timedelta
+from io import BytesIO
 
+import httpx
 import pandas as pd
+import xarray as xr
 from erddapy import ERDDAP
-from requests.exceptions import HTTPError
 
 from ..models import (
     BufferType,
@@ -13,6 +15,8 @@ from ..models import (
     Platform,
     TimeSeries,
 )
+from .http_clients import server_client
+from .rate_limit import wait_for_request_slot
 
 logger = logging.getLogger(__name__)
 
@@ -28,7 +32,10 @@ def add_timeseries(platform: Platform, server: str, dataset: str, constraints):
     """
     e = ERDDAP(server)
 
-    info = pd.read_csv(e.get_info_url(dataset, response="csv"))
+    wait_for_request_slot(server)
+    response = server_client(server).get(e.get_info_url(dataset, response="csv"))
+    response.raise_for_status()
+    info = pd.read_csv(BytesIO(response.content))
     info_vars = info[info["Row Type"] == "variable"]
 
     logger.info(f"Opened dataset from ERDDAP and found variables: {''.join(info_vars)}")
@@ -67,15 +74,19 @@ def add_timeseries(platform: Platform, server: str, dataset: str, constraints):
     e.constraints = constraints.copy()
     e.constraints["time>="] = yesterday
 
+    wait_for_request_slot(server)
     try:
-        ds = e.to_xarray()
-    except HTTPError:
+        response = server_client(server).get(e.get_download_url())
+        response.raise_for_status()
+    except httpx.HTTPError:
         logger.error(
             "Either the dataset was invalid, the server was down, "
             "or the dataset has not been updated in the last day",
         )
         return
 
+    ds = xr.open_dataset(BytesIO(response.content))
+
     try:
         buffer = BufferType.objects.get(name=ds.buffer_type)
     except BufferType.DoesNotExist:
@@ -0,0 +1,93 @@
+"""Remember groups of timeseries whose requests will keep failing for a while, so refreshes skip them
+
+Errors that `tasks.error_handling` recognizes as lasting (no rows, a station or variable
+that the dataset doesn't have, a dataset that the server doesn't know about)
+are saved as a `FailedRequest` for the dataset and group, which expires after
+`settings.FAILED_REQUEST_TTL_MINUTES` for the reason. Until then, refreshes skip the group,
+rather than spending a request and its place in the server's rate limit on it.
+
+Forced refreshes clear the failures for the dataset first, and they can be cleared from the admin.
+"""
+
+import hashlib
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from deployments.models import ErddapDataset, FailedRequest, TimeSeries
+
+from .refresh_ledger import group_label
+
+logger = logging.getLogger(__name__)
+
+# Enough of the error to tell what went wrong in the admin
+MAX_MESSAGE_LENGTH = 2000
+
+
+def group_key(timeseries: list[TimeSeries]) -> str:
+    """Hash of the constraints and variables of a group of timeseries"""
+    return hashlib.sha256(group_label(timeseries).encode()).hexdigest()
+
+
+def remember_failure(timeseries: list[TimeSeries], reason: FailedRequest.Reason, message: str):
+    """Skip the group of timeseries in refreshes until the TTL for the reason has passed"""
+    minutes = settings.FAILED_REQUEST_TTL_MINUTES.get(reason, 0)
+    if not minutes:
+        return
+
+    now = timezone.now()
+    expires = now + timedelta(minutes=minutes)
+    message = message[:MAX_MESSAGE_LENGTH]
+
+    FailedRequest.objects.update_or_create(
+        dataset=timeseries[0].dataset,
+        group_key=group_key(timeseries),
+        defaults={
+            "reason": reason,
+            "message": message,
+            "failures": F("failures") + 1,
+            "last_failed": now,
+            "expires": expires,
+        },
+        create_defaults={
+            "constraints": timeseries[0].constraints,
+            "variables": sorted({series.variable for series in timeseries}),
+            "reason": reason,
+            "message": message,
+            "first_failed": now,
+            "last_failed": now,
+            "expires": expires,
+        },
+    )
+    logger.info(
+        f"Skipping {timeseries[0].dataset.name} with constraints {timeseries[0].constraints} "
+        f"until {expires} as it failed with {reason}",
+    )
+
+
+def skip_failed_requests(dataset: ErddapDataset, groups: dict[tuple, list[TimeSeries]]) -> dict:
+    """The groups of timeseries for a dataset, without those that have recently failed"""
+    failed = set(
+        FailedRequest.objects.active().filter(dataset=dataset).values_list("group_key", flat=True),
+    )
+    if not failed:
+        return groups
+
+    remaining = {
+        key: timeseries for key, timeseries in groups.items() if group_key(timeseries) not in failed
+    }
+    if len(remaining) < len(groups):
+        logger.info(
+            f"Skipping {len(groups) - len(remaining)} groups of timeseries in dataset {dataset.id} "
+            "that have recently failed",
+        )
+    return remaining
+
+
+def clear_failures(dataset: ErddapDataset) -> int:
+    """Forget the failures for a dataset, so all its groups are requested again"""
+    deleted, _ = FailedRequest.objects.filter(dataset=dataset).delete()
+    return deleted
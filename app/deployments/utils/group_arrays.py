@@ -0,0 +1,92 @@
+"""Split the dataframe for a group of timeseries into NumPy arrays for each variable in a single pass
+
+Rather than filtering, copying, and renaming the group dataframe for each timeseries,
+the values for all variables are copied once into a column-major block,
+so that each variable's values are a contiguous view into it,
+alongside a shared time array and a mask of valid rows.
+"""
+
+from collections.abc import Iterable
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from .erddap_datasets import ERDDAP_TIME_COLUMN
+
+
+@dataclass
+class SeriesArrays:
+    """Time and values for a single variable, with a mask of rows where both are valid
+
+    `time` is UTC datetime64[ns], and `value` is float64.
+    Both are views into the group's arrays, and should not be modified.
+    """
+
+    time: np.ndarray
+    value: np.ndarray
+    valid: np.ndarray
+
+    def valid_rows(self) -> np.ndarray:
+        """Indexes of rows with a valid time and value"""
+        return np.flatnonzero(self.valid)
+
+    def timestamp(self, row: int) -> pd.Timestamp:
+        """The UTC time of a row"""
+        return pd.Timestamp(self.time[row], tz="UTC")
+
+
+@dataclass
+class GroupArrays:
+    """Times and values for all the variables of a group of timeseries
+
+    `block` has a float64 column of values for each variable, indexed by `columns`.
+    """
+
+    time: np.ndarray
+    block: np.ndarray
+    columns: dict[str, int]
+
+    @classmethod
+    def from_dataframe(cls, df: pd.DataFrame, variables: Iterable[str]) -> "GroupArrays":
+        """Copy the values for variables out of a group dataframe.
+
+        Columns are matched by variable name, ignoring units.
+        Missing variables are left out, and non-numeric values or times become NaN or NaT.
+        """
+        variables = set(variables)
+
+        times = df[ERDDAP_TIME_COLUMN]
+        if not pd.api.types.is_datetime64_any_dtype(times):
+            times = pd.to_datetime(times, format="ISO8601", utc=True, errors="coerce")
+        elif times.dt.tz is not None:
+            times = times.dt.tz_convert("UTC")
+        time = times.to_numpy(dtype="datetime64[ns]")
+
+        column_names = {}
+        for name in df.columns:
+            variable = name.split(" ")[0]
+            if variable in variables and variable not in column_names:
+                column_names[variable] = name
+
+        values = np.empty((len(df), len(column_names)), dtype="float64", order="F")
+        for index, name in enumerate(column_names.values()):
+            column = df[name]
+            if column.dtype != "float64":
+                column = pd.to_numeric(column, errors="coerce")
+            values[:, index] = column.to_numpy(dtype="float64", na_value=np.nan)
+
+        return cls(
+            time=time,
+            block=values,
+            columns={variable: index for index, variable in enumerate(column_names)},
+        )
+
+    def series(self, variable: str) -> SeriesArrays:
+        """Arrays for a single variable. Raises KeyError if the variable wasn't in the dataframe"""
+        value = self.block[:, self.columns[variable]]
+        return SeriesArrays(
+            time=self.time,
+            value=value,
+            valid=~np.isnat(self.time) & ~np.isnan(value),
+        )
@@ -0,0 +1,103 @@
+"""Pooled HTTP clients for ERDDAP servers
+
+Each process keeps one `httpx.Client` per server, so that requests to a server
+reuse kept-alive connections rather than opening a new TLS connection each time.
+Clients use the server's `request_timeout_seconds`, and keep up to
+`request_concurrency` connections alive.
+
+If `settings.ERDDAP_HTTP2` is set and the `h2` package is installed,
+clients will use HTTP/2 with servers that support it.
+
+Async clients are tied to an event loop, so `async_server_client` returns
+a new client with the same configuration to be used as a context manager.
+"""
+
+import atexit
+import importlib.util
+import logging
+import threading
+
+import httpx
+from django.conf import settings
+
+from ..models import ErddapServer
+from .rate_limit import server_key
+
+logger = logging.getLogger(__name__)
+
+# Connections kept open to a server beyond its request concurrency,
+# for the info and time_coverage_end requests made between data requests
+EXTRA_CONNECTIONS = 2
+
+_clients: dict[str, tuple[tuple, httpx.Client]] = {}
+_lock = threading.Lock()
+
+
+def http2_enabled() -> bool:
+    if not settings.ERDDAP_HTTP2:
+        return False
+
+    if importlib.util.find_spec("h2") is None:
+        logger.warning("ERDDAP_HTTP2 is set, but the h2 package isn't installed. Using HTTP/1.1")
+        return False
+
+    return True
+
+
+def client_config(server: ErddapServer | str) -> tuple[str, float, int, bool]:
+    """Returns the key, timeout, connection limit, and HTTP/2 setting for a server"""
+    if isinstance(server, ErddapServer):
+        return (
+            server_key(server.base_url),
+            server.request_timeout_seconds,
+            max(server.request_concurrency, 1) + EXTRA_CONNECTIONS,
+            http2_enabled(),
+        )
+
+    return server_key(server), settings.ERDDAP_TIMEOUT_SECONDS, 1 + EXTRA_CONNECTIONS, http2_enabled()
+
+
+def client_options(timeout: float, connections: int, http2: bool) -> dict:
+    return {
+        "timeout": timeout,
+        "limits": httpx.Limits(max_connections=connections, max_keepalive_connections=connections),
+        "http2": http2,
+        "follow_redirects": True,
+    }
+
+
+def server_client(server: ErddapServer | str) -> httpx.Client:
+    """Returns the pooled client for a server, creating it if the server's settings have changed.
+
+    Servers given by URL share any client already created for that server.
+    Replaced clients aren't closed, as other threads may still be making requests with them,
+    so their connections are closed once they are garbage collected.
+    """
+    key, *config = client_config(server)
+
+    with _lock:
+        existing = _clients.get(key)
+        if existing is not None and (isinstance(server, str) or existing[0] == tuple(config)):
+            return existing[1]
+
+        client = httpx.Client(**client_options(*config))
+        _clients[key] = (tuple(config), client)
+
+    return client
+
+
+def async_server_client(server: ErddapServer | str) -> httpx.AsyncClient:
+    """Returns a new async client configured the same as the server's pooled client"""
+    _, *config = client_config(server)
+    return httpx.AsyncClient(**client_options(*config))
+
+
+@atexit.register
+def close_clients():
+    """Close all the pooled clients and their connections"""
+    with _lock:
+        clients = [client for _, client in _clients.values()]
+        _clients.clear()
+
+    for client in clients:
+        client.close()
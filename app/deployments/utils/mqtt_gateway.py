@@ -0,0 +1,308 @@
+"""Subscribe to the MQTT brokers of every configured ERDDAP server from a single asyncio event loop
+
+Rather than a process with its own network thread for each server, `MqttGateway` drives
+a paho client for each `ErddapServer` with an MQTT broker and credentials from one event loop,
+using paho's socket callbacks. Every `index_refresh_seconds` the configured servers are reloaded,
+so servers that are added, changed, or removed in the admin are picked up without a restart.
+If the database can't be reached, the current subscriptions are kept until the next reload.
+
+Each subscription collects change notifications for its datasets with a `ChangeDebouncer`,
+and once a second refreshes that have become due are enqueued, and notification counts saved,
+from a worker thread so that the event loop never waits on Redis or Postgres.
+Connecting to brokers also happens from a worker thread, as resolving a broker's address
+and opening its socket block.
+"""
+
+import asyncio
+import logging
+import threading
+from collections import Counter
+from dataclasses import dataclass
+
+import paho.mqtt.client as mqtt
+from asgiref.sync import sync_to_async
+from django.db import DatabaseError, close_old_connections
+
+from deployments.models import ErddapServer
+from deployments.tasks import single_refresh_dataset
+from deployments.tasks.queue import PUSH_QUEUE
+
+from .change_payloads import parse_change_payload
+from .mqtt_notifications import ChangeDebouncer, DatasetIndex, PendingChange, count_notifications
+
+logger = logging.getLogger(__name__)
+
+TICK_SECONDS = 1
+CONNECT_TIMEOUT_SECONDS = 5
+KEEPALIVE_SECONDS = 60
+MAX_RECONNECT_SECONDS = 5 * 60
+
+
+@dataclass(frozen=True)
+class BrokerConfig:
+    broker: str
+    port: int
+    username: str
+    password: str
+
+    @classmethod
+    def for_server(cls, server: ErddapServer) -> "BrokerConfig":
+        return cls(server.mqtt_broker, server.mqtt_port, server.mqtt_username, server.mqtt_password)
+
+
+def configured_servers() -> dict[int, ErddapServer]:
+    """Servers that have an MQTT broker and credentials, by id"""
+    servers = ErddapServer.objects.exclude(mqtt_broker__isnull=True).exclude(mqtt_broker="")
+    return {server.id: server for server in servers if server.mqtt_username and server.mqtt_password}
+
+
+class AsyncioHelper:
+    """Drive the socket of a paho client from an asyncio event loop, rather than its own thread
+
+    Sockets are opened from the worker thread that connects, so paho's socket callbacks
+    are passed back to the event loop when they come from another thread.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, client: mqtt.Client):
+        self.loop = loop
+        self.client = client
+        self.misc: asyncio.Task | None = None
+        self.loop_thread = threading.get_ident()
+
+        client.on_socket_open = self.on_socket_open
+        client.on_socket_close = self.on_socket_close
+        client.on_socket_register_write = self.on_socket_register_write
+        client.on_socket_unregister_write = self.on_socket_unregister_write
+
+    def call_in_loop(self, callback, *args):
+        if threading.get_ident() == self.loop_thread:
+            callback(*args)
+        else:
+            self.loop.call_soon_threadsafe(callback, *args)
+
+    # The socket may be closed by the time a callback from another thread runs,
+    # so the loop is given its file descriptor instead
+    def on_socket_open(self, client, userdata, sock):
+        self.call_in_loop(self.watch_socket, sock.fileno())
+
+    def on_socket_close(self, client, userdata, sock):
+        self.call_in_loop(self.unwatch_socket, sock.fileno())
+
+    def on_socket_register_write(self, client, userdata, sock):
+        self.call_in_loop(self.loop.add_writer, sock.fileno(), client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        self.call_in_loop(self.loop.remove_writer, sock.fileno())
+
+    def watch_socket(self, fd: int):
+        self.loop.add_reader(fd, self.client.loop_read)
+        self.misc = self.loop.create_task(self.loop_misc())
+
+    def unwatch_socket(self, fd: int):
+        self.loop.remove_reader(fd)
+        if self.misc is not None:
+            self.misc.cancel()
+
+    async def loop_misc(self):
+        """Let paho send keepalives while connected"""
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(TICK_SECONDS)
+
+
+class ServerSubscription:
+    """An MQTT client for a server's broker, and the datasets that it has been notified about"""
+
+    def __init__(
+        self,
+        server: ErddapServer,
+        loop: asyncio.AbstractEventLoop,
+        debouncer: ChangeDebouncer,
+        index_refresh_seconds: float,
+        client_id: str,
+    ):
+        self.server = server
+        self.config = BrokerConfig.for_server(server)
+        self.loop = loop
+        self.debouncer = debouncer
+        self.index = DatasetIndex(server, index_refresh_seconds)
+        self.counts = Counter()
+        self.reconnect_seconds = 1
+        self.stopped = False
+
+        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id)
+        self.client.username_pw_set(username=self.config.username, password=self.config.password)
+        self.client.connect_timeout = CONNECT_TIMEOUT_SECONDS
+        self.client.on_connect = self.on_connect
+        self.client.on_disconnect = self.on_disconnect
+        self.client.on_message = self.on_message
+        AsyncioHelper(loop, self.client)
+
+    def connect(self):
+        self.client.connect_async(self.config.broker, self.config.port, KEEPALIVE_SECONDS)
+        self.reconnect()
+
+    def reconnect(self):
+        """Connect from a worker thread, so that the event loop doesn't wait on the broker"""
+        if self.stopped:
+            return
+        self.loop.run_in_executor(None, self.open_connection)
+
+    def open_connection(self):
+        try:
+            self.client.reconnect()
+        except (OSError, mqtt.WebsocketConnectionError) as error:
+            logger.warning(f"Unable to connect to MQTT broker for {self.server}: {error}")
+            self.loop.call_soon_threadsafe(self.schedule_reconnect)
+
+    def schedule_reconnect(self):
+        """Try again later, waiting longer each time the broker can't be reached"""
+        if self.stopped:
+            return
+        self.loop.call_later(self.reconnect_seconds, self.reconnect)
+        self.reconnect_seconds = min(self.reconnect_seconds * 2, MAX_RECONNECT_SECONDS)
+
+    def stop(self):
+        self.stopped = True
+        self.client.disconnect()
+
+    def on_connect(self, client, userdata, flags, reason_code, properties):
+        if reason_code.is_failure:
+            logger.error(f"MQTT broker for {self.server} refused the connection: {reason_code}")
+            return
+
+        logger.info(f"Connected to MQTT broker ({self.config.broker}) for {self.server}")
+        self.reconnect_seconds = 1
+        client.subscribe("change/#")
+
+    def on_disconnect(self, client, userdata, flags, reason_code, properties):
+        if self.stopped:
+            return
+        logger.warning(f"Disconnected from MQTT broker for {self.server}: {reason_code}")
+        self.schedule_reconnect()
+
+    def on_message(self, client, userdata, msg):
+        dataset_name = msg.topic.split("/")[-1]
+        dataset_id = self.index.get(dataset_name)
+
+        self.counts["messages"] += 1
+        if dataset_id is None:
+            logger.debug(f"No dataset found for name {dataset_name} on server {self.server}")
+            self.counts["unknown"] += 1
+            return
+
+        self.debouncer.notify(dataset_id, parse_change_payload(msg.payload))
+
+    async def tick(self):
+        """Enqueue refreshes for datasets whose notifications have settled,
+        save notification counts, and reload the dataset index when it's stale
+        """
+        due = self.debouncer.pop_due_changes()
+        counts, self.counts = self.counts, Counter()
+
+        if due or counts or self.index.seconds_until_stale() == 0:
+            await sync_to_async(self.save)(due, counts)
+
+    def save(self, due: dict[int, PendingChange], counts: Counter):
+        scheduled = []
+        for dataset_id, change in due.items():
+            try:
+                # Clear end_time since MQTT notification indicates new data is available
+                single_refresh_dataset.delay(
+                    dataset_id,
+                    clear_end_time=True,
+                    queue=PUSH_QUEUE,
+                    changes=change.changes,
+                )
+            except Exception:
+                logger.exception(f"Unable to schedule refresh for dataset {dataset_id}, trying again")
+                self.debouncer.notify(dataset_id, change.changes)
+                continue
+
+            scheduled.append(dataset_id)
+        if scheduled:
+            logger.info(f"Scheduled refreshes for datasets {scheduled} on {self.server}")
+            counts["refreshes"] += len(scheduled)
+
+        if counts:
+            count_notifications(self.server, **counts)
+
+        self.index.reload_if_stale()
+
+
+class MqttGateway:
+    """Subscriptions to the MQTT brokers of every configured server, kept in sync with the database"""
+
+    def __init__(
+        self,
+        quiet_seconds: float,
+        max_delay_seconds: float,
+        index_refresh_seconds: float,
+        client_id: str,
+    ):
+        self.quiet_seconds = quiet_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self.index_refresh_seconds = index_refresh_seconds
+        self.client_id = client_id
+        self.subscriptions: dict[int, ServerSubscription] = {}
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        next_sync = 0.0
+
+        while True:
+            if loop.time() >= next_sync:
+                await self.try_sync_servers()
+                next_sync = loop.time() + self.index_refresh_seconds
+
+            subscriptions = list(self.subscriptions.values())
+            results = await asyncio.gather(
+                *(subscription.tick() for subscription in subscriptions),
+                return_exceptions=True,
+            )
+            for subscription, result in zip(subscriptions, results, strict=True):
+                if isinstance(result, Exception):
+                    logger.error(
+                        f"Unable to save notifications for {subscription.server}",
+                        exc_info=result,
+                    )
+            await asyncio.sleep(TICK_SECONDS)
+
+    async def try_sync_servers(self):
+        """Sync servers, keeping the current subscriptions if the database can't be reached"""
+        await sync_to_async(close_old_connections)()
+        try:
+            await self.sync_servers()
+        except DatabaseError:
+            logger.exception(
+                f"Unable to load configured servers, keeping {len(self.subscriptions)} "
+                "subscriptions until the next sync",
+            )
+
+    async def sync_servers(self):
+        """Subscribe to newly configured servers, and resubscribe or unsubscribe changed ones"""
+        servers = await sync_to_async(configured_servers)()
+
+        for server_id in set(self.subscriptions) - set(servers):
+            subscription = self.subscriptions.pop(server_id)
+            logger.info(f"Unsubscribing from {subscription.server}, as its broker was removed")
+            subscription.stop()
+
+        for server_id, server in servers.items():
+            current = self.subscriptions.get(server_id)
+            if current is not None and current.config == BrokerConfig.for_server(server):
+                continue
+
+            if current is not None:
+                logger.info(f"Resubscribing to {server}, as its broker changed")
+                current.stop()
+
+            subscription = ServerSubscription(
+                server,
+                asyncio.get_running_loop(),
+                ChangeDebouncer(self.quiet_seconds, self.max_delay_seconds),
+                self.index_refresh_seconds,
+                client_id=f"{self.client_id}-{server.name}",
+            )
+            await sync_to_async(subscription.index.load)()
+            subscription.connect()
+            self.subscriptions[server_id] = subscription
@@ -0,0 +1,170 @@
+"""Coalesce bursts of ERDDAP MQTT change notifications into a single refresh for each dataset
+
+ERDDAP often sends several change notifications for a dataset as its files land,
+so rather than refreshing for each, `ChangeDebouncer` waits until a dataset's notifications
+have been quiet for a while, or until a maximum delay since the first one,
+before it's due to be refreshed.
+
+When a message's payload says what changed (see `change_payloads`), the changes are kept
+with the notifications, so that only the groups of timeseries they match are refreshed.
+
+Messages are matched to datasets with a `DatasetIndex` of the server's dataset ids by name,
+which is reloaded periodically outside of the MQTT network thread,
+so handling a message doesn't wait on the database.
+
+Counts of notifications received and refreshes scheduled for each server are kept in Redis,
+for the admin.
+"""
+
+import logging
+import threading
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+
+from django.db import DatabaseError, close_old_connections
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+from deployments.models import ErddapDataset, ErddapServer
+
+from .change_payloads import Changes, merge_changes
+
+logger = logging.getLogger(__name__)
+
+COUNTS_KEY = "mqtt-notifications:{}"
+
+
+@dataclass
+class PendingChange:
+    first: float
+    last: float
+    notifications: int = 1
+    # What changed, or None for the whole dataset
+    changes: Changes | None = None
+
+
+class ChangeDebouncer:
+    """Collect change notifications until a key has been quiet for `quiet_seconds`,
+    or `max_delay_seconds` have passed since its first notification.
+
+    Notifications can come from one thread while another waits for keys to be due.
+    """
+
+    def __init__(
+        self,
+        quiet_seconds: float,
+        max_delay_seconds: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.quiet_seconds = quiet_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self.clock = clock
+        self.pending: dict[int, PendingChange] = {}
+        self.condition = threading.Condition()
+
+    def due_at(self, change: PendingChange) -> float:
+        return min(change.last + self.quiet_seconds, change.first + self.max_delay_seconds)
+
+    def notify(self, key: int, changes: Changes | None = None):
+        with self.condition:
+            now = self.clock()
+            change = self.pending.get(key)
+            if change is None:
+                self.pending[key] = PendingChange(first=now, last=now, changes=changes)
+            else:
+                change.last = now
+                change.notifications += 1
+                change.changes = merge_changes(change.changes, changes)
+            self.condition.notify()
+
+    def pop_due_changes(self) -> dict[int, PendingChange]:
+        """Remove and return the keys that are due, with their notifications"""
+        with self.condition:
+            now = self.clock()
+            due = {key: change for key, change in self.pending.items() if self.due_at(change) <= now}
+            for key in due:
+                del self.pending[key]
+            return due
+
+    def pop_due(self) -> dict[int, int]:
+        """Remove and return the keys that are due, with how many notifications each had"""
+        return {key: change.notifications for key, change in self.pop_due_changes().items()}
+
+    def wait(self, timeout: float | None = None):
+        """Block until a key may be due, a notification arrives, or `timeout` passes"""
+        with self.condition:
+            if self.pending:
+                delay = min(self.due_at(change) for change in self.pending.values()) - self.clock()
+                if delay <= 0:
+                    return
+                timeout = delay if timeout is None else min(delay, timeout)
+            self.condition.wait(timeout)
+
+
+class DatasetIndex:
+    """Ids of a server's datasets by name, reloaded when older than `refresh_seconds`
+
+    The whole index is replaced when reloaded, so it can be read from another thread.
+    """
+
+    def __init__(
+        self,
+        server: ErddapServer,
+        refresh_seconds: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.server = server
+        self.refresh_seconds = refresh_seconds
+        self.clock = clock
+        self.ids: dict[str, int] = {}
+        self.loaded = None
+
+    def get(self, name: str) -> int | None:
+        return self.ids.get(name)
+
+    def load(self):
+        self.ids = dict(ErddapDataset.objects.filter(server=self.server).values_list("name", "id"))
+        self.loaded = self.clock()
+
+    def seconds_until_stale(self) -> float:
+        if self.loaded is None:
+            return 0
+        return max(self.loaded + self.refresh_seconds - self.clock(), 0)
+
+    def reload_if_stale(self):
+        """Reload the index if it's old, keeping the current one if the database can't be reached"""
+        if self.seconds_until_stale() > 0:
+            return
+
+        try:
+            # Like a request would, drop connections that have broken since the last reload
+            close_old_connections()
+            self.load()
+        except DatabaseError as error:
+            logger.warning(f"Unable to reload datasets for {self.server}: {error}")
+            self.loaded = self.clock()
+
+
+def count_notifications(server: ErddapServer, **counts: int):
+    """Add to the counts of `messages`, `refreshes`, or `unknown` datasets for a server"""
+    try:
+        pipe = get_redis_connection("default").pipeline(transaction=False)
+        for name, count in counts.items():
+            pipe.hincrby(COUNTS_KEY.format(server.name), name, count)
+        pipe.execute()
+    except RedisError as error:
+        logger.warning(f"Unable to count MQTT notifications for {server}: {error}")
+
+
+def notification_counts(server: ErddapServer) -> dict[str, int] | None:
+    """Counts of notifications received and refreshes scheduled for a server,
+    or None if they couldn't be loaded
+    """
+    try:
+        counts = get_redis_connection("default").hgetall(COUNTS_KEY.format(server.name))
+    except RedisError as error:
+        logger.warning(f"Unable to load MQTT notification counts for {server}: {error}")
+        return None
+
+    return {name.decode(): int(count) for name, count in counts.items()}
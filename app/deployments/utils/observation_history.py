@@ -0,0 +1,250 @@
+"""Keep the observations of each timeseries in Postgres, with hourly and daily rollups
+
+When `settings.OBSERVATION_HISTORY` is enabled, each refresh adds the valid rows
+since the last refresh of observed timeseries to `Observation`. That table is partitioned by month,
+so the partition for a month is created before rows are added to it,
+and whole months can be dropped after `settings.OBSERVATION_HISTORY_RETENTION_MONTHS`.
+
+As rows are added, the hourly rollups for the hours that they fall in are recalculated
+from the observations, and then the daily rollups for those days from the hourly rollups,
+so rollups are kept up to date without rescanning history,
+and are kept after the raw observations are dropped.
+
+Ranges are loaded from the raw observations or a rollup tier,
+depending on the resolution that was asked for.
+"""
+
+import logging
+import re
+from collections.abc import Iterable
+from datetime import UTC, date, datetime, timedelta
+
+import numpy as np
+from django.db import DatabaseError, connection, transaction
+
+from deployments.models import Observation, ObservationRollup
+
+from .group_arrays import SeriesArrays
+
+logger = logging.getLogger(__name__)
+
+# How far before the last value time to look for rows that arrived late
+LATE_ROWS = timedelta(hours=1)
+
+# Seconds covered by each point of a tier
+TIER_SECONDS = {
+    "raw": 0,
+    ObservationRollup.Tier.HOUR: 60 * 60,
+    ObservationRollup.Tier.DAY: 24 * 60 * 60,
+}
+
+OBSERVATION_TABLE = Observation._meta.db_table
+ROLLUP_TABLE = ObservationRollup._meta.db_table
+PARTITION_NAME = re.compile(rf"^{OBSERVATION_TABLE}_p(\d{{4}})_(\d{{2}})$")
+
+# Months that this process has already made sure have a partition
+known_partitions: set[date] = set()
+
+INSERT_OBSERVATIONS = f"""
+INSERT INTO {OBSERVATION_TABLE} (timeseries_id, time, value)
+SELECT timeseries_id, to_timestamp(seconds), value
+FROM unnest(%s::integer[], %s::double precision[], %s::double precision[])
+    AS rows (timeseries_id, seconds, value)
+ON CONFLICT (timeseries_id, time) DO UPDATE SET value = EXCLUDED.value
+WHERE {OBSERVATION_TABLE}.value IS DISTINCT FROM EXCLUDED.value
+"""
+
+CHANGED = "unnest(%s::integer[], %s::double precision[]) AS changed (timeseries_id, since)"
+
+UPSERT_ROLLUP = """
+ON CONFLICT (timeseries_id, tier, bucket) DO UPDATE SET
+    count = EXCLUDED.count,
+    total = EXCLUDED.total,
+    minimum = EXCLUDED.minimum,
+    maximum = EXCLUDED.maximum
+"""
+
+ROLLUP_HOURS = f"""
+INSERT INTO {ROLLUP_TABLE} (timeseries_id, tier, bucket, count, total, minimum, maximum)
+SELECT
+    observation.timeseries_id, 'hour', date_trunc('hour', observation.time),
+    count(*), sum(observation.value), min(observation.value), max(observation.value)
+FROM {OBSERVATION_TABLE} AS observation
+JOIN {CHANGED} ON observation.timeseries_id = changed.timeseries_id
+WHERE observation.time >= date_trunc('hour', to_timestamp(changed.since))
+GROUP BY observation.timeseries_id, date_trunc('hour', observation.time)
+{UPSERT_ROLLUP}
+"""
+
+ROLLUP_DAYS = f"""
+INSERT INTO {ROLLUP_TABLE} (timeseries_id, tier, bucket, count, total, minimum, maximum)
+SELECT
+    hour.timeseries_id, 'day', date_trunc('day', hour.bucket),
+    sum(hour.count), sum(hour.total), min(hour.minimum), max(hour.maximum)
+FROM {ROLLUP_TABLE} AS hour
+JOIN {CHANGED} ON hour.timeseries_id = changed.timeseries_id
+WHERE hour.tier = 'hour' AND hour.bucket >= date_trunc('day', to_timestamp(changed.since))
+GROUP BY hour.timeseries_id, date_trunc('day', hour.bucket)
+{UPSERT_ROLLUP}
+"""
+
+
+def month_start(moment: datetime) -> date:
+    return date(moment.year, moment.month, 1)
+
+
+def next_month(month: date) -> date:
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def months_between(first: datetime, last: datetime) -> list[date]:
+    """The start of each month from `first` through `last`"""
+    months = [month_start(first)]
+    while months[-1] < month_start(last):
+        months.append(next_month(months[-1]))
+    return months
+
+
+def partition_name(month: date) -> str:
+    return f"{OBSERVATION_TABLE}_p{month:%Y_%m}"
+
+
+def ensure_partitions(months: Iterable[date]):
+    """Create the observation partitions for months that don't have one yet"""
+    for month in months:
+        if month in known_partitions:
+            continue
+
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(
+                    f"CREATE TABLE IF NOT EXISTS {partition_name(month)} "
+                    f"PARTITION OF {OBSERVATION_TABLE} "
+                    f"FOR VALUES FROM ('{month.isoformat()} 00:00+00') "
+                    f"TO ('{next_month(month).isoformat()} 00:00+00')",
+                )
+        except DatabaseError as error:
+            # Another worker may have been creating the same partition
+            logger.warning(f"Unable to create observation partition for {month}: {error}")
+            continue
+
+        known_partitions.add(month)
+
+
+def partitions() -> dict[date, str]:
+    """The existing observation partitions by month"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE parent.relname = %s",
+            [OBSERVATION_TABLE],
+        )
+        names = [name for (name,) in cursor.fetchall()]
+
+    return {
+        date(int(match[1]), int(match[2]), 1): name
+        for name in names
+        if (match := PARTITION_NAME.match(name))
+    }
+
+
+def drop_partitions_before(month: date) -> list[str]:
+    """Drop the observation partitions for months before `month`. Rollups are kept"""
+    dropped = []
+    for partition_month, name in sorted(partitions().items()):
+        if partition_month >= month:
+            continue
+
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE {name}")
+        known_partitions.discard(partition_month)
+        dropped.append(name)
+
+    return dropped
+
+
+def new_rows(series_arrays: SeriesArrays, since: datetime | None) -> tuple[np.ndarray, np.ndarray]:
+    """Seconds since the epoch and values of the valid rows from `LATE_ROWS` before `since`,
+    with a single value for each time
+    """
+    rows = series_arrays.valid_rows()
+    times = series_arrays.time[rows]
+    if since is not None:
+        cutoff = np.datetime64((since - LATE_ROWS).astimezone(UTC).replace(tzinfo=None), "ns")
+        rows = rows[times >= cutoff]
+        times = series_arrays.time[rows]
+
+    times, first = np.unique(times, return_index=True)
+    seconds = times.astype("datetime64[us]").astype(np.int64) / 1_000_000
+    return seconds, series_arrays.value[rows[first]]
+
+
+def record_observations(observations: dict[int, tuple[np.ndarray, np.ndarray]]):
+    """Add the seconds and values of rows for timeseries by id,
+    and update the rollups for the hours and days that they fall in
+    """
+    observations = {pk: rows for pk, rows in observations.items() if len(rows[0])}
+    if not observations:
+        return
+
+    ids = np.concatenate([np.full(len(rows[0]), pk) for pk, rows in observations.items()])
+    seconds = np.concatenate([rows[0] for rows in observations.values()])
+    values = np.concatenate([rows[1] for rows in observations.values()])
+    since = [float(rows[0].min()) for rows in observations.values()]
+
+    ensure_partitions(
+        months_between(
+            datetime.fromtimestamp(seconds.min(), UTC),
+            datetime.fromtimestamp(seconds.max(), UTC),
+        ),
+    )
+
+    try:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(INSERT_OBSERVATIONS, [ids.tolist(), seconds.tolist(), values.tolist()])
+            cursor.execute(ROLLUP_HOURS, [list(observations), since])
+            cursor.execute(ROLLUP_DAYS, [list(observations), since])
+    except DatabaseError as error:
+        logger.warning(f"Unable to record history for {len(observations)} timeseries: {error}")
+
+
+def tier_for_resolution(seconds: float) -> str:
+    """The coarsest tier with points that are at least as close together as `seconds`"""
+    return max(
+        (tier for tier, tier_seconds in TIER_SECONDS.items() if tier_seconds <= seconds),
+        key=TIER_SECONDS.get,
+    )
+
+
+def load_history(timeseries_id: int, start: datetime, end: datetime, tier: str) -> dict:
+    """Times in seconds since the epoch, and values, of a timeseries from `start` until `end`.
+
+    Rollup tiers include the buckets that overlap the range,
+    with the mean as the value, along with the min, max, and count of observations.
+    """
+    if tier == "raw":
+        rows = (
+            Observation.objects.filter(timeseries_id=timeseries_id, time__gte=start, time__lt=end)
+            .order_by("time")
+            .values_list("time", "value")
+        )
+        return {
+            "time": [int(time.timestamp()) for time, _ in rows],
+            "value": [value for _, value in rows],
+        }
+
+    rollups = ObservationRollup.objects.filter(
+        timeseries_id=timeseries_id,
+        tier=tier,
+        bucket__gt=start - timedelta(seconds=TIER_SECONDS[tier]),
+        bucket__lt=end,
+    ).order_by("bucket")
+    return {
+        "time": [int(rollup.bucket.timestamp()) for rollup in rollups],
+        "value": [rollup.mean for rollup in rollups],
+        "min": [rollup.minimum for rollup in rollups],
+        "max": [rollup.maximum for rollup in rollups],
+        "count": [rollup.count for rollup in rollups],
+    }
@@ -0,0 +1,174 @@
+"""Keep the rendered GeoJSON of the platform list for each visibility in Redis
+
+Rather than prefetching and serializing every platform and reading when the list is requested,
+the list for each visibility is rendered after refreshes change values
+(see `tasks.platform_snapshots`), and stored uncompressed, gzipped, and brotli compressed
+(when `brotli` is installed), so that the list endpoint only needs to pick the bytes
+that the client accepts.
+
+Admin edits also rebuild the snapshots (see `signals`), and snapshots expire after
+`settings.PLATFORM_SNAPSHOT_SECONDS` in case a rebuild is missed,
+with a missing snapshot rendered by the request that finds it.
+"""
+
+import gzip
+import logging
+
+from django.conf import settings
+from django.db.models import Prefetch, QuerySet
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+from rest_framework.renderers import JSONRenderer
+
+from ..models import Platform, TimeSeries
+from ..serializers import PlatformSerializer
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_KEY = "platform-snapshot:{}"
+
+VISIBILITY_KEYS = ["mariners", "dev", "climatology", "graph_download"]
+DEFAULT_VISIBILITY = "mariners"
+
+IDENTITY = "identity"
+GZIP = "gzip"
+BROTLI = "br"
+# Smallest first, so clients get the smallest snapshot they accept
+COMPRESSED_ENCODINGS = [BROTLI, GZIP] if brotli else [GZIP]
+
+# Nearly as small as the highest quality, in a fraction of the time
+BROTLI_QUALITY = 9
+
+
+def visibility_key(visibility: str | None) -> str:
+    """The visibility for a request, defaulting to mariners for anything unknown"""
+    visibility = (visibility or DEFAULT_VISIBILITY).lower()
+    return visibility if visibility in VISIBILITY_KEYS else DEFAULT_VISIBILITY
+
+
+def platform_queryset(ts_active: bool = True) -> QuerySet[Platform]:
+    """Platforms with their timeseries prefetched, by default only those that are active"""
+    ts_queryset = TimeSeries.objects.prefetch_related(
+        "dataset",
+        "dataset__server",
+        "data_type",
+        "buffer_type",
+        "flood_levels",
+    )
+
+    if ts_active:
+        ts_queryset = ts_queryset.filter(active=True, end_time__isnull=True)
+
+    return Platform.objects.prefetch_related(
+        "programattribution_set",
+        "programattribution_set__program",
+        "alerts",
+        "programs",
+        "links",
+        Prefetch(
+            "timeseries_set",
+            queryset=ts_queryset,
+            to_attr="timeseries_active",
+        ),
+    )
+
+
+def visible_platforms(visibility: str) -> QuerySet[Platform]:
+    """Platforms for a visibility, with all their timeseries for graphs and climatology"""
+    ts_active = visibility not in {"graph_download", "climatology"}
+    return platform_queryset(ts_active=ts_active).filter(**{f"visible_{visibility}": True})
+
+
+def render_snapshot(visibility: str) -> bytes:
+    """The GeoJSON of the platform list for a visibility"""
+    serializer = PlatformSerializer(visible_platforms(visibility), many=True)
+    return JSONRenderer().render(serializer.data)
+
+
+def encode_snapshot(snapshot: bytes) -> dict[str, bytes]:
+    """A snapshot by content encoding"""
+    encoded = {IDENTITY: snapshot, GZIP: gzip.compress(snapshot, mtime=0)}
+    if brotli:
+        encoded[BROTLI] = brotli.compress(snapshot, quality=BROTLI_QUALITY)
+    return encoded
+
+
+def build_snapshot(visibility: str) -> dict[str, bytes]:
+    """Render and store the snapshot for a visibility, returning it by content encoding"""
+    encoded = encode_snapshot(render_snapshot(visibility))
+
+    try:
+        pipe = get_redis_connection("default").pipeline()
+        key = SNAPSHOT_KEY.format(visibility)
+        pipe.delete(key)
+        pipe.hset(key, mapping=encoded)
+        pipe.expire(key, settings.PLATFORM_SNAPSHOT_SECONDS)
+        pipe.execute()
+    except RedisError as error:
+        logger.warning(f"Unable to store platform snapshot for {visibility}: {error}")
+
+    return encoded
+
+
+def refused(params: str) -> bool:
+    """Has an Accept-Encoding item been given a quality of 0?"""
+    try:
+        return float(params.strip().removeprefix("q=")) == 0
+    except ValueError:
+        return False
+
+
+def accepted_encodings(accept_encoding: str) -> set[str]:
+    """Content encodings from an Accept-Encoding header"""
+    accepted = set()
+    for item in accept_encoding.split(","):
+        encoding, _, params = item.partition(";")
+        encoding = encoding.strip().lower()
+        if encoding and not refused(params):
+            accepted.add(encoding)
+    return accepted
+
+
+def preferred_encodings(accept_encoding: str) -> list[str]:
+    """Encodings of a snapshot to serve, in order of preference"""
+    accepted = accepted_encodings(accept_encoding)
+    compressed = [
+        encoding for encoding in COMPRESSED_ENCODINGS if encoding in accepted or "*" in accepted
+    ]
+    return [*compressed, IDENTITY]
+
+
+def choose_encoding(encoded: dict[str, bytes], accept_encoding: str) -> tuple[str, bytes] | None:
+    """The smallest encoding of a snapshot that the client accepts"""
+    for encoding in preferred_encodings(accept_encoding):
+        if encoded.get(encoding) is not None:
+            return encoding, encoded[encoding]
+    return None
+
+
+def load_snapshot(visibility: str, accept_encoding: str) -> tuple[str, bytes] | None:
+    """The smallest stored encoding of a visibility's snapshot that the client accepts,
+    or None if there isn't a snapshot
+    """
+    encodings = preferred_encodings(accept_encoding)
+    try:
+        values = get_redis_connection("default").hmget(SNAPSHOT_KEY.format(visibility), encodings)
+    except RedisError as error:
+        logger.warning(f"Unable to load platform snapshot for {visibility}: {error}")
+        return None
+
+    return choose_encoding(dict(zip(encodings, values, strict=True)), accept_encoding)
+
+
+def snapshot(visibility: str, accept_encoding: str) -> tuple[str, bytes]:
+    """The stored snapshot for a visibility, or a newly built one if it's missing"""
+    stored = load_snapshot(visibility, accept_encoding)
+    if stored is not None:
+        return stored
+
+    return choose_encoding(build_snapshot(visibility), accept_encoding)
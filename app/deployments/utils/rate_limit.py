@@ -0,0 +1,217 @@
+"""Rate limit requests to ERDDAP servers across all processes and workers
+
+Each server has a token bucket in Redis that refills at one token per
+`ErddapServer.request_refresh_time_seconds`, and can hold up to
+`ErddapServer.request_concurrency` tokens. Requests reserve a token,
+and wait until the bucket would have refilled enough to cover it.
+
+Requests made while serving a web request don't wait, instead `take_request_slot`
+raises `RequestSlotUnavailable` when the bucket is empty, without reserving a token.
+
+When a server tells us to back off (timeouts, 408s, 429s), the interval
+between requests is doubled for all workers, up to
+`settings.ERDDAP_RATE_LIMIT_MAX_BACKOFF_LEVEL` times. The backoff expires
+after `settings.ERDDAP_RATE_LIMIT_BACKOFF_SECONDS` without another one.
+"""
+
+import asyncio
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django_redis import get_redis_connection
+from django_redis.exceptions import ConnectionInterrupted
+from redis.exceptions import RedisError
+
+from ..models import ErddapServer
+from . import refresh_ledger
+
+logger = logging.getLogger(__name__)
+
+BUCKET_KEY = "erddap-rate-limit:{}"
+BACKOFF_KEY = "erddap-rate-limit-backoff:{}"
+SERVER_LIMIT_KEY = "erddap-rate-limit-server:{}"
+SERVER_LIMIT_CACHE_SECONDS = 5 * 60
+
+# Takes a token from the bucket, and returns the number of milliseconds
+# that the caller should wait before making their request.
+# When ARGV[4] is 1, a token is only taken if the request can be made now.
+RESERVE_SCRIPT = """
+local interval = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local level = math.min(tonumber(redis.call('GET', KEYS[2]) or '0'), tonumber(ARGV[3]))
+
+if level > 0 then
+  interval = math.max(interval, 1000) * (2 ^ level)
+end
+
+if interval <= 0 then
+  return 0
+end
+
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+
+tokens = math.min(burst, tokens + (now - ts) / interval) - 1
+
+if tokens < 0 and ARGV[4] == '1' then
+  return math.ceil(-tokens * interval)
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil((burst - tokens) * interval) + 1000)
+
+if tokens >= 0 then
+  return 0
+end
+return math.ceil(-tokens * interval)
+"""
+
+_reserve_script = None
+
+
+def server_key(base_url: str) -> str:
+    """Normalize a server URL so that all requests to a server share limits"""
+    return base_url.rstrip("/")
+
+
+def server_limits(server: ErddapServer | str) -> tuple[str, float, int]:
+    """Returns the key, minimum interval in seconds, and burst size for a server.
+
+    Servers that are not configured in Buoy Barn (say for forecasts) have
+    no minimum interval, unless they have asked us to back off.
+    """
+    if isinstance(server, ErddapServer):
+        return (
+            server_key(server.base_url),
+            server.request_refresh_time_seconds,
+            max(server.request_concurrency, 1),
+        )
+
+    key = server_key(server)
+
+    def configured_limits():
+        configured = (
+            ErddapServer.objects.filter(base_url__in=[key, key + "/"])
+            .values_list("request_refresh_time_seconds", "request_concurrency")
+            .first()
+        )
+        return configured or (0, 1)
+
+    interval, burst = cache.get_or_set(
+        SERVER_LIMIT_KEY.format(key),
+        configured_limits,
+        SERVER_LIMIT_CACHE_SECONDS,
+    )
+    return key, interval, max(burst, 1)
+
+
+class RequestSlotUnavailable(Exception):
+    """Raised instead of waiting for a request to a server, see `take_request_slot`"""
+
+    def __init__(self, server: ErddapServer | str, wait_seconds: float):
+        super().__init__(f"Requests to {server} are limited for another {wait_seconds:.1f} seconds")
+        self.wait_seconds = wait_seconds
+
+
+def reserve_request_slot(server: ErddapServer | str, only_if_free: bool = False) -> float:
+    """Reserve the next request to a server, and return how many seconds to wait before making it.
+
+    With `only_if_free`, nothing is reserved unless the request can be made now.
+    """
+    global _reserve_script  # noqa: PLW0603
+
+    try:
+        key, interval, burst = server_limits(server)
+
+        if _reserve_script is None:
+            _reserve_script = get_redis_connection("default").register_script(RESERVE_SCRIPT)
+
+        wait_ms = _reserve_script(
+            keys=[BUCKET_KEY.format(key), BACKOFF_KEY.format(key)],
+            args=[
+                interval * 1000,
+                burst,
+                settings.ERDDAP_RATE_LIMIT_MAX_BACKOFF_LEVEL,
+                int(only_if_free),
+            ],
+        )
+    except (RedisError, ConnectionInterrupted) as error:
+        logger.warning(f"Unable to rate limit request to {server}, continuing without: {error}")
+        return 0
+
+    return wait_ms / 1000
+
+
+def wait_for_request_slot(server: ErddapServer | str) -> float:
+    """Block until a request can be made to a server. Returns the seconds waited"""
+    wait_seconds = reserve_request_slot(server)
+    if wait_seconds > 0:
+        time.sleep(wait_seconds)
+    return wait_seconds
+
+
+def take_request_slot(server: ErddapServer | str):
+    """Reserve a request to a server that can be made now, or raise `RequestSlotUnavailable`.
+
+    For requests made while serving a web request, which shouldn't tie up a worker waiting.
+    """
+    wait_seconds = reserve_request_slot(server, only_if_free=True)
+    if wait_seconds > 0:
+        raise RequestSlotUnavailable(server, wait_seconds)
+
+
+async def await_request_slot(server: ErddapServer | str) -> float:
+    """Wait until a request can be made to a server without blocking the event loop.
+    Returns the seconds waited.
+    """
+    wait_seconds = await asyncio.to_thread(reserve_request_slot, server)
+    if wait_seconds > 0:
+        await asyncio.sleep(wait_seconds)
+    return wait_seconds
+
+
+def report_backoff(server: ErddapServer | str) -> int:
+    """Double the interval between requests to a server for all workers.
+
+    Returns the new backoff level.
+    """
+    key = server_key(server if isinstance(server, str) else server.base_url)
+
+    try:
+        pipe = get_redis_connection("default").pipeline()
+        pipe.incr(BACKOFF_KEY.format(key))
+        pipe.expire(BACKOFF_KEY.format(key), settings.ERDDAP_RATE_LIMIT_BACKOFF_SECONDS)
+        level, _ = pipe.execute()
+    except RedisError as error:
+        logger.warning(f"Unable to record backoff for {key}: {error}")
+        return 0
+
+    logger.warning(f"{key} asked us to back off, now at backoff level {level}")
+    refresh_ledger.record_backoff(level)
+    return level
+
+
+def backoff_level(server: ErddapServer | str) -> int:
+    """Returns how many times the interval between requests to a server is currently doubled"""
+    key = server_key(server if isinstance(server, str) else server.base_url)
+
+    try:
+        level = get_redis_connection("default").get(BACKOFF_KEY.format(key))
+    except RedisError:
+        return 0
+
+    return min(int(level or 0), settings.ERDDAP_RATE_LIMIT_MAX_BACKOFF_LEVEL)
+
+
+def reset_rate_limit(server: ErddapServer | str):
+    """Refill a server's bucket and forget its backoff and cached limits"""
+    key = server_key(server if isinstance(server, str) else server.base_url)
+
+    get_redis_connection("default").delete(BUCKET_KEY.format(key), BACKOFF_KEY.format(key))
+    cache.delete(SERVER_LIMIT_KEY.format(key))
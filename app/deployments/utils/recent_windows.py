@@ -0,0 +1,109 @@
+"""Keep the recent values of each timeseries in Redis, so charts don't need to ask ERDDAP
+
+When a timeseries is refreshed, the valid rows of the dataframe already retrieved for it
+are packed into a compact binary window:
+
+- the first time, as int64 seconds since the epoch
+- the seconds since the first time for each row, as int32
+- the values for each row, as float32
+
+so a day of 10 minute observations is under 2 KB. Windows keep the newest
+`settings.TIMESERIES_WINDOW_MAX_POINTS` rows, and expire after
+`settings.TIMESERIES_WINDOW_EXPIRE_SECONDS` if the timeseries stops being refreshed.
+"""
+
+import logging
+from collections.abc import Iterable
+
+import numpy as np
+from django.conf import settings
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+from .group_arrays import SeriesArrays
+
+logger = logging.getLogger(__name__)
+
+WINDOW_KEY = "timeseries-window:{}"
+
+HEADER_DTYPE = np.dtype("<i8")
+OFFSET_DTYPE = np.dtype("<i4")
+VALUE_DTYPE = np.dtype("<f4")
+ROW_BYTES = OFFSET_DTYPE.itemsize + VALUE_DTYPE.itemsize
+
+
+def pack_window(series_arrays: SeriesArrays) -> bytes:
+    """Pack the newest valid rows of a timeseries into a window"""
+    rows = series_arrays.valid_rows()[-settings.TIMESERIES_WINDOW_MAX_POINTS :]
+    seconds = series_arrays.time[rows].astype("datetime64[s]").astype(np.int64)
+    first = seconds[0] if len(seconds) else 0
+
+    return (
+        np.array([first], dtype=HEADER_DTYPE).tobytes()
+        + (seconds - first).astype(OFFSET_DTYPE).tobytes()
+        + series_arrays.value[rows].astype(VALUE_DTYPE).tobytes()
+    )
+
+
+def unpack_window(window: bytes) -> tuple[np.ndarray, np.ndarray]:
+    """Returns the times in seconds since the epoch, and the values, of a window"""
+    first = np.frombuffer(window, dtype=HEADER_DTYPE, count=1)[0]
+    points = (len(window) - HEADER_DTYPE.itemsize) // ROW_BYTES
+
+    offsets = np.frombuffer(window, dtype=OFFSET_DTYPE, count=points, offset=HEADER_DTYPE.itemsize)
+    values = np.frombuffer(
+        window,
+        dtype=VALUE_DTYPE,
+        count=points,
+        offset=HEADER_DTYPE.itemsize + points * OFFSET_DTYPE.itemsize,
+    )
+    return first + offsets.astype(np.int64), values
+
+
+def store_windows(windows: dict[int, bytes]):
+    """Save the windows for timeseries by id"""
+    if not windows:
+        return
+
+    try:
+        pipe = get_redis_connection("default").pipeline(transaction=False)
+        expire = settings.TIMESERIES_WINDOW_EXPIRE_SECONDS
+        for timeseries_id, window in windows.items():
+            pipe.set(WINDOW_KEY.format(timeseries_id), window, ex=expire)
+        pipe.execute()
+    except RedisError as error:
+        logger.warning(f"Unable to store recent windows for {len(windows)} timeseries: {error}")
+
+
+def load_windows(timeseries_ids: Iterable[int]) -> dict[int, tuple[np.ndarray, np.ndarray] | None]:
+    """Returns the times and values of the windows for timeseries by id,
+    or None for timeseries without a window
+    """
+    timeseries_ids = list(timeseries_ids)
+    if not timeseries_ids:
+        return {}
+
+    try:
+        windows = get_redis_connection("default").mget(
+            [WINDOW_KEY.format(timeseries_id) for timeseries_id in timeseries_ids],
+        )
+    except RedisError as error:
+        logger.warning(f"Unable to load recent windows: {error}")
+        windows = [None] * len(timeseries_ids)
+
+    return {
+        timeseries_id: unpack_window(window) if window else None
+        for timeseries_id, window in zip(timeseries_ids, windows, strict=True)
+    }
+
+
+def window_json(window: tuple[np.ndarray, np.ndarray] | None) -> dict | None:
+    """Times and values of a window for the API. Values are rounded to float32 precision"""
+    if window is None:
+        return None
+
+    times, values = window
+    return {
+        "time": times.tolist(),
+        "value": [float(f"{value:.7g}") for value in values.tolist()],
+    }
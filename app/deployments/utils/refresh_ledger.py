@@ -0,0 +1,174 @@
+"""Record where the time goes in each dataset refresh
+
+`record_refresh` collects a `RefreshLedger` while a dataset is refreshed,
+and saves it as a `RefreshRun`. The functions below add to the current ledger
+from wherever the work is done, and do nothing outside of a refresh.
+
+For each group of timeseries, the ledger records the seconds spent in each stage:
+
+- wait: waiting for the server's rate limit, which grows when it asks us to back off
+- fetch: making the request and downloading the response
+- parse: reading the response into arrays
+- extrema: finding the extrema for each timeseries
+- save: writing changed timeseries
+
+along with the bytes downloaded, rows read, and any errors handled.
+
+The ledger is kept in a context variable, so that it follows the refresh into
+the event loop and threads used for concurrent requests.
+"""
+
+import json
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+from django.utils import timezone
+
+from ..models import ErddapDataset, RefreshRun, TimeSeries
+from ..models.refresh_run import STAGES
+
+logger = logging.getLogger(__name__)
+
+COUNTS = ("bytes", "rows")
+
+# Only the start of error messages are kept, as ERDDAP can return whole pages
+ERROR_MESSAGE_LENGTH = 500
+
+
+@dataclass
+class RefreshLedger:
+    """Timings, sizes, and errors for each group of timeseries in a refresh"""
+
+    groups: dict[str, dict] = field(default_factory=dict)
+    errors: list[dict] = field(default_factory=list)
+    backoff_level: int = 0
+    result: str | None = None
+
+    def group(self, timeseries: list[TimeSeries]) -> dict:
+        key = group_label(timeseries)
+        if key not in self.groups:
+            self.groups[key] = {"group": key, **dict.fromkeys(STAGES, 0.0), **dict.fromkeys(COUNTS, 0)}
+        return self.groups[key]
+
+    def total(self, name: str) -> float:
+        return sum(group[name] for group in self.groups.values())
+
+
+_ledger: ContextVar[RefreshLedger | None] = ContextVar("refresh_ledger", default=None)
+
+
+def group_label(timeseries: list[TimeSeries]) -> str:
+    """Describe a group of timeseries by its constraints and variables"""
+    return json.dumps(
+        {
+            "constraints": timeseries[0].constraints or {},
+            "variables": sorted({series.variable for series in timeseries}),
+        },
+        sort_keys=True,
+        default=str,
+    )
+
+
+def record(timeseries: list[TimeSeries], **values: float):
+    """Add stage seconds or counts to a group of timeseries"""
+    ledger = _ledger.get()
+    if ledger is None or not timeseries:
+        return
+
+    group = ledger.group(timeseries)
+    for name, value in values.items():
+        group[name] += value
+
+
+def record_for_groups(timeseries_groups: list[list[TimeSeries]], **values: float):
+    """Split stage seconds or counts evenly between groups from a combined request"""
+    for timeseries in timeseries_groups:
+        record(timeseries, **{name: value / len(timeseries_groups) for name, value in values.items()})
+
+
+@contextmanager
+def timed(stage: str, timeseries: list[TimeSeries]):
+    """Add the seconds spent in the block to a stage for a group of timeseries"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(timeseries, **{stage: time.perf_counter() - start})
+
+
+def record_error(timeseries: list[TimeSeries], error: Exception):
+    """Note an error handled while refreshing a group of timeseries"""
+    ledger = _ledger.get()
+    if ledger is None:
+        return
+
+    ledger.errors.append(
+        {
+            "group": group_label(timeseries),
+            "error": type(error).__name__,
+            "message": str(error)[:ERROR_MESSAGE_LENGTH],
+        },
+    )
+
+
+def record_backoff(level: int):
+    """Note that the server asked us to back off, and the level it is backed off to"""
+    ledger = _ledger.get()
+    if ledger is not None:
+        ledger.backoff_level = max(ledger.backoff_level, level)
+
+
+def save_run(
+    dataset: ErddapDataset,
+    ledger: RefreshLedger,
+    started,
+    duration: float,
+    result: str,
+) -> RefreshRun:
+    groups = sorted(ledger.groups.values(), key=lambda group: -sum(group[stage] for stage in STAGES))
+
+    return RefreshRun.objects.create(
+        dataset=dataset,
+        started=started,
+        duration_seconds=duration,
+        result=result,
+        wait_seconds=ledger.total("wait"),
+        fetch_seconds=ledger.total("fetch"),
+        parse_seconds=ledger.total("parse"),
+        extrema_seconds=ledger.total("extrema"),
+        save_seconds=ledger.total("save"),
+        bytes_downloaded=int(ledger.total("bytes")),
+        rows=int(ledger.total("rows")),
+        group_count=len(groups),
+        error_count=len(ledger.errors),
+        backoff_level=ledger.backoff_level,
+        groups=groups,
+        errors=ledger.errors,
+    )
+
+
+@contextmanager
+def record_refresh(dataset: ErddapDataset):
+    """Collect a ledger for the refresh of a dataset within the block, and save it as a RefreshRun.
+
+    The block can set `ledger.result` to describe how the refresh ended,
+    otherwise it is recorded as failed if an exception is raised.
+    """
+    ledger = RefreshLedger()
+    token = _ledger.set(ledger)
+    started = timezone.now()
+    start = time.perf_counter()
+    result = RefreshRun.Result.FAILED
+
+    try:
+        yield ledger
+        result = ledger.result or RefreshRun.Result.REFRESHED
+    finally:
+        _ledger.reset(token)
+        try:
+            save_run(dataset, ledger, started, time.perf_counter() - start, result)
+        except Exception:
+            logger.exception(f"Unable to save refresh timings for dataset {dataset.id}")
@@ -0,0 +1,135 @@
+"""Track the progress of server refreshes that are fanned out across workers
+
+Celery isn't configured with a result backend, so rather than a chord,
+each dataset refresh counts itself as finished in a Redis hash for the run,
+and whichever worker finishes the last dataset completes the run.
+
+Each dataset of a run is its own task, and only `ErddapServer.max_dataset_refreshes`
+of a server's datasets are refreshed at once, by taking a slot from a sorted set
+of leases for the server. Leases expire after `settings.CELERY_TASK_TIME_LIMIT`,
+so a refresh that was killed before releasing its slot only holds it until then.
+"""
+
+import logging
+import time
+
+from django.conf import settings
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+RUN_KEY = "refresh-server-run:{}"
+LATEST_RUN_KEY = "refresh-server-latest-run:{}"
+RUN_EXPIRE_SECONDS = 24 * 60 * 60
+
+SLOTS_KEY = "refresh-server-slots:{}"
+# How long to wait before trying again for a slot, before jitter
+SLOT_RETRY_SECONDS = 10
+
+# Drops expired leases, then takes a slot for the lease if one is free
+# (or it already has one). Returns 1 if the lease has a slot.
+ACQUIRE_SLOT_SCRIPT = """
+local now = tonumber(redis.call('TIME')[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+
+if redis.call('ZSCORE', KEYS[1], ARGV[1]) or redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[2]) then
+  redis.call('ZADD', KEYS[1], now + tonumber(ARGV[3]), ARGV[1])
+  redis.call('EXPIRE', KEYS[1], tonumber(ARGV[3]))
+  return 1
+end
+return 0
+"""
+
+_acquire_slot_script = None
+
+
+def start_server_run(server_id: int, run_id: str, total: int):
+    """Record that a refresh of `total` datasets has started for a server"""
+    try:
+        pipe = get_redis_connection("default").pipeline()
+        pipe.hset(
+            RUN_KEY.format(run_id),
+            mapping={"server_id": server_id, "total": total, "completed": 0, "started": time.time()},
+        )
+        pipe.expire(RUN_KEY.format(run_id), RUN_EXPIRE_SECONDS)
+        pipe.set(LATEST_RUN_KEY.format(server_id), run_id, ex=RUN_EXPIRE_SECONDS)
+        pipe.execute()
+    except RedisError as error:
+        logger.warning(f"Unable to record refresh progress for server {server_id}: {error}")
+
+
+def complete_server_dataset(run_id: str) -> tuple[int, int] | None:
+    """Count a dataset as finished for a run.
+
+    Returns the number of completed and total datasets,
+    or None if the progress of the run is unknown.
+    """
+    try:
+        pipe = get_redis_connection("default").pipeline()
+        pipe.hincrby(RUN_KEY.format(run_id), "completed", 1)
+        pipe.hget(RUN_KEY.format(run_id), "total")
+        completed, total = pipe.execute()
+    except RedisError as error:
+        logger.warning(f"Unable to update refresh progress for run {run_id}: {error}")
+        return None
+
+    if total is None:
+        return None
+
+    return completed, int(total)
+
+
+def server_run_progress(server_id: int) -> dict | None:
+    """Returns the completed and total datasets, and start time, of the latest refresh of a server"""
+    try:
+        connection = get_redis_connection("default")
+        run_id = connection.get(LATEST_RUN_KEY.format(server_id))
+        if run_id is None:
+            return None
+        run = connection.hgetall(RUN_KEY.format(run_id.decode()))
+    except RedisError as error:
+        logger.warning(f"Unable to load refresh progress for server {server_id}: {error}")
+        return None
+
+    if not run:
+        return None
+
+    return {
+        "completed": int(run[b"completed"]),
+        "total": int(run[b"total"]),
+        "started": float(run[b"started"]),
+    }
+
+
+def acquire_dataset_slot(server_id: int, lease: str, limit: int) -> bool:
+    """Take one of the `limit` slots for refreshing a server's datasets.
+    Returns False if they are all taken.
+
+    If Redis is unavailable, datasets are refreshed without a limit.
+    """
+    global _acquire_slot_script  # noqa: PLW0603
+
+    try:
+        if _acquire_slot_script is None:
+            _acquire_slot_script = get_redis_connection("default").register_script(ACQUIRE_SLOT_SCRIPT)
+
+        acquired = _acquire_slot_script(
+            keys=[SLOTS_KEY.format(server_id)],
+            args=[lease, max(limit, 1), settings.CELERY_TASK_TIME_LIMIT],
+        )
+    except RedisError as error:
+        logger.warning(
+            f"Unable to limit dataset refreshes for server {server_id}, continuing without: {error}",
+        )
+        return True
+
+    return bool(acquired)
+
+
+def release_dataset_slot(server_id: int, lease: str):
+    """Let another of the server's datasets be refreshed"""
+    try:
+        get_redis_connection("default").zrem(SLOTS_KEY.format(server_id), lease)
+    except RedisError as error:
+        logger.warning(f"Unable to release dataset refresh slot for server {server_id}: {error}")
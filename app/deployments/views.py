@@ -1,3 +1,5 @@
+import asyncio
+from datetime import UTC, datetime, timedelta
 from urllib.parse import urljoin, urlparse
 
 import httpx
@@ -5,7 +7,9 @@ from django.conf import settings
 from django.db.models import Prefetch
 from django.http import HttpRequest, HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from django.utils.decorators import method_decorator
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.utils.dateparse import parse_datetime
 from django.views.decorators.cache import cache_page
 from rest_framework import viewsets
 
@@ -13,13 +17,13 @@ from rest_framework import viewsets
 from rest_framework.decorators import (
     action,  # , authentication_classes, permission_classes
 )
-from rest_framework.exceptions import APIException, ParseError
+from rest_framework.exceptions import APIException, NotFound, ParseError
 
 # from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
 from . import tasks
-from .models import ErddapDataset, ErddapServer, Platform, TimeSeries
+from .models import ErddapDataset, ErddapServer, Platform, RefreshRun, TimeSeries
 from .serializers import (  # TimeSeriesUpdateResponseSerializer,
     ErddapDatasetSerializer,
     ErddapServerSerializer,
@@ -27,9 +31,19 @@ from .serializers import (  # TimeSeriesUpdateResponseSerializer,
     TimeSeriesSerializer,
     TimeSeriesUpdateSerializer,
 )
+from .tasks.queue import USER_QUEUE
+from .utils import platform_snapshots
+from .utils.circuit_breaker import (
+    CIRCUIT_STATUS_CODES,
+    circuit_allows,
+    record_failure,
+    record_success,
+    trips_circuit,
+)
+from .utils.observation_history import TIER_SECONDS, load_history, tier_for_resolution
+from .utils.recent_windows import load_windows, window_json
 
 
-@method_decorator(cache_page(60), name="list")
 class PlatformViewset(viewsets.ReadOnlyModelViewSet):
     """A viewset for viewing Platforms
 
@@ -37,46 +51,31 @@ class PlatformViewset(viewsets.ReadOnlyModelViewSet):
 
     By default, only those where `visible_mariners=True` will be shown,
     but `visibility` can be set to `dev`, `graph_download` or `climatology`.
+
+    JSON lists are served from pre-rendered snapshots, see `utils.platform_snapshots`.
     """
 
     def get_platform_queryset(self, ts_active: bool = True):
         """Return the queryset for platforms with active timeseries"""
-        ts_queryset = TimeSeries.objects.prefetch_related(
-            "dataset",
-            "dataset__server",
-            "data_type",
-            "buffer_type",
-            "flood_levels",
-        )
-
-        if ts_active:
-            ts_queryset = ts_queryset.filter(active=True, end_time__isnull=True)
-
-        return Platform.objects.prefetch_related(
-            "programattribution_set",
-            "programattribution_set__program",
-            "alerts",
-            "programs",
-            "links",
-            Prefetch(
-                "timeseries_set",
-                queryset=ts_queryset,
-                to_attr="timeseries_active",
-            ),
-        )
+        return platform_snapshots.platform_queryset(ts_active=ts_active)
 
     serializer_class = PlatformSerializer
 
     def list(self, request, *args, **kwargs):  # pylint: disable=unused-argument
-        visibility_key = request.query_params.get("visibility", "mariners").lower()
-        if visibility_key not in {"mariners", "dev", "climatology", "graph_download"}:
-            visibility_key = "mariners"
-        filter_kwargs = {f"visible_{visibility_key}": True}
+        visibility_key = platform_snapshots.visibility_key(request.query_params.get("visibility"))
 
-        ts_active = visibility_key not in {"graph_download", "climatology"}
+        if request.accepted_renderer.format == "json":
+            encoding, content = platform_snapshots.snapshot(
+                visibility_key,
+                request.headers.get("Accept-Encoding", ""),
+            )
+            response = HttpResponse(content, content_type="application/json")
+            if encoding != platform_snapshots.IDENTITY:
+                response["Content-Encoding"] = encoding
+            patch_vary_headers(response, ["Accept-Encoding"])
+            return response
 
-        queryset = self.get_platform_queryset(ts_active=ts_active)
-        queryset = self.filter_queryset(queryset).filter(**filter_kwargs)
+        queryset = self.filter_queryset(platform_snapshots.visible_platforms(visibility_key))
         serializer = self.get_serializer(queryset, many=True)
 
         return Response(serializer.data)
@@ -117,7 +116,7 @@ class DatasetViewSet(viewsets.ReadOnlyModelViewSet):
     def refresh(self, request, **kwargs):
         dataset = self.dataset(**kwargs)
 
-        tasks.single_refresh_dataset.delay(dataset.id, healthcheck=True)
+        tasks.single_refresh_dataset.delay(dataset.id, healthcheck=True, queue=USER_QUEUE)
 
         serializer = self.serializer_class(dataset, context={"request": request})
         return Response(serializer.data)
@@ -167,7 +166,7 @@ class ServerViewSet(viewsets.ReadOnlyModelViewSet):
 
         server = get_object_or_404(self.queryset, pk=pk)
 
-        tasks.single_refresh_server.delay(server.id, healthcheck=True)
+        tasks.single_refresh_server.delay(server.id, healthcheck=True, queue=USER_QUEUE)
 
         serializer = self.serializer_class(server, context={"request": request})
         return Response(serializer.data)
@@ -204,6 +203,39 @@ class ServerViewSet(viewsets.ReadOnlyModelViewSet):
         return Response(serializer.data)
 
 
+class RefreshTimingViewSet(viewsets.ViewSet):
+    """The datasets and servers that have taken the longest to refresh
+
+    Query parameters:
+    - `hours`: how far back to look at refreshes (default 24)
+    - `order`: `total` (default), `average`, or `max` refresh seconds
+    - `limit`: how many datasets and servers to return (default 20, up to 200)
+    """
+
+    def list(self, request):
+        try:
+            hours = float(request.query_params.get("hours", 24))
+            limit = min(int(request.query_params.get("limit", 20)), 200)
+        except ValueError:
+            raise ParseError(detail="`hours` and `limit` must be numbers.") from None
+
+        order = request.query_params.get("order", "total")
+        if order not in RefreshRun.SLOWEST_ORDERINGS:
+            raise ParseError(detail=f"`order` must be one of {', '.join(RefreshRun.SLOWEST_ORDERINGS)}.")
+
+        since = timezone.now() - timedelta(hours=hours)
+        runs = RefreshRun.objects.filter(started__gte=since)
+
+        return Response(
+            {
+                "since": since,
+                "order": order,
+                "datasets": runs.slowest("dataset", order=order, limit=limit),
+                "servers": runs.slowest("server", order=order, limit=limit),
+            },
+        )
+
+
 class TimeSeriesViewSet(viewsets.ReadOnlyModelViewSet):
     """A viewset for retrieving and updating timeseries data"""
 
@@ -217,6 +249,11 @@ class TimeSeriesViewSet(viewsets.ReadOnlyModelViewSet):
     # serializer_class = TimeSeriesSerializer
     # permission_classes = []
 
+    MAX_WINDOWS = 200
+
+    # Aim for about this many points when a history resolution isn't given
+    HISTORY_POINTS = 1000
+
     # def get_queryset(self):
     #     return TimeSeries.objects.filter(active=True).prefetch_related(
     #         "dataset",
@@ -231,6 +268,89 @@ class TimeSeriesViewSet(viewsets.ReadOnlyModelViewSet):
             return TimeSeriesUpdateSerializer
         return TimeSeriesSerializer
 
+    @action(detail=True)
+    def window(self, request, **kwargs):
+        """Recent times (seconds since the epoch) and values for a timeseries,
+        from its last refresh rather than ERDDAP
+        """
+        timeseries = self.get_object()
+        window = load_windows([timeseries.id])[timeseries.id]
+        return Response({"id": timeseries.id, "window": window_json(window)})
+
+    @action(detail=False)
+    def windows(self, request):
+        """Recent windows for up to `MAX_WINDOWS` timeseries, with `?ids=1,2,3`"""
+        try:
+            ids = [int(pk) for pk in request.query_params.get("ids", "").split(",") if pk]
+        except ValueError:
+            raise ParseError(detail="`ids` must be a comma separated list of timeseries ids.") from None
+
+        if len(ids) > self.MAX_WINDOWS:
+            raise ParseError(detail=f"Up to {self.MAX_WINDOWS} timeseries can be requested at once.")
+
+        found = set(self.get_queryset().filter(id__in=ids).values_list("id", flat=True))
+        windows = load_windows(pk for pk in ids if pk in found)
+
+        return Response(
+            [{"id": pk, "window": window_json(window)} for pk, window in windows.items()],
+        )
+
+    def history_time(self, param: str) -> datetime | None:
+        """Parse a UTC or timezone aware time from the query parameters"""
+        if param not in self.request.query_params:
+            return None
+        try:
+            time = parse_datetime(self.request.query_params[param])
+        except ValueError:
+            time = None
+        if time is None:
+            raise ParseError(detail=f"`{param}` must be an ISO 8601 time.")
+        return time if timezone.is_aware(time) else time.replace(tzinfo=UTC)
+
+    @action(detail=True)
+    def history(self, request, **kwargs):
+        """Observations for a timeseries from the history store
+
+        Query parameters:
+        - `start` and `end`: ISO 8601 times (default the last week)
+        - `resolution`: `raw`, `hour`, `day`, or the seconds between points,
+          which picks the coarsest tier that is at least that fine
+          (default the range split into `HISTORY_POINTS`)
+        """
+        if not settings.OBSERVATION_HISTORY:
+            raise NotFound(detail="The observation history store is not enabled.")
+
+        timeseries = self.get_object()
+
+        end = self.history_time("end") or timezone.now()
+        start = self.history_time("start") or end - timedelta(days=7)
+        if start >= end:
+            raise ParseError(detail="`start` must be before `end`.")
+
+        resolution = request.query_params.get(
+            "resolution",
+            (end - start).total_seconds() / self.HISTORY_POINTS,
+        )
+        if resolution in TIER_SECONDS:
+            tier = resolution
+        else:
+            try:
+                tier = tier_for_resolution(float(resolution))
+            except ValueError:
+                raise ParseError(
+                    detail=f"`resolution` must be seconds or one of {', '.join(TIER_SECONDS)}.",
+                ) from None
+
+        return Response(
+            {
+                "id": timeseries.id,
+                "start": start,
+                "end": end,
+                "tier": tier,
+                **load_history(timeseries.id, start, end, tier),
+            },
+        )
+
     # @action()
     # def batch(self, request):
     #     """List all the outdated timeseries"""
@@ -289,6 +409,15 @@ class ProxyTimeout(APIException):
     default_code = "erddap_timeout"
 
 
+class ProxyUnavailable(APIException):
+    status_code = 503
+    default_detail = (
+        "Upstream ERDDAP server has recently been timing out or refusing requests, "
+        "so requests to it are paused for a few minutes."
+    )
+    default_code = "erddap_unavailable"
+
+
 # Shared async HTTP client — one instance per worker process, reused across requests.
 # Timeout defaults match PROXY_TIMEOUT_SECONDS; individual calls may override if needed.
 # Lifecycle: Granian spawns workers as separate processes, so each process owns its own
@@ -328,15 +457,26 @@ async def server_proxy(request: HttpRequest, server_id: int) -> HttpResponse | S
     ):
         raise ParseError(detail="Invalid proxy path.")
 
+    if not await asyncio.to_thread(circuit_allows, server):
+        raise ProxyUnavailable
+
     try:
         response = await _proxy_http_client.get(request_url)
     except httpx.TimeoutException as e:
+        await asyncio.to_thread(record_failure, server)
         raise ProxyTimeout from e
     except httpx.RequestError as e:
+        if trips_circuit(e):
+            await asyncio.to_thread(record_failure, server)
         raise APIException(
             detail=f"Error connecting to upstream ERDDAP server: {type(e).__name__}.",
         ) from e
 
+    if response.status_code in CIRCUIT_STATUS_CODES:
+        await asyncio.to_thread(record_failure, server)
+    else:
+        await asyncio.to_thread(record_success, server)
+
     # Cache small responses, stream large ones
     content_length = int(response.headers.get("content-length", 0))
     if content_length < settings.PROXY_STREAM_THRESHOLD_BYTES:
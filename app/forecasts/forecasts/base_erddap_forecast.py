@@ -1,13 +1,16 @@
 import os
 from datetime import datetime
+from io import BytesIO
 from json import JSONDecodeError
 
 # from memoize import memoize
 import pandas as pd
-import requests
 import sentry_sdk
 from erddapy import ERDDAP
 
+from deployments.utils.circuit_breaker import circuit_breaker, raise_for_circuit_status
+from deployments.utils.http_clients import server_client
+from deployments.utils.rate_limit import take_request_slot
 from forecasts.forecasts.base_forecast import BaseForecast
 from forecasts.utils import erddap as erddap_utils
 
@@ -99,7 +102,10 @@ class BaseERDDAPForecast(BaseForecast):
         sentry_sdk.set_tag("forecast_dataset_id", self.dataset)
         url = self.dataset_url(lat, lon)
         timeout = float(os.environ.get("RETRIEVE_FORECAST_TIMEOUT_SECONDS", 60))  # noqa: PLW1508
-        response = requests.get(url, timeout=timeout)
+        with circuit_breaker(self.server):
+            take_request_slot(self.server)
+            response = server_client(self.server).get(url, timeout=timeout)
+            raise_for_circuit_status(response)
         try:
             return response.json()["table"]
         except JSONDecodeError as e:
@@ -120,7 +126,12 @@ class BaseERDDAPForecast(BaseForecast):
 
         info_csv_url = conn.get_info_url(response="csv")
 
-        return pd.read_csv(info_csv_url)
+        with circuit_breaker(self.server):
+            take_request_slot(self.server)
+            response = server_client(self.server).get(info_csv_url)
+            response.raise_for_status()
+
+        return pd.read_csv(BytesIO(response.content))
 
     def dataset_url(self, lat: float, lon: float) -> str:
         """Return the full url of the dataset with query string for a given latitude and longitude.
@@ -1,5 +1,10 @@
+from http import HTTPStatus
+from unittest.mock import patch
+
 from deployments.tests.vcr import my_vcr
+from deployments.utils.rate_limit import RequestSlotUnavailable
 from forecasts.forecasts import forecast_list
+from forecasts.forecasts.base_erddap_forecast import BaseERDDAPForecast
 
 
 @my_vcr.use_cassette("test_forecasts_api.yaml")
@@ -24,3 +29,14 @@ def test_forecasts_api(client):
             assert key in response.data
 
         assert "Z" in response.json()["time_series"][0]["time"]
+
+
+@patch("forecasts.forecasts.base_erddap_forecast.take_request_slot")
+def test_rate_limited_forecast_does_not_wait(take_request_slot, client):
+    forecast = next(forecast for forecast in forecast_list if isinstance(forecast, BaseERDDAPForecast))
+    take_request_slot.side_effect = RequestSlotUnavailable(forecast.server, 2.5)
+
+    response = client.get(f"/api/forecasts/{forecast.slug}/?lat=43.7148&lon=-69.3578")
+
+    assert response.status_code == HTTPStatus.SERVICE_UNAVAILABLE
+    assert response["Retry-After"] == "3"
@@ -1,19 +1,76 @@
 """Viewset for displaying forecasts, and fetching point forecast data is lat,lon are specified"""
 
 import logging
-from datetime import UTC
+import math
+from datetime import UTC, datetime
 from json import JSONDecodeError
 
+import httpx
 from rest_framework import viewsets
 from rest_framework.exceptions import APIException, NotFound
 from rest_framework.response import Response
 
+from deployments.utils.circuit_breaker import CircuitOpenError, CircuitStatusError
+from deployments.utils.rate_limit import RequestSlotUnavailable
 from forecasts.forecasts import forecast_list
+from forecasts.forecasts.base_forecast import BaseForecast
 from forecasts.serializers import ForecastSerializer
 
 logger = logging.getLogger(__name__)
 
 
+class ForecastRateLimited(APIException):
+    status_code = 503
+    default_detail = "Requests to the upstream forecast source are limited, try again shortly."
+    default_code = "forecast_rate_limited"
+
+    def __init__(self, wait: float, detail=None):
+        super().__init__(detail)
+        # Sent as the Retry-After header
+        self.wait = math.ceil(wait)
+
+
+def point_forecast(forecast: BaseForecast, lat: float, lon: float) -> list[tuple[datetime, float]]:
+    """Retrieve a point forecast, raising API errors for problems with the upstream source"""
+    try:
+        return forecast.point_forecast(lat, lon)
+    except JSONDecodeError as error:
+        logger.error(
+            f"Error retrieving dataset due to a JSON decode error: {error}",
+            exc_info=True,
+        )
+        raise APIException(
+            detail=f"Error retrieving dataset for forecast slug: {forecast.slug}",
+        ) from None
+    except RequestSlotUnavailable as error:
+        logger.info(f"Not waiting for upstream forecast source: {error}")
+        raise ForecastRateLimited(error.wait_seconds) from None
+    except (CircuitOpenError, CircuitStatusError) as error:
+        logger.info(f"Upstream forecast source unavailable: {error}")
+        raise APIException(
+            detail=f"Upstream forecast source is unavailable for forecast: {forecast.slug}",
+        ) from None
+    except httpx.TimeoutException as error:
+        logger.info(f"Upstream forecast timed out: {error}")
+        raise APIException(
+            detail=f"Upstream forecast source timed out for forecast: {forecast.slug}",
+        ) from None
+    except (ConnectionError, httpx.TransportError) as error:
+        if "Connection timed out" in str(error):
+            logger.info(f"Upstream forecast timed out: {error}")
+            raise APIException(
+                detail=f"Upstream forecast source timed out for forecast: {forecast.slug}",
+            ) from None
+
+        logger.error(
+            f"ConnectionError (probably a timeout): {error}",
+            exc_info=True,
+        )
+        raise APIException(
+            detail=f"Error retrieving dataset for forecast slug: {forecast.slug}",
+        ) from None
+
+
 class ForecastViewSet(viewsets.ViewSet):
     """A viewset for forecasts"""
 
@@ -46,31 +103,7 @@ class ForecastViewSet(viewsets.ViewSet):
             data["longitude"] = "`lon` parameter not specified"
 
         if "lat" in request.query_params and "lon" in request.query_params:
-            try:
-                time_series = forecast.point_forecast(lat, lon)
-            except JSONDecodeError as error:
-                logger.error(
-                    f"Error retrieving dataset due to a JSON decode error: {error}",
-                    exc_info=True,
-                )
-                raise APIException(
-                    detail=f"Error retrieving dataset for forecast slug: {pk}",
-                ) from None
-            except ConnectionError as error:
-                if "Connection timed out" in str(error):
-                    logger.info(f"Upstream forecast timed out: {error}")
-                    raise APIException(
-                        detail=f"Upstream forecast source timed out for forecast: {pk}",
-                    ) from None
-
-                logger.error(
-                    f"ConnectionError (probably a timeout): {error}",
-                    exc_info=True,
-                )
-                raise APIException(
-                    detail=f"Error retrieving dataset for forecast slug: {pk}",
-                ) from None
-
+            time_series = point_forecast(forecast, lat, lon)
             data["time_series"] = [
                 {"time": time.replace(tzinfo=UTC), "reading": reading} for time, reading in time_series
             ]